@@ -9,6 +9,7 @@
 import arcpy
 import os
 from arcpy import env
+from gbif_manifest import ProcessingManifest
 Default_Geodatabase = arcpy.GetParameterAsText(0)
 env.workspace = Default_Geodatabase
 env.overwriteOutput = True
@@ -36,6 +37,10 @@ def GBIF_conversion(Default_Geodatabase, Incident_Folder,clip_Feature="",project
             continue
         else:
             continue
+    # The manifest keeps track of which csv files were already converted, projected and clipped so only new or changed
+    # files are processed again
+    manifest = ProcessingManifest(os.path.join(Incident_Folder, "GBIF_manifest.json"))
+    feature_sources = {}
     # Autoconvert GBIF Data from csv
     for file in GBIF_table:
         test_hyphen = file.find("-")
@@ -43,53 +48,67 @@ def GBIF_conversion(Default_Geodatabase, Incident_Folder,clip_Feature="",project
             base_name = os.path.basename(file)
             new_feature_name = base_name
             rename_gdb = f"{new_feature_name[:-4]}_XY"
-            print(file)
-            print(base_name)
-            print(f"Regular path: {rename_gdb}")
-            print(f"Geodatabase path: {rename_gdb}")
-            arcpy.management.XYTableToPoint(file, rename_gdb, "decimalLongitude",
-                                            "decimalLatitude")
         else:
             base_name = os.path.basename(file)
             new_feature_name = base_name.replace('-', '')
             rename_gdb = f"{new_feature_name[:-4]}_XY"
-            print(file)
-            print(base_name)
-            print(f"Regular path: {rename_gdb}")
-            print(f"Geodatabase path: {rename_gdb}")
-            arcpy.management.XYTableToPoint(file, rename_gdb, "decimalLongitude",
-                                            "decimalLatitude")
-    print(
-        f"{rename_gdb} has been converted from a csv to a feature and is stored in the {Default_Geodatabase} folder.")
+        feature_sources[rename_gdb] = file
+        if manifest.is_current(file, "convert", output_exists=arcpy.Exists):
+            print(f"{base_name} hasn't changed since it was converted to {rename_gdb} and was skipped.")
+            continue
+        print(file)
+        print(base_name)
+        print(f"Regular path: {rename_gdb}")
+        print(f"Geodatabase path: {rename_gdb}")
+        arcpy.management.XYTableToPoint(file, rename_gdb, "decimalLongitude",
+                                        "decimalLatitude")
+        manifest.record(file, "convert", [os.path.join(Default_Geodatabase, rename_gdb)])
+        print(
+            f"{rename_gdb} has been converted from a csv to a feature and is stored in the {Default_Geodatabase} folder.")
     # Elif statements are to prevent duplicating geoprocessing operations
+    # The projection and clip extent are the same for every feature so they are only described once
+    feature_projection = arcpy.Describe(projection).spatialReference.name
+    clip_extent = arcpy.Describe(clip_Feature).extent if clip_Feature != "" else None
     for feature in arcpy.ListFeatureClasses("*_XY"):
-        features_extent = arcpy.Describe(feature).extent
-        spatial_ref = arcpy.Describe(feature).spatialReference.name
+        source_file = feature_sources.get(feature)  # None for features that didn't come from Incident_Folder
+        step_parameters = {"projection": feature_projection, "clip_Feature": clip_Feature}
+        if source_file is not None and manifest.is_current(source_file, "project_clip", step_parameters,
+                                                           output_exists=arcpy.Exists):
+            print(f"{feature} hasn't changed since it was last projected and clipped and was skipped.")
+            continue
+        step_outputs = []
+        feature_description = arcpy.Describe(feature)
+        features_extent = feature_description.extent
+        spatial_ref = feature_description.spatialReference.name
         clipped_features = f"{feature}_clipped"
-        feature_projection = arcpy.Describe(projection).spatialReference.name
         project_feature = f"{feature}_projected"
         if feature_projection == spatial_ref:
             clipped_features = feature
         else:
             arcpy.management.Project(feature, project_feature, projection,
                                      preserve_shape="PRESERVE_SHAPE")  # Later make coord user input, using a feature
+            step_outputs.append(os.path.join(Default_Geodatabase, project_feature))
         if clip_Feature == "":
             project_feature = project_feature  # Allows reprojection of feature without clipping
-        elif features_extent == arcpy.Describe(clip_Feature).extent:
+        elif features_extent == clip_extent:
             project_feature = feature
             print(f"{clipped_features} is already in selected extent and has been skipped")
         else:
             arcpy.analysis.Clip(project_feature, clip_Feature, clipped_features)
+            step_outputs.append(os.path.join(Default_Geodatabase, clipped_features))
+        if source_file is not None:
+            manifest.record(source_file, "project_clip", step_outputs, step_parameters)
     print(GBIF_table)
     print(GBIF_Geodatabase)
 GBIF_conversion(Default_Geodatabase, Incident_Folder, clip_Feature=clip_Feature_class,projection=projection)
 def feature_proj_clip(Default_Geodatabase,projection,clip_Feature=""):
 #Reoccuring variables
+    feature_projection = arcpy.Describe(projection).spatialReference.name
     for feature in arcpy.ListFeatureClasses():
-        features_extent = arcpy.Describe(feature).extent
-        spatial_ref = arcpy.Describe(feature).spatialReference.name
+        feature_description = arcpy.Describe(feature)
+        features_extent = feature_description.extent
+        spatial_ref = feature_description.spatialReference.name
         clipped_features = f"{feature}_clipped"
-        feature_projection = arcpy.Describe(projection).spatialReference.name
         project_feature = f"{feature}_projected"
         clip_Feature = ""
         if feature_projection == spatial_ref:
@@ -108,6 +127,9 @@ def feature_proj_clip(Default_Geodatabase,projection,clip_Feature=""):
             arcpy.analysis.Clip(project_feature, clip_Feature, clipped_features)
     feature_proj_clip(Default_Geodatabase,projection=projection,clip_Feature=clip_Feature_class)
 def incident_union_poly(Default_Geodatabase,area_Interest, overlap_area=""):
+    # Not covered by the GBIF manifest: the Near, Union and SpatialJoin outputs also depend on area_Interest and
+    # overlap_area, which are geodatabase layers that can't be fingerprinted like the csv files, so they are rebuilt on
+    # every run
     import arcpy
     from arcpy import env
     #Common variables that will be replaced with user input.
@@ -119,13 +141,23 @@ def incident_union_poly(Default_Geodatabase,area_Interest, overlap_area=""):
     Union_incident = []
     outFeature = ""
     incident_points =[]
+    # near_area is projected once per run for each spatial reference used by the point layers, overwriting any copy
+    # left from an earlier run since area_Interest may have changed, and the copy is shared by every point layer in that
+    # spatial reference. Custom references have a factoryCode of 0, so their copies are numbered instead.
+    near_area_reference = arcpy.Describe(near_area).spatialReference.name
+    near_area_projections = {near_area_reference: near_area}
     for point in arcpy.ListFeatureClasses(feature_type="Point"):
-        if arcpy.Describe(near_area).spatialReference.name != arcpy.Describe(point).spatialReference.name:
-            arcpy.management.Project(near_area, near_area + "_projected", point)
-            print(f"The projection of the point layer,{near_area}, and the interest layer, {point} do not match, and the conflicting layer was converted to {projection}.")
-            print(f"Features name {near_area}: Projection {arcpy.Describe(near_area).spatialReference.name}.")
-            print(f"Features name {point}: Projection {arcpy.Describe(point).spatialReference.name}.")
-            arcpy.analysis.Near(point, near_area)
+        point_reference = arcpy.Describe(point).spatialReference
+        if near_area_reference != point_reference.name:
+            if point_reference.name not in near_area_projections:
+                projection_id = point_reference.factoryCode or f"custom{len(near_area_projections)}"
+                near_area_projected = f"{near_area}_projected_{projection_id}"
+                arcpy.management.Project(near_area, near_area_projected, point_reference)
+                print(f"The projection of the point layer,{near_area}, and the interest layer, {point} do not match, and the conflicting layer was converted to {point_reference.name}.")
+                near_area_projections[point_reference.name] = near_area_projected
+            print(f"Features name {near_area}: Projection {near_area_reference}.")
+            print(f"Features name {point}: Projection {point_reference.name}.")
+            arcpy.analysis.Near(point, near_area_projections[point_reference.name])
         else:
             print(f"The wildcard made this {point}")
             arcpy.analysis.Near(point, near_area)
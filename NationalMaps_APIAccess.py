@@ -1,17 +1,38 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import json
+import hashlib
 import folium
 import random
 import geopandas as gpd
 from geopandas import GeoSeries
 from shapely.geometry import Polygon
+import shapely
+import numpy as np
 import pandas as pd
+import download_engine
+from download_ledger import DownloadLedger
+from query_cache import QueryCache
+from local_catalog import LocalCatalog
+import tile_selection
 
 class NationalMAP_API:
     """This class can be used to access the USGS National Maps API.
-    The GUI site is provided here: https://apps.nationalmap.gov/downloader/"""
-    def __init__(self, wgsbbox, data_output_folder, log_output_folder):
+    The GUI site is provided here: https://apps.nationalmap.gov/downloader/
+    With query_cache=True, query results are kept in a SQLite cache in log_output_folder for cache_ttl_seconds and
+    repeat queries are answered from it instead of the API. The cache is off by default. offline=True answers queries
+    only from the cache, including expired results."""
+    def __init__(self,
+                 wgsbbox,
+                 data_output_folder,
+                 log_output_folder,
+                 max_workers=8,
+                 query_cache=False,
+                 cache_ttl_seconds=86400,
+                 cache_max_bytes=268435456,
+                 offline=False):
         self.website = r"https://tnmaccess.nationalmap.gov/api/v1/"
         self.output_folder = data_output_folder
         self.bbox = wgsbbox
@@ -22,6 +43,26 @@ class NationalMAP_API:
         self.dataset_name = None
         self.json_result = None
         self.log_output_folder = log_output_folder
+        self.query_url = None
+        self.query_key = None
+        self.offline = offline #Only use results that were cached by earlier queries
+        self.page_size = 200 #Largest number of entries the API returns for a single page
+        self.max_workers = max_workers #Number of requests that are allowed to run at the same time
+        self.session = self._pooled_session()
+        ledger_path = os.path.join(log_output_folder, "downloads_ledger.jsonl")
+        json_log_path = os.path.join(log_output_folder, "downloads_logs.json") #Log kept before the ledger
+        first_ledger = not os.path.exists(ledger_path)
+        self.ledger = DownloadLedger(ledger_path)
+        if first_ledger and os.path.exists(json_log_path):
+            imported = self.ledger.import_json_log(json_log_path, data_output_folder)
+            print(f"Imported {imported} downloads from {json_log_path} into the download ledger.")
+        self.catalog = LocalCatalog(os.path.join(log_output_folder, "local_catalog.sqlite"))
+        if query_cache or offline: #Results are only cached on disk when asked for, since cached results can be stale
+            self.cache = QueryCache(os.path.join(log_output_folder, "query_cache.sqlite"),
+                                    ttl_seconds=cache_ttl_seconds,
+                                    max_bytes=cache_max_bytes)
+        else:
+            self.cache = None
 
     def search_dataset(self,
                        dataset_name,
@@ -29,9 +70,33 @@ class NationalMAP_API:
                        dataset_end_year = 2023,
                        data_type = "Publication",
                        download_data = False,
-                       override_confirmation=False):
+                       override_confirmation=False,
+                       use_cache=True,
+                       tile_selection_order=None,
+                       bbox_grid=None,
+                       skip_downloaded=False):
         """This method uses a dataset name and year provided by the user to identify and store entries that match
-        the user's query."""
+        the user's query. When the object was made with query_cache=True, results for a query that was made recently are
+        loaded from the query cache instead of the API unless use_cache is False. When tile_selection_order is "newest" or "smallest", only the entries chosen by
+        select_tiles are kept. A (columns, rows) bbox_grid splits a large extent into smaller queries that are run
+        concurrently. skip_downloaded leaves out entries that the local catalog already has on disk."""
+        full_dataset = self._query_url(dataset_name, dataset_start_year, dataset_end_year, data_type)
+        if full_dataset is not None:
+            api_query_results = self._cached_results(full_dataset, use_cache=use_cache, bbox_grid=bbox_grid)
+            if skip_downloaded:
+                api_query_results = [item for item in api_query_results if not self.catalog.is_on_disk(item)]
+            self.json_result = api_query_results
+            if tile_selection_order is not None:
+                api_query_results = self.select_tiles(order=tile_selection_order)
+            if download_data:
+                self.dataset_download(api_query_results, override_confirmation=override_confirmation)
+                return api_query_results
+            else:
+                return api_query_results
+
+    def _query_url(self, dataset_name, dataset_start_year=1990, dataset_end_year=2023, data_type="Publication"):
+        """Builds the products url for the user's query. Returns None and suggests a dataset when the dataset name is not
+        one of the datasets availible through the API."""
         if dataset_name.find(" ") != -1:
             api_dataset_name = self._spaces_handler(dataset_name)
         else:
@@ -74,14 +139,11 @@ class NationalMAP_API:
             dataset_query = f"datasets={api_dataset_name}"
 
             full_dataset = self.website + "products?" + dataset_query + date_datetype + start + end + bbox
-            api_query_results = self._all_results(full_dataset)
-            self.json_result = api_query_results
-            if download_data:
-                self.dataset_download(api_query_results, override_confirmation=override_confirmation)
-                return api_query_results
-            else:
-                return api_query_results
-
+            self.query_url = full_dataset
+            self.dataset_name = dataset_name
+            self.query_key = QueryCache.query_key(api_dataset_name, data_type, f"{dataset_start_year}-08-01",
+                                                  f"{dataset_end_year}-08-31", self.bbox)
+            return full_dataset
 
         else:
             for i in availible_datasets:
@@ -103,44 +165,178 @@ class NationalMAP_API:
         else:
             return query_text
 
-    def _all_results(self, api_url):
-        """This function returns a list containing all posts that match the query. It does this by iterating through all
-        results that are retrieved by the site."""
-        full_results = []
-        page_max = f"&max=200" #Total number of pages loaded
-        offset_amount = 200 #How many entries to go through when loading a query
-        get_dataset = requests.get(api_url + page_max)
-        contents = get_dataset.json()
-        full_results.append(contents)
-
-        while contents["total"] > offset_amount:
-            get_dataset = requests.get(api_url + page_max + f"&offset={offset_amount}")
-            new_contents = get_dataset.json()
-            full_results.append(new_contents)
-            offset_amount += 200
+    def _pooled_session(self):
+        """Creates a requests session that reuses its connections, so the pages and files requested by the worker threads
+        don't each open a new connection to the API."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=3)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get_page(self, api_url, offset):
+        """Requests a single page of results starting at the offset."""
+        get_dataset = self.session.get(api_url + f"&max={self.page_size}&offset={offset}")
+        get_dataset.raise_for_status()
+        return get_dataset.json()
+
+    def _iter_pages(self, api_url, max_workers=None):
+        """Yields (offset, page) pairs for the query. The first page is loaded on its own to read the total number of
+        entries, then the remaining offsets are loaded concurrently and yielded in the order that they finish."""
+        if max_workers is None:
+            max_workers = self.max_workers
+        first_page = self._get_page(api_url, 0)
+        yield 0, first_page
+        offsets = range(self.page_size, first_page["total"], self.page_size)
+        if len(offsets) == 0:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(offsets)))
+        try:
+            pending_pages = {executor.submit(self._get_page, api_url, offset): offset for offset in offsets}
+            for finished_page in as_completed(pending_pages):
+                yield pending_pages[finished_page], finished_page.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True) # Stops loading pages if the caller stops early
+
+    def iter_results(self,
+                     dataset_name=None,
+                     dataset_start_year=1990,
+                     dataset_end_year=2023,
+                     data_type="Publication"):
+        """Yields the entries that match the query as each page arrives, so entries can be processed before the last page
+        is loaded. Uses the last query made by the object when no dataset name is given. Entries after the first page
+        aren't yielded in the same order as the API lists them."""
+        if dataset_name is not None:
+            api_url = self._query_url(dataset_name, dataset_start_year, dataset_end_year, data_type)
+        else:
+            api_url = self.query_url
+        if api_url is None:
+            raise ValueError("There is no query to load. Provide a dataset name or run search_dataset first.")
+        cached_results = self._cache_lookup()
+        if cached_results is not None:
+            for item in cached_results:
+                yield item
+            return
+        for offset, page in self._iter_pages(api_url):
+            for item in page["items"]:
+                yield item
+
+    def _cache_lookup(self):
+        """Returns the cached results for the last query that was built, or None if it isn't cached. Raises a
+        LookupError in offline mode when the query can't be answered from the cache."""
+        cached_results = None
+        if self.cache is not None:
+            cached_results = self.cache.get(self.query_key, allow_expired=self.offline)
+        if cached_results is None and self.offline:
+            raise LookupError(f"The query, {self.query_url}, isn't in the query cache and the API can't be reached "
+                              f"in offline mode.")
+        return cached_results
+
+    def _cached_results(self, api_url, use_cache=True, bbox_grid=None):
+        """Returns the results for the query from the query cache when possible, and stores the results loaded from the
+        API in the cache."""
+        if use_cache or self.offline:
+            cached_results = self._cache_lookup()
+            if cached_results is not None:
+                return cached_results
+        if bbox_grid is not None:
+            api_query_results = self._split_results(api_url, bbox_grid[0], bbox_grid[1])
+        else:
+            api_query_results = self._all_results(api_url)
+        if self.cache is not None:
+            self.cache.put(self.query_key, api_query_results)
+        return api_query_results
+
+    def _all_results(self, api_url, max_workers=None):
+        """This function returns a list containing all posts that match the query. Pages are loaded concurrently and put
+        back in the order that the site lists them."""
+        full_results = {}
+        for offset, page in self._iter_pages(api_url, max_workers=max_workers):
+            full_results[offset] = page["items"]
 
         full_list = []
-        for page in full_results:
-
-            for item in page["items"]:
-                full_list.append(item)
+        for offset in sorted(full_results):
+            full_list.extend(full_results.pop(offset))
 
         return full_list #Returns the list of dictionaries that contain the data entries
-    def _log_downloads(self, dict_item):
-        """Creates a log for which files were downloaded through the API."""
-        log_file = os.path.join(self.log_output_folder, "downloads_logs.json")
-        if not os.path.exists(log_file):
-            with open(log_file, "w") as f:
-                json.dump([], f)
-        with open(log_file, "r") as f:
-            log = json.load(f)
-            log.append(dict_item)
-            with open(log_file, "w") as f:
-                json.dump(log, f, indent=4)
-
-
-    def dataset_download(self, api_query, override_confirmation = False):
-        """Combines all the functions to preview the total size for the data as well as begin the dota download."""
+
+    def _split_bbox(self, columns, rows):
+        """Divides the user's extent into a grid of smaller extents, listed row by row from the lower left corner."""
+        # 0 = xmin | 1 = ymin | 2 = xmax | 3 = ymax
+        cell_width = (self.bbox[2] - self.bbox[0]) / columns
+        cell_height = (self.bbox[3] - self.bbox[1]) / rows
+        sub_bboxes = []
+        for row in range(rows):
+            for column in range(columns):
+                sub_bboxes.append([self.bbox[0] + column * cell_width,
+                                   self.bbox[1] + row * cell_height,
+                                   self.bbox[2] if column == columns - 1 else self.bbox[0] + (column + 1) * cell_width,
+                                   self.bbox[3] if row == rows - 1 else self.bbox[1] + (row + 1) * cell_height])
+        return sub_bboxes
+
+    def _split_results(self, api_url, columns, rows, retries=2):
+        """Runs the query as a grid of smaller extents at the same time and merges the results. Entries that are found
+        by more than one extent are only kept once. Extents whose query failed are retried on their own, so one failed
+        request doesn't restart the whole query. Returns the same list of dictionaries as _all_results."""
+        base_url = api_url.rsplit("&bbox=", 1)[0]
+        sub_urls = [base_url + f"&bbox={b[0]},{b[1]},{b[2]},{b[3]}" for b in self._split_bbox(columns, rows)]
+        sub_results = {}
+        failed_urls = sub_urls
+        for attempt in range(retries + 1):
+            retry_urls = []
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(failed_urls))) as executor:
+                # Pages within each extent are loaded one at a time so the extents share the worker limit
+                running_queries = {executor.submit(self._all_results, url, 1): url for url in failed_urls}
+                for finished_query in as_completed(running_queries):
+                    if finished_query.exception() is None:
+                        sub_results[running_queries[finished_query]] = finished_query.result()
+                    else:
+                        retry_urls.append(running_queries[finished_query])
+            failed_urls = retry_urls
+            if len(failed_urls) == 0:
+                break
+            print(f"{len(failed_urls)} of the {len(sub_urls)} extents failed to load and will be retried.")
+        if len(failed_urls) > 0:
+            raise IOError(f"{len(failed_urls)} of the {len(sub_urls)} extents could not be loaded after {retries} "
+                          f"retries: {failed_urls}")
+
+        full_list = []
+        seen_entries = set()
+        for url in sub_urls:
+            for item in sub_results[url]:
+                entry_key = DownloadLedger.entry_key(item)
+                if entry_key not in seen_entries:
+                    seen_entries.add(entry_key)
+                    full_list.append(item)
+        return full_list
+
+    def _log_downloads(self, dict_item, path, size_in_bytes, checksum):
+        """Adds a line to the download ledger for a file that was downloaded through the API and adds its footprint to
+        the local catalog."""
+        self.ledger.record(dict_item, path, size_in_bytes, checksum, state="complete")
+        self.catalog.add(dict_item, path, size_in_bytes, dataset=self.dataset_name)
+
+    def dataset_download(self,
+                         api_query,
+                         override_confirmation = False,
+                         download_workers = 4,
+                         chunk_size = 1048576,
+                         max_bytes_per_second = None,
+                         verify_checksums = False):
+        """Combines all the functions to preview the total size for the data as well as begin the dota download. Files
+        are streamed to disk in chunks by download_workers threads, and partially downloaded files are resumed the next
+        time the download is run. max_bytes_per_second caps the combined download speed. Entries that the download
+        ledger lists as complete, and whose files still match the ledger, are skipped."""
+        queued_downloads = {}
+        for path_to_download, download_url in self._download_paths(api_query).items():
+            if not self.ledger.is_complete(download_url, path_to_download, verify_checksum=verify_checksums):
+                queued_downloads[path_to_download] = download_url
+        if len(queued_downloads) < len(api_query):
+            print(f"{len(api_query) - len(queued_downloads)} of the {len(api_query)} datasets were already downloaded "
+                  f"and will be skipped.")
+        api_query = list(queued_downloads.values())
+        if len(api_query) == 0:
+            return
         if not override_confirmation:
             file_num, file_size =  self._download_metrics(list_of_dictionaries=api_query)
             continue_download = input(f"You are about to download {file_num} datasets. The size of this download will be"
@@ -152,25 +348,55 @@ class NationalMAP_API:
         else:
             continue_download = True
         if continue_download:
-            download_progress = 1
-            for download_url in api_query:
-                path_to_download = os.path.join(self.output_folder, os.path.basename(download_url["downloadURL"]))
-                print(f"Now downloading {os.path.basename(download_url['downloadURL'])}. "
-                      f"Size: {int(download_url['sizeInBytes'] * 0.000001)} MB")
-                download_contents = requests.get(download_url["downloadURL"]).content
-                print(f"Files remaining: {download_progress}/ {len(api_query)}")
-                try:
-                    with open(path_to_download, "wb") as f:
-                        f.write(download_contents)
-                    self._log_downloads(download_url)
-                    download_progress += 1
-                except Exception as e:
-                    error_log = os.path.join(self.output_folder, "error_log.txt")
-                    if not os.path.exists(error_log):
-                        with open(error_log, "w"):
-                            pass
-                    with open(error_log, "a") as f:
-                        f.write(f"The download for the entry, {download_url['title']} was not downloaded and was skipped. Here's the download link: {download_url['downloadURL']}.\n")
+            downloads = [(item["downloadURL"], path, item.get("sizeInBytes")) for path, item in queued_downloads.items()]
+            for (url, path, expected_size), result, error in download_engine.download_files(downloads,
+                                                                                    session=self.session,
+                                                                                    workers=download_workers,
+                                                                                    chunk_size=chunk_size,
+                                                                                    max_bytes_per_second=max_bytes_per_second):
+                if error is None:
+                    self._log_downloads(queued_downloads[path], path, *result)
+                else:
+                    self._log_failed_download(queued_downloads[path], error, path)
+
+    def _download_paths(self, api_query):
+        """Returns a dictionary of the path each entry is downloaded to, with entries listed more than once kept once.
+        Files are named after their downloadURL, and when entries from different folders share a file name, those
+        entries are named with their sourceId in front so one download can't overwrite another."""
+        unique_entries = {}
+        for download_url in api_query:
+            unique_entries.setdefault(DownloadLedger.entry_key(download_url), download_url)
+        file_names = [os.path.basename(download_url["downloadURL"]) for download_url in unique_entries.values()]
+        download_paths = {}
+        for (entry_key, download_url), file_name in zip(unique_entries.items(), file_names):
+            if file_names.count(file_name) > 1:
+                file_name = f"{download_url.get('sourceId') or hashlib.sha256(entry_key.encode()).hexdigest()[:12]}_" \
+                            f"{file_name}"
+            download_paths[os.path.join(self.output_folder, file_name)] = download_url
+        return download_paths
+
+    def _log_failed_download(self, download_url, error, path):
+        """Records a download that failed so it can be retried later."""
+        self.ledger.record(download_url, path, state="failed", error=error)
+        error_log = os.path.join(self.output_folder, "error_log.txt")
+        with open(error_log, "a") as f:
+            f.write(f"The download for the entry, {download_url['title']} was not downloaded and was skipped. Here's the download link: {download_url['downloadURL']}. Error: {error}\n")
+
+    def select_tiles(self, order="newest", area_of_interest=None, min_new_area=0.001):
+        """Narrows the query results down to a small set of entries that covers the user's extent, or a shapely polygon
+        in WGS84 given as area_of_interest. Prints the coverage and the bytes saved, then stores and returns the chosen
+        entries so they can be previewed or passed to dataset_download."""
+        if area_of_interest is None:
+            area_of_interest = Polygon([[self.bbox[0], self.bbox[1]], [self.bbox[2], self.bbox[1]],
+                                        [self.bbox[2], self.bbox[3]], [self.bbox[0], self.bbox[3]]])
+        selected, report = tile_selection.select_tiles(self.json_result, area_of_interest, order=order,
+                                                       min_new_area=min_new_area)
+        print(f"{report['Entries Selected']} of the {report['Entries Found']} datasets were selected "
+              f"({report['Entries Intersecting']} intersect the area). They cover {report['Coverage Percent']:.1f}% "
+              f"of the area. Download size: {int(report['Selected Bytes'] * 0.000001)} MB, saving "
+              f"{int(report['Bytes Saved'] * 0.000001)} MB.")
+        self.json_result = selected
+        return selected
                    
     def _download_metrics(self, list_of_dictionaries):
         """Provides the total size of all the downloads that match the query and returns the number of files and the amount of
@@ -183,10 +409,12 @@ class NationalMAP_API:
         total_size_in_MB = total_size * 0.000001
         return total_downloads, total_size_in_MB
 
-    def preview_query(self, save_preview_as_geojson = False):
+    def preview_query(self, save_preview_as_geojson = False, output_path = "test_map.html", dissolve_above = 5000):
         """This method provides a preview of the area that lidar will be downloaded for in a folium map, along with the
         option to store the preview's geometry, along with its associated attributes, to a geojson file. Uses query made
-        by object"""
+        by object. Each publication date becomes one GeoJSON layer whose popups are read from the feature properties.
+        When there are more than dissolve_above results, the footprints for each date are dissolved into a single
+        feature so the saved map stays small."""
 
         user_extent = [ #Extent chosen by user
             [self.bbox[1], self.bbox[0]],
@@ -199,62 +427,57 @@ class NationalMAP_API:
 
         preview_map = folium.Map([self.bbox[3], self.bbox[0]], zoom_start=12)
         def user_extent_preview():
-            user_extent_polygon = folium.vector_layers.Rectangle(user_extent, **{"color": "red"})
+            user_extent_polygon = folium.vector_layers.Rectangle([user_extent[0], user_extent[2]], **{"color": "red"})
             user_defined_group =folium.map.FeatureGroup(name="User Defined Extent", control=True) # Create folium Layergroup to toggle
             user_extent_polygon.add_to(user_defined_group)
             user_defined_group.add_to(preview_map)
 
-
-        unique_publications = []
-        for query in self.json_result: #Grab unique publications to group the polygons by
-            publication_date = query["publicationDate"]
-            unique_publications.append(publication_date)
-        unique_publications = list(set(unique_publications))
-
-        unique_pubDicts = []
-        for unique_date in unique_publications: #Grab unique publications to group the polygons by
-            date_query_dict = {"Unique Date": unique_date, "Matching Query": [], "Extent": []}
-            for query in self.json_result:
-                if unique_date == query["publicationDate"]:
-                    query_extent = [
-                        [query["boundingBox"]["minY"], query["boundingBox"]["minX"]],
-                        [query["boundingBox"]["minY"], query["boundingBox"]["maxX"]],
-                        [query["boundingBox"]["maxY"], query["boundingBox"]["maxX"]],
-                        [query["boundingBox"]["maxY"], query["boundingBox"]["minX"]],
-                        [query["boundingBox"]["minY"], query["boundingBox"]["minX"]]
-                    ]
-                    date_query_dict["Extent"].append(query_extent)
-                    date_query_dict["Matching Query"].append(query)
-            unique_pubDicts.append(date_query_dict)
-
-        # Generate Folium group using dictionary
-        for dictionary in unique_pubDicts:
-            year = dictionary["Unique Date"]
-            group_year = folium.map.FeatureGroup(name=year,
-                                                 control=True)  # Create folium Layergroup to toggle
-            def random_color():
-                # code excerpt from geeksforgeeks Create random hex color
-                color_options = ["green", "blue", "yellow", "orange", "purple", "grey", "black", "white"]
-                color = random.choice(color_options)
-                return color
-            color = random_color()
-            for extent, metadata in zip(dictionary["Extent"], dictionary["Matching Query"]):
-
-                title = metadata["title"]
-                actual_metadata = metadata["metaUrl"]
-                data_download = metadata["downloadURL"]
-
-
-                html = f"<p><b>Collection Name:</b>{title}</p><p><b>Data Source:</b>{data_download}</p><p><b>Metadata:</b>{actual_metadata}</p>"
-                popup = folium.map.Popup(html=html, parse_html=False)
-
-                result_rectangle = folium.vector_layers.Rectangle(extent, **{"color":color}, popup=popup)
-                result_rectangle.add_to(group_year)
-                group_year.add_to(preview_map)
+        unique_pubDicts = {}
+        for query in self.json_result: #Group the polygons by publication date in a single pass
+            bounding_box = query["boundingBox"]
+            feature = {"type": "Feature",
+                       "geometry": {"type": "Polygon",
+                                    "coordinates": [[[round(bounding_box["minX"], 6), round(bounding_box["minY"], 6)],
+                                                     [round(bounding_box["minX"], 6), round(bounding_box["maxY"], 6)],
+                                                     [round(bounding_box["maxX"], 6), round(bounding_box["maxY"], 6)],
+                                                     [round(bounding_box["maxX"], 6), round(bounding_box["minY"], 6)],
+                                                     [round(bounding_box["minX"], 6), round(bounding_box["minY"], 6)]]]},
+                       "properties": {"Collection Name": query["title"],
+                                      "Data Source": query["downloadURL"],
+                                      "Metadata": query["metaUrl"]}}
+            unique_pubDicts.setdefault(query["publicationDate"], []).append(feature)
+
+        dissolve_features = len(self.json_result) > dissolve_above
+        color_options = ["green", "blue", "yellow", "orange", "purple", "grey", "black", "white"]
+        all_features = []
+        for year, features in unique_pubDicts.items():
+            if dissolve_features:
+                dissolved_extent = shapely.union_all([shapely.geometry.shape(f["geometry"]) for f in features])
+                features = [{"type": "Feature",
+                             "geometry": shapely.geometry.mapping(dissolved_extent),
+                             "properties": {"Publication Date": year, "Datasets": len(features)}}]
+                popup_fields = ["Publication Date", "Datasets"]
+            else:
+                popup_fields = ["Collection Name", "Data Source", "Metadata"]
+            all_features.extend(features)
+            color = random.choice(color_options)
+            folium.GeoJson({"type": "FeatureCollection", "features": features},
+                           name=year,
+                           control=True,  # Create folium Layergroup to toggle
+                           style_function=lambda feature, color=color: {"color": color, "weight": 1},
+                           popup=folium.GeoJsonPopup(fields=popup_fields)).add_to(preview_map)
         user_extent_preview()
         folium.LayerControl().add_to(preview_map)
-        preview_map.save("test_map.html")
-    def _save_preview_to_geodf(self):
+        preview_map.save(output_path)
+        if save_preview_as_geojson:
+            with open(os.path.splitext(output_path)[0] + ".geojson", "w") as f:
+                json.dump({"type": "FeatureCollection", "features": all_features}, f)
+
+    def _save_preview_to_geodf(self, output_path=None, categorical_dates=True):
+        """Builds a GeoDataFrame of the query results from their bounding boxes, along with a GeoSeries of the user's
+        extent. The bounding boxes are read into arrays and turned into polygons in a single shapely call. Date columns
+        are stored as categories and text columns as Arrow strings when pyarrow is installed. When output_path ends in
+        .parquet or .gpkg, the frame is written to that file and the path is returned in place of the frame."""
         user_extent = [  # Extent chosen by user
             [self.bbox[0], self.bbox[1]],
             [self.bbox[2], self.bbox[1]],
@@ -263,47 +486,44 @@ class NationalMAP_API:
             [self.bbox[0], self.bbox[1]]
         ]
         user_polygon = Polygon(user_extent)
-        feature_polygons = []
+        bbox_fields = ("minX", "minY", "maxX", "maxY")
+        bounding_boxes = np.fromiter((query["boundingBox"][field] for query in self.json_result for field in bbox_fields),
+                                     dtype=np.float64, count=len(self.json_result) * 4).reshape(-1, 4)
+        feature_polygons = shapely.box(bounding_boxes[:, 0], bounding_boxes[:, 1],
+                                       bounding_boxes[:, 2], bounding_boxes[:, 3], ccw=False)
+
+        text_dtype = _text_dtype()
+        date_dtype = "category" if categorical_dates else text_dtype
         original_query = {
-            "Title":[],
-            "Metadata Url": [],
-            "Publication Date":[],
-            "Last Updated":[],
-            "Date Created":[],
-            "Vendor Data Url":[],
-            "Download Url":[],
-            "geometry":[]
-
-
+            "Title": pd.array([query["title"] for query in self.json_result], dtype=text_dtype),
+            "Metadata Url": pd.array([query["metaUrl"] for query in self.json_result], dtype=text_dtype),
+            "Publication Date": pd.Series([query["publicationDate"] for query in self.json_result], dtype=date_dtype),
+            "Last Updated": pd.Series([query["lastUpdated"] for query in self.json_result], dtype=date_dtype),
+            "Date Created": pd.Series([query["dateCreated"] for query in self.json_result], dtype=date_dtype),
         }
-        for query in self.json_result:
-
-            query_extent = [
-                [query["boundingBox"]["minX"], query["boundingBox"]["minY"]],
-                [query["boundingBox"]["minX"], query["boundingBox"]["maxY"]],
-                [query["boundingBox"]["maxX"], query["boundingBox"]["maxY"]],
-                [query["boundingBox"]["maxX"], query["boundingBox"]["minY"]],
-                [query["boundingBox"]["minX"], query["boundingBox"]["minY"]]
-            ]
-
-            original_query["Title"].append(query["title"])
-            original_query["Publication Date"].append(query["publicationDate"])
-            original_query["Last Updated"].append(query["lastUpdated"])
-            original_query["Date Created"].append(query["dateCreated"])
-            original_query["Metadata Url"].append(query["metaUrl"])
-            original_query["Vendor Data Url"].append(query["metaUrl"])
-            original_query["Download Url"].append(query["downloadURL"])
-            original_query["geometry"].append(Polygon(query_extent))
-
-            feature_polygons.append(Polygon(query_extent))
-        
-        gdf = gpd.GeoDataFrame(data=original_query, geometry=original_query["geometry"],crs="EPSG:4326")
-        #    original_query.append(query)
-        # original_query_bbox = zip(original_query, feature_polygons)
-        return gdf, GeoSeries(user_polygon, crs="EPSG:4326")
+        original_query["Vendor Data Url"] = original_query["Metadata Url"]
+        original_query["Download Url"] = pd.array([query["downloadURL"] for query in self.json_result], dtype=text_dtype)
+
+        gdf = gpd.GeoDataFrame(data=original_query, geometry=feature_polygons, crs="EPSG:4326")
+        user_series = GeoSeries(user_polygon, crs="EPSG:4326")
+        if output_path is None:
+            return gdf, user_series
+        if output_path.lower().endswith(".parquet"):
+            gdf.to_parquet(output_path)
+        elif output_path.lower().endswith(".gpkg"):
+            gdf.to_file(output_path, layer="query_results", driver="GPKG")
+        else:
+            raise ValueError(f"The output path, {output_path}, needs to end in .parquet or .gpkg.")
+        return output_path, user_series
 
 
-            
+def _text_dtype():
+    """Uses Arrow backed strings for text columns when pyarrow is installed. pandas raises an ImportError for the
+    pyarrow storage when it isn't."""
+    try:
+        return pd.StringDtype("pyarrow")
+    except ImportError:
+        return pd.StringDtype()
 
 
 if __name__ == "__main__":
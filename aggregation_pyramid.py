@@ -0,0 +1,288 @@
+"""Counts points once into a pyramid of square grid cells so polygons can be summarized without recounting the points.
+Level 0 has cells of cell_size and each level above doubles the cell size. Every level stores counts by cell, year,
+hour and category. A polygon is summarized from the coarsest level down: cells inside the polygon add their counts,
+cells outside it are dropped, and only cells crossing its boundary are split into their children. Points in level 0
+cells that still cross the boundary are tested one by one, so the result matches clipping the points.
+
+The pyramid is saved as a Parquet file of counts per level and a NumPy file of the points sorted by level 0 cell, and
+new points can be added to a saved pyramid.
+
+python aggregation_pyramid.py build crime gbif_pyramid crime_incidents.shp --crs 2274 --cell-size 500 --levels 8
+python aggregation_pyramid.py summarize gbif_pyramid Kudzu_AOI.gpkg --by year hour
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+DIMENSIONS = ("year", "hour", "category")
+
+
+def cell_keys(cell_x, cell_y):
+    """Packs cell columns and rows into one int64 so points and counts can be sorted and searched by cell."""
+    return (np.asarray(cell_x, dtype=np.int64) << 32) | (np.asarray(cell_y, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def split_cell_keys(keys):
+    """Returns the cell columns and rows packed by cell_keys."""
+    keys = np.asarray(keys, dtype=np.int64)
+    return keys >> 32, ((keys & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+
+
+def _ranges(starts, ends):
+    """Concatenates np.arange(start, end) for each pair without a Python loop."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def _insert_sorted(stored, new):
+    """Inserts the new columns into the stored ones, both sorted by cell_key, keeping the result sorted. The stored
+    rows are only copied, not sorted again."""
+    positions = np.searchsorted(stored["cell_key"], new["cell_key"], side="right")
+    return {column: np.insert(stored[column], positions, new[column]) for column in stored}
+
+
+class AggregationPyramid:
+    """A pyramid of point counts by grid cell, year, hour and category. Missing years and hours are stored as -1, and
+    categories are stored as codes into the category_vocabulary list."""
+    def __init__(self, cell_size, levels=8, origin=(0.0, 0.0), crs=None):
+        if int(levels) < 1:
+            raise ValueError(f"The pyramid needs at least 1 level, not {levels}.")
+        self.cell_size = float(cell_size)
+        self.levels = int(levels)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.crs = pyproj.CRS.from_user_input(crs) if crs is not None else None
+        self.category_vocabulary = []
+        self.points = {"x": np.empty(0), "y": np.empty(0), "cell_key": np.empty(0, np.int64),
+                       "year": np.empty(0, np.int16), "hour": np.empty(0, np.int8), "category": np.empty(0, np.int32)}
+        self.counts = [self._empty_counts() for _ in range(self.levels)]  # Sorted by cell_key
+        self._cell_index = {}
+
+    @staticmethod
+    def _empty_counts():
+        return pd.DataFrame({"cell_key": np.empty(0, np.int64),
+                             "year": np.empty(0, np.int16), "hour": np.empty(0, np.int8),
+                             "category": np.empty(0, np.int32), "count": np.empty(0, np.int64)})
+
+    def category_codes(self, categories):
+        """Codes for an array of categories, adding categories that haven't been seen to the vocabulary."""
+        categories = pd.Series(categories, dtype="string").fillna("")
+        known = {category: code for code, category in enumerate(self.category_vocabulary)}
+        for category in categories.unique():
+            if category not in known:
+                known[category] = len(self.category_vocabulary)
+                self.category_vocabulary.append(category)
+        return categories.map(known).to_numpy(dtype=np.int32)
+
+    def add_points(self, x, y, years=None, hours=None, categories=None):
+        """Adds points to every level. x and y are in the pyramid's CRS, and years, hours and categories can be left
+        out when a source doesn't have them. Only the cells the new points fall in are recounted, so adding points takes
+        time in proportion to the new points and the cells they touch rather than to everything already stored."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cell_x = np.floor((x - self.origin[0]) / self.cell_size)
+        cell_y = np.floor((y - self.origin[1]) / self.cell_size)
+        cell_limit = np.iinfo(np.int32)
+        outside = ~(np.isfinite(cell_x) & np.isfinite(cell_y) & (np.abs(cell_x) < cell_limit.max)
+                    & (np.abs(cell_y) < cell_limit.max))
+        if outside.any():
+            raise ValueError(f"{np.count_nonzero(outside):,} points have missing or infinite coordinates, or are too "
+                             f"far from the origin for the cell size. Drop them before adding the points.")
+        cell_x = cell_x.astype(np.int32)
+        cell_y = cell_y.astype(np.int32)
+        new_points = {"x": x, "y": y, "cell_key": cell_keys(cell_x, cell_y),
+                      "year": np.full(len(x), -1, np.int16) if years is None else
+                      pd.to_numeric(pd.Series(years), errors="coerce").fillna(-1).to_numpy(dtype=np.int16),
+                      "hour": np.full(len(x), -1, np.int8) if hours is None else
+                      pd.to_numeric(pd.Series(hours), errors="coerce").fillna(-1).to_numpy(dtype=np.int8),
+                      "category": np.zeros(len(x), np.int32) if categories is None else
+                      self.category_codes(categories)}
+        if categories is None and not self.category_vocabulary:
+            self.category_vocabulary.append("")
+        new_points = pd.DataFrame(new_points)
+        for level in range(self.levels):
+            level_counts = new_points[list(DIMENSIONS)].copy()
+            # A right shift floor divides by 2 ** level, also for negative cells
+            level_counts.insert(0, "cell_key", cell_keys(cell_x >> level, cell_y >> level))
+            level_counts = level_counts.groupby(["cell_key", *DIMENSIONS]).size().rename("count").reset_index()
+            self.counts[level] = self._merge_counts(self.counts[level], level_counts)
+        self._cell_index = {}
+        new_points = new_points.sort_values("cell_key", kind="stable")
+        self.points = _insert_sorted(self.points, {column: new_points[column].to_numpy() for column in self.points})
+
+    @staticmethod
+    def _merge_counts(counts, new_counts):
+        """Adds new_counts to counts, both sorted by cell_key. The stored rows of the cells in new_counts are taken out,
+        added to the new rows, and put back in cell order."""
+        keys = counts["cell_key"].to_numpy()
+        new_cells = np.unique(new_counts["cell_key"].to_numpy())
+        touched = _ranges(np.searchsorted(keys, new_cells, side="left"), np.searchsorted(keys, new_cells, side="right"))
+        merged = pd.concat([counts.iloc[touched], new_counts], ignore_index=True)
+        merged = merged.groupby(["cell_key", *DIMENSIONS], as_index=False)["count"].sum()
+        untouched = np.delete(np.arange(len(counts)), touched)
+        merged = _insert_sorted({column: counts[column].to_numpy()[untouched] for column in counts.columns},
+                                {column: merged[column].to_numpy() for column in counts.columns})
+        return pd.DataFrame(merged)
+
+    def cell_boxes(self, cell_x, cell_y, level):
+        size = self.cell_size * 2 ** level
+        min_x = self.origin[0] + cell_x.astype(np.float64) * size
+        min_y = self.origin[1] + cell_y.astype(np.float64) * size
+        return shapely.box(min_x, min_y, min_x + size, min_y + size)
+
+    def cell_index(self, level):
+        """Returns the cells that have counts at a level and where each cell's rows start and end in counts[level]."""
+        if level not in self._cell_index:
+            level_keys = self.counts[level]["cell_key"].to_numpy()
+            keys, starts = np.unique(level_keys, return_index=True)
+            self._cell_index[level] = keys, starts, np.append(starts[1:], len(level_keys))
+        return self._cell_index[level]
+
+    def summarize(self, polygon, by=("year",)):
+        """Counts the points that intersect polygon, grouped by the dimensions in by. Categories are returned as their
+        names. Returns a DataFrame with the by columns and a count column."""
+        by = list(by)
+        shapely.prepare(polygon)
+        min_x, min_y, max_x, max_y = polygon.bounds
+        parts = []
+        boundary_keys = None  # Cells of the level above that cross the boundary, None above the top level
+        for level in range(self.levels - 1, -1, -1):
+            keys, starts, ends = self.cell_index(level)
+            if boundary_keys is None:
+                size = self.cell_size * 2 ** level
+                cell_x, cell_y = split_cell_keys(keys)
+                found = np.flatnonzero((cell_x >= np.floor((min_x - self.origin[0]) / size))
+                                       & (cell_x <= np.floor((max_x - self.origin[0]) / size))
+                                       & (cell_y >= np.floor((min_y - self.origin[1]) / size))
+                                       & (cell_y <= np.floor((max_y - self.origin[1]) / size)))
+            else:
+                parent_x, parent_y = split_cell_keys(boundary_keys)
+                children = np.concatenate([cell_keys(parent_x * 2 + dx, parent_y * 2 + dy)
+                                           for dx in (0, 1) for dy in (0, 1)])
+                positions = np.searchsorted(keys, children)
+                exists = positions < len(keys)
+                exists[exists] = keys[positions[exists]] == children[exists]
+                found = positions[exists]
+            cell_x, cell_y = split_cell_keys(keys[found])
+            boxes = self.cell_boxes(cell_x, cell_y, level)
+            inside = shapely.contains(polygon, boxes)
+            crossing = ~inside & shapely.intersects(polygon, boxes)
+            covered_rows = _ranges(starts[found[inside]], ends[found[inside]])
+            if len(covered_rows):
+                covered = self.counts[level].iloc[covered_rows]
+                parts.append(covered.groupby(by, sort=False)["count"].sum())
+            boundary_keys = keys[found[crossing]]
+            if len(boundary_keys) == 0:
+                break
+        if len(boundary_keys):
+            # Level 0 cells on the boundary: test their points exactly. Points are sorted by cell so each cell's points
+            # are found with a binary search.
+            points = self.points
+            candidates = _ranges(np.searchsorted(points["cell_key"], boundary_keys, side="left"),
+                                 np.searchsorted(points["cell_key"], boundary_keys, side="right"))
+            hits = candidates[shapely.intersects_xy(polygon, points["x"][candidates], points["y"][candidates])]
+            if len(hits):
+                exact = pd.DataFrame({dimension: points[dimension][hits] for dimension in DIMENSIONS})
+                parts.append(exact.groupby(by, sort=False).size().rename("count"))
+        if not parts:
+            return pd.DataFrame({**{dimension: [] for dimension in by}, "count": np.empty(0, np.int64)})
+        summary = pd.concat(parts).groupby(level=list(range(len(by)))).sum().reset_index()
+        summary.columns = [*by, "count"]
+        if "category" in by:
+            summary["category"] = np.asarray(self.category_vocabulary, dtype=object)[summary["category"].to_numpy()]
+        return summary.sort_values(by, ignore_index=True)
+
+    def save(self, pyramid_folder):
+        """Saves the counts of every level to counts.parquet, the points to points.npz and the settings to
+        pyramid.json. The points are kept so boundary cells can be tested exactly and more points can be added later."""
+        os.makedirs(pyramid_folder, exist_ok=True)
+        pd.concat([counts.assign(level=np.int8(level)) for level, counts in enumerate(self.counts)],
+                  ignore_index=True).to_parquet(os.path.join(pyramid_folder, "counts.parquet"), index=False)
+        np.savez_compressed(os.path.join(pyramid_folder, "points.npz"), **self.points)
+        with open(os.path.join(pyramid_folder, "pyramid.json"), "w") as f:
+            json.dump({"cell_size": self.cell_size, "levels": self.levels, "origin": self.origin,
+                       "crs": self.crs.to_wkt() if self.crs is not None else None,
+                       "category_vocabulary": self.category_vocabulary}, f, indent=4)
+
+    @classmethod
+    def load(cls, pyramid_folder):
+        with open(os.path.join(pyramid_folder, "pyramid.json"), "r") as f:
+            settings = json.load(f)
+        pyramid = cls(settings["cell_size"], settings["levels"], settings["origin"], settings["crs"])
+        pyramid.category_vocabulary = settings["category_vocabulary"]
+        counts = pd.read_parquet(os.path.join(pyramid_folder, "counts.parquet"))
+        for level, level_counts in counts.groupby("level"):
+            pyramid.counts[level] = level_counts.drop(columns="level").reset_index(drop=True)
+        with np.load(os.path.join(pyramid_folder, "points.npz")) as points:
+            pyramid.points = {column: points[column] for column in points.files}
+        return pyramid
+
+
+def read_points(source, points_path, crs):
+    """Reads x, y, years, hours and categories from a GeoParquet layer made by gbif_ingest.py (source "gbif", with
+    species as the category and no hours) or from a Memphis crime incidents layer (source "crime", with the year from
+    date_offen, the hour rounded from time_offen and agency_cri as the category)."""
+    import geopandas as gpd
+    points = gpd.read_parquet(points_path) if points_path.lower().endswith(".parquet") else gpd.read_file(points_path)
+    points = points.to_crs(crs)
+    if source == "gbif":
+        return points.geometry.x.to_numpy(), points.geometry.y.to_numpy(), points["year"], None, points["species"]
+    elif source == "crime":
+        from crime_analysis import parse_years, parse_hours
+        years = parse_years(points["date_offen"])
+        hours = parse_hours(points["time_offen"])
+        return points.geometry.x.to_numpy(), points.geometry.y.to_numpy(), years, hours, points["agency_cri"]
+    raise ValueError(f"The source, {source}, isn't supported. Use 'gbif' or 'crime'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, update and query a pyramid of point counts.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    build_parser = subparsers.add_parser("build", help="Build a pyramid, or add points to an existing one.")
+    build_parser.add_argument("source", choices=["gbif", "crime"])
+    build_parser.add_argument("pyramid_folder")
+    build_parser.add_argument("points")
+    build_parser.add_argument("--crs", default=None, help="Projected CRS for the cells. Required for a new pyramid.")
+    build_parser.add_argument("--cell-size", type=float, default=500, help="Level 0 cell size in CRS units.")
+    build_parser.add_argument("--levels", type=int, default=8)
+    summarize_parser = subparsers.add_parser("summarize", help="Count the points in each polygon of a layer.")
+    summarize_parser.add_argument("pyramid_folder")
+    summarize_parser.add_argument("polygons")
+    summarize_parser.add_argument("--by", nargs="+", choices=DIMENSIONS, default=["year"])
+    summarize_parser.add_argument("--output", default=None, help="CSV to save the summary to.")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    if arguments.mode == "build":
+        if os.path.exists(os.path.join(arguments.pyramid_folder, "pyramid.json")):
+            pyramid = AggregationPyramid.load(arguments.pyramid_folder)
+        elif arguments.crs is None:
+            parser.error("--crs is required when building a new pyramid.")
+        else:
+            pyramid = AggregationPyramid(arguments.cell_size, arguments.levels, crs=arguments.crs)
+        x, y, years, hours, categories = read_points(arguments.source, arguments.points, pyramid.crs)
+        pyramid.add_points(x, y, years, hours, categories)
+        pyramid.save(arguments.pyramid_folder)
+        print(f"Added {len(x):,} points to {arguments.pyramid_folder} in {time.perf_counter() - start:.1f} s. The "
+              f"pyramid has {len(pyramid.points['x']):,} points in {len(pyramid.counts[0]):,} level 0 counts.")
+    else:
+        import geopandas as gpd
+        pyramid = AggregationPyramid.load(arguments.pyramid_folder)
+        polygons = gpd.read_file(arguments.polygons).to_crs(pyramid.crs)
+        summaries = []
+        for polygon_number, polygon in enumerate(polygons.geometry.values):
+            summaries.append(pyramid.summarize(polygon, arguments.by).assign(polygon=polygon_number))
+        summary = pd.concat(summaries, ignore_index=True)
+        print(summary.to_string(index=False))
+        print(f"Summarized {len(polygons):,} polygons in {time.perf_counter() - start:.2f} s.")
+        if arguments.output is not None:
+            summary.to_csv(arguments.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
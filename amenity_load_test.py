@@ -0,0 +1,80 @@
+"""Sends many concurrent queries to a running amenity_service and reports the p50/p99 latency and queries per second.
+
+python amenity_load_test.py --port 8765 --requests 5000 --concurrency 50 --features Pool,Gym
+"""
+import argparse
+import asyncio
+import random
+import time
+import numpy as np
+
+
+async def run_client(host, port, request_count, query_targets, latencies):
+    """Sends requests one after another over a single kept-alive connection and records each request's latency."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(request_count):
+            target = random.choice(query_targets)
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            content_length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                if header.lower().startswith(b"content-length:"):
+                    content_length = int(header.split(b":")[1])
+            await reader.readexactly(content_length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def query_targets(center, spread_degrees, features, k, radius_mi, target_count=1000):
+    targets = []
+    for _ in range(target_count):
+        target = (f"/nearest?lat={center[0] + random.uniform(-spread_degrees, spread_degrees)}"
+                  f"&lon={center[1] + random.uniform(-spread_degrees, spread_degrees)}&k={k}")
+        if features:
+            target += f"&features={features}"
+        if radius_mi is not None:
+            target += f"&radius_mi={radius_mi}"
+        targets.append(target)
+    return targets
+
+
+async def load_test(host, port, request_count, concurrency, targets):
+    latencies = []
+    requests_per_client = [request_count // concurrency + (1 if i < request_count % concurrency else 0)
+                           for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, client_requests, targets, latencies)
+                           for client_requests in requests_per_client if client_requests > 0])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    print(f"{len(latencies)} requests with {concurrency} concurrent clients in {elapsed:.2f} s: "
+          f"{len(latencies) / elapsed:,.0f} queries/s, p50 {np.percentile(latencies, 50):.2f} ms, "
+          f"p99 {np.percentile(latencies, 99):.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running amenity_service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--features", default="", help="Comma separated amenities to ask for.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--radius-mi", type=float, default=None)
+    parser.add_argument("--lat", type=float, default=35.68)
+    parser.add_argument("--lon", type=float, default=-105.94)
+    parser.add_argument("--spread", type=float, default=0.5, help="Degrees around lat/lon to place the users.")
+    arguments = parser.parse_args()
+    targets = query_targets((arguments.lat, arguments.lon), arguments.spread, arguments.features, arguments.k,
+                            arguments.radius_mi)
+    asyncio.run(load_test(arguments.host, arguments.port, arguments.requests, arguments.concurrency, targets))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Runs the amenity finder without input() prompts. The batch mode reads a CSV of users and the amenities that they
+want and writes the matching locations ranked by distance. The service mode answers the same query over HTTP on
+localhost so many users can be served at once.
+
+Batch:   python amenity_service.py batch locations.csv users.csv matches.csv --crs 32113
+Service: python amenity_service.py serve locations.csv --crs 32113 --port 8765
+         GET /nearest?lat=35.64&lon=-106.01&features=Elvis,Avatar&match=any&k=5&radius_mi=10
+"""
+import argparse
+import asyncio
+import csv
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+import pandas as pd
+import find_amenity
+from location_store import LocationStore
+
+
+def load_locations(locations_path, feature_separator=";"):
+    """Loads locations from a CSV with Name, Latitude, Longitude and Features columns, or from a point GeoJSON,
+    GeoPackage or GeoParquet file with Name and Features columns."""
+    if locations_path.lower().endswith(".csv"):
+        return LocationStore.from_csv(locations_path, feature_separator=feature_separator)
+    return LocationStore.from_file(locations_path, feature_separator=feature_separator)
+
+
+def find_matches(amenity_index, user_location, features_of_interest, match="all", k=5, radius_mi=None):
+    """Ranks the locations for one user. Without any features of interest, the nearest locations are returned."""
+    if k is not None and k < 1:
+        raise ValueError(f"k must be positive, but it was {k}.")
+    if len(features_of_interest) == 0:
+        matches = amenity_index.within(user_location, radius_mi) if radius_mi is not None else \
+            amenity_index.nearest(user_location, k=k)
+        return matches[:k] if k is not None else matches
+    return amenity_index.search(user_location, features_of_interest, match=match, radius_mi=radius_mi, k=k)
+
+
+def batch_match(locations_path, users_path, output_path, projected_crs_ESPG, k=5, radius_mi=None, match="all",
+                feature_separator=";"):
+    """Reads a CSV of users with User, Latitude, Longitude and Amenities columns (amenities separated by
+    feature_separator) and writes the ranked matches for every user to output_path."""
+    amenity_index = find_amenity.AmenityIndex(load_locations(locations_path, feature_separator), projected_crs_ESPG)
+    users = pd.read_csv(users_path, dtype={"User": str, "Latitude": float, "Longitude": float, "Amenities": str})
+    users["Amenities"] = users["Amenities"].fillna("")
+    start = time.perf_counter()
+    match_count = 0
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["User", "Rank", "Name", "Distance (mi)", "Latitude", "Longitude", "Features"])
+        for user in users.itertuples(index=False):
+            features_of_interest = [feature for feature in user.Amenities.split(feature_separator) if feature.strip()]
+            matches = find_matches(amenity_index, [user.Latitude, user.Longitude], features_of_interest, match=match,
+                                   k=k, radius_mi=radius_mi)
+            for rank, (location, distance) in enumerate(matches, start=1):
+                latitude, longitude = location["WGS Coordinates"]
+                writer.writerow([user.User, rank, location["Name"], distance, latitude, longitude,
+                                 feature_separator.join(location["Features"])])
+            match_count += len(matches)
+    elapsed = time.perf_counter() - start
+    print(f"Matched {len(users)} users to {match_count} locations in {elapsed:.2f} s "
+          f"({len(users) / max(elapsed, 1e-9):,.0f} users/s). Results were saved to {output_path}.")
+
+
+class AmenityService:
+    """A small asyncio HTTP server for the amenity finder. Each connection is handled by its own coroutine and can send
+    several requests over a kept-alive connection."""
+    def __init__(self, amenity_index, host="127.0.0.1", port=8765):
+        self.amenity_index = amenity_index
+        self.host = host
+        self.port = port
+
+    def handle_query(self, target):
+        url = urlsplit(target)
+        if url.path != "/nearest":
+            return 404, {"error": f"The path, {url.path}, was not found. Use /nearest."}
+        query = parse_qs(url.query)
+        try:
+            user_location = [float(query["lat"][0]), float(query["lon"][0])]
+            features_of_interest = [feature for feature in query.get("features", [""])[0].split(",") if feature.strip()]
+            k = int(query["k"][0]) if "k" in query else 5
+            if k < 1:
+                return 400, {"error": f"k must be positive, but it was {k}."}
+            radius_mi = float(query["radius_mi"][0]) if "radius_mi" in query else None
+            matches = find_matches(self.amenity_index, user_location, features_of_interest,
+                                   match=query.get("match", ["all"])[0], k=k, radius_mi=radius_mi)
+        except (KeyError, ValueError) as e:
+            return 400, {"error": f"The query could not be read: {e}. lat and lon are required."}
+        return 200, {"matches": [{"Name": location["Name"],
+                                  "WGS Coordinates": location["WGS Coordinates"],
+                                  "Features": list(location["Features"]),
+                                  "Distance (mi)": distance} for location, distance in matches]}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:  # Headers are read but only Connection is used
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    if header.lower().startswith(b"connection:") and b"close" in header.lower():
+                        keep_alive = False
+                parts = request_line.decode("latin-1").split()
+                if len(parts) < 2 or parts[0] != "GET":
+                    status, body = 405, {"error": "Only GET requests are supported."}
+                else:
+                    status, body = self.handle_query(parts[1])
+                payload = json.dumps(body).encode("utf-8")
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[status]
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                             + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"Amenity service is running on http://{self.host}:{self.port}/nearest")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find amenities near users without interactive prompts.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    batch_parser = subparsers.add_parser("batch", help="Rank matches for a CSV of users.")
+    batch_parser.add_argument("locations")
+    batch_parser.add_argument("users")
+    batch_parser.add_argument("output")
+    serve_parser = subparsers.add_parser("serve", help="Answer nearest amenity queries over HTTP on localhost.")
+    serve_parser.add_argument("locations")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    for subparser in (batch_parser, serve_parser):
+        subparser.add_argument("--crs", type=int, required=True, help="EPSG code of the projected CRS to measure in.")
+    batch_parser.add_argument("--k", type=int, default=5)
+    batch_parser.add_argument("--radius-mi", type=float, default=None)
+    batch_parser.add_argument("--match", choices=["all", "any"], default="all")
+    arguments = parser.parse_args()
+
+    if arguments.mode == "batch":
+        batch_match(arguments.locations, arguments.users, arguments.output, arguments.crs, k=arguments.k,
+                    radius_mi=arguments.radius_mi, match=arguments.match)
+    else:
+        amenity_index = find_amenity.AmenityIndex(load_locations(arguments.locations), arguments.crs)
+        asyncio.run(AmenityService(amenity_index, arguments.host, arguments.port).serve())
+
+
+if __name__ == "__main__":
+    main()
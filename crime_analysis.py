@@ -0,0 +1,214 @@
+"""Builds the tables from Memphis_Open_Data_Crime_Incidents_42022_Analysis.ipynb without the notebook's loops and
+repeated groupbys. Dates and times are parsed once for every incident, each incident is given a zone (inside the park
+or in the ring out to the 2 mile buffer), and one count cube of year x hour x agency_cri x zone is made in a single
+pass. Every by-year, by-hour and pivot table in the notebook is then a sum over that cube.
+
+python crime_analysis.py crime_incidents.shp TN_City_Boundaries.shp Layer_Products.gdb --park-layer Kudzu_AOI \
+    --boundary-row 199 --excel Memphis_OpenData_Crime_Incidents_Pandas_Analysis.xlsx --benchmark
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import shapely
+
+ZONES = ("park", "two_mi_ring")  # The notebook's two mile tables cover both zones since its buffer includes the park
+TWO_MILES_FT = 10560
+
+
+def _text_array(values):
+    return pa.array(pd.Series(values, dtype=object).where(pd.notna(values), None), type=pa.string())
+
+
+def parse_years(date_offen):
+    """The year of each date_offen string as int16, read from its first four characters like the notebook. Dates that
+    can't be read are -1."""
+    years = pc.utf8_slice_codeunits(_text_array(date_offen), 0, 4)
+    years = pc.if_else(pc.match_substring_regex(years, r"^\d{4}$"), years, None)
+    return pc.fill_null(pc.cast(years, pa.int16()), -1).to_numpy(zero_copy_only=False)
+
+
+def parse_hours(time_offen):
+    """The hour of each time_offen rounded to the nearest hour, like pd.to_datetime(time_offen).dt.round("H").dt.hour,
+    as int8. HH:MM and HH:MM:SS times are read directly, other formats fall back to pd.to_datetime, and times that
+    can't be read are -1."""
+    times = _text_array(time_offen)
+    parts = pc.extract_regex(times, r"^\s*(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}(?:\.\d+)?))?\s*$")
+    hour, minute, second = [pc.cast(pc.if_else(pc.equal(pc.struct_field(parts, [field]), ""), None,
+                                               pc.struct_field(parts, [field])), pa.float64()) for field in range(3)]
+    seconds = pc.add(pc.add(pc.multiply(hour, 3600), pc.multiply(minute, 60)), pc.fill_null(second, 0))
+    seconds = seconds.to_numpy(zero_copy_only=False).astype(np.float64)  # Nulls become NaN
+    unparsed = np.isnan(seconds) & pc.is_valid(times).to_numpy(zero_copy_only=False)
+    if unparsed.any():
+        other_times = pd.to_datetime(pd.Series(times.to_pandas()[unparsed]), errors="coerce", format="mixed")
+        seconds[unparsed] = (other_times.dt.hour * 3600 + other_times.dt.minute * 60 + other_times.dt.second
+                             ).to_numpy(dtype=np.float64, na_value=np.nan)
+    # np.round rounds halves to even, the same as pandas' round("H")
+    hours = np.round(seconds / 3600) % 24
+    return np.where(np.isnan(hours), -1, hours).astype(np.int8)
+
+
+def assign_zones(points, park, buffer_ft=TWO_MILES_FT, buffer_resolution=16):
+    """Zone codes for an array of shapely points: 0 inside park, 1 inside the park's buffer (made the same way as the
+    notebook's mlk_park.buffer(10560, resolution=16)) but not the park, and -1 outside both."""
+    park = shapely.union_all(np.asarray(park))
+    park_buffer = shapely.buffer(park, buffer_ft, quad_segs=buffer_resolution)
+    shapely.prepare(park)
+    shapely.prepare(park_buffer)
+    zones = np.full(len(points), -1, dtype=np.int8)
+    in_buffer = np.flatnonzero(shapely.intersects(park_buffer, points))
+    zones[in_buffer] = np.where(shapely.intersects(park, points[in_buffer]), 0, 1)
+    return zones
+
+
+class CrimeCube:
+    """Incident counts for every year, hour, agency_cri and zone, as a dense int64 array with those four axes."""
+    def __init__(self, years, hours, agencies, zones):
+        year_labels = np.unique(years[years >= 0])
+        agency_codes, agency_labels = pd.factorize(pd.Series(agencies, dtype="string"), sort=True)
+        self.years = year_labels
+        self.hours = np.arange(24)
+        self.agencies = np.asarray(agency_labels, dtype=object)
+        self.zones = ZONES
+        valid = (years >= 0) & (hours >= 0) & (agency_codes >= 0) & (zones >= 0)
+        year_codes = np.searchsorted(year_labels, years[valid])
+        shape = (len(year_labels), 24, len(agency_labels), len(ZONES))
+        flat_index = np.ravel_multi_index((year_codes, hours[valid], agency_codes[valid], zones[valid]), shape)
+        self.counts = np.bincount(flat_index, minlength=int(np.prod(shape))).reshape(shape)
+
+    @classmethod
+    def from_incidents(cls, crime_incidents, park, buffer_ft=TWO_MILES_FT, year_range=(2006, 2022)):
+        """Builds the cube from a GeoDataFrame of incidents in the same CRS as park. Years outside year_range are left
+        out, as the notebook does for data before 2006. Dates and times are only parsed for incidents in a zone."""
+        zones = assign_zones(crime_incidents.geometry.values, park, buffer_ft)
+        in_zone = np.flatnonzero(zones >= 0)
+        zones = zones[in_zone]
+        years = parse_years(crime_incidents["date_offen"].to_numpy()[in_zone])
+        hours = parse_hours(crime_incidents["time_offen"].to_numpy()[in_zone])
+        if year_range is not None:
+            zones = np.where((years >= year_range[0]) & (years <= year_range[1]), zones, -1)
+        return cls(years, hours, crime_incidents["agency_cri"].to_numpy()[in_zone], zones)
+
+    def counts_by(self, by, zones=ZONES):
+        """Sums the cube over every axis not in by ("year", "crime_hour", "agency_cri") for the given zones. Returns a
+        Series indexed by the by axes, a MultiIndex when there is more than one, keeping only the combinations that had
+        incidents."""
+        axes = {"year": (0, self.years), "crime_hour": (1, self.hours), "agency_cri": (2, self.agencies)}
+        zone_numbers = [self.zones.index(zone) for zone in zones]
+        counts = self.counts[..., zone_numbers].sum(axis=3)
+        kept_axes = [axes[name][0] for name in by]
+        counts = counts.sum(axis=tuple(axis for axis in range(3) if axis not in kept_axes))
+        counts = counts.transpose([sorted(kept_axes).index(axis) for axis in kept_axes])  # Puts the axes in by's order
+        index = pd.MultiIndex.from_product([axes[name][1] for name in by], names=list(by)) if len(by) > 1 \
+            else pd.Index(axes[by[0]][1], name=by[0])
+        counts = pd.Series(counts.reshape(-1), index=index)
+        return counts[counts > 0]
+
+    def tables(self):
+        """Returns every summary table from the notebook, named as they are there, plus mlk_crime_type_time."""
+        tables = {}
+        for prefix, zones in (("mlk", ("park",)), ("two_mi", ZONES)):
+            by_year_agency = self.counts_by(["year", "agency_cri"], zones).rename("crime_count").to_frame()
+            tables[f"{prefix}_crime_by_year_agency"] = by_year_agency.sort_values("year", ascending=False, kind="stable")
+            tables[f"{prefix}_crime_by_year"] = self.counts_by(["year"], zones).rename("crime_count").to_frame()\
+                .sort_values("year", ascending=False)
+            tables[f"{prefix}_crime_by_hour"] = self.counts_by(["crime_hour"], zones).rename("crime_count").to_frame()
+            tables[f"{prefix}_crime_type_time"] = self.counts_by(["year", "crime_hour", "agency_cri"], zones).rename(
+                "crime_incidents").reset_index()
+        crime_type_time = tables["two_mi_crime_type_time"]
+        # The notebook groups two_mi_crime_type_time again with a count, so these are the number of hours (or years)
+        # that had incidents rather than the number of incidents
+        tables["two_mi_crimeType_inc"] = crime_type_time.groupby(["year", "agency_cri"]).agg(
+            crime_incidents=pd.NamedAgg(column="agency_cri", aggfunc="count")).reset_index()
+        tables["two_mi_hour_crime"] = crime_type_time.groupby(["crime_hour", "agency_cri"]).agg(
+            crime_incidents=pd.NamedAgg(column="agency_cri", aggfunc="count")).reset_index()
+        tables["format_for_bar1_crimetype_hour"] = self.counts_by(["crime_hour", "agency_cri"]).unstack("agency_cri")
+        tables["format_for_bar2_crime_type_year"] = self.counts_by(["year", "agency_cri"]).unstack("agency_cri")
+        return tables
+
+
+def save_tables(tables, excel_path):
+    """Writes every table to its own sheet, like the notebook's ExcelWriter cell."""
+    with pd.ExcelWriter(excel_path) as writer:
+        for name, table in tables.items():
+            table.to_excel(writer, sheet_name=name[:31])  # Excel sheet names can't be longer than 31 characters
+
+
+def notebook_tables(crime_incidents, park, buffer_ft=TWO_MILES_FT):
+    """The notebook's steps for the two mile tables, kept to benchmark and check CrimeCube against."""
+    crime_outside_park = crime_incidents.clip(park.buffer(buffer_ft, quad_segs=16))
+    crime_outside_park = crime_outside_park[["date_offen", "time_offen", "agency_cri", "geometry"]]
+    crime_year_trans = []
+    for crime in crime_outside_park["date_offen"].values.tolist():
+        crime_year_trans.append(int(crime[0:4]))
+    crime_outside_park["year"] = crime_year_trans
+    crime_outside_park = crime_outside_park[crime_outside_park["year"].between(2006, 2022)]
+    crimes_by_time = crime_outside_park.copy()
+    crimes_time_type = pd.to_datetime(crimes_by_time["time_offen"], format="mixed").reset_index()
+    crime_outside_park["crime_hour"] = crimes_time_type["time_offen"].dt.round("h").dt.hour.values
+    two_mi_crime_by_year = crime_outside_park[["year", "agency_cri"]].groupby("year").count().rename(
+        columns={"agency_cri": "crime_count"}).sort_values("year", ascending=False)
+    two_mi_crime_by_hour = crime_outside_park[["crime_hour", "agency_cri"]].groupby(["crime_hour"]).count().rename(
+        columns={"agency_cri": "crime_count"}).sort_values("crime_hour", ascending=True)
+    two_mi_crime_type_time = crime_outside_park[["year", "crime_hour", "agency_cri"]].copy()
+    two_mi_crime_type_time = two_mi_crime_type_time.groupby(["year", "crime_hour", "agency_cri"]).agg(
+        crime_incidents=pd.NamedAgg(column="agency_cri", aggfunc="count")).reset_index()
+    format_for_bar2_crime_type_year = two_mi_crime_type_time.pivot_table(index="year", columns="agency_cri",
+                                                                         values="crime_incidents", aggfunc="sum")
+    return {"two_mi_crime_by_year": two_mi_crime_by_year,
+            "two_mi_crime_by_hour": two_mi_crime_by_hour,
+            "two_mi_crime_type_time": two_mi_crime_type_time,
+            "format_for_bar2_crime_type_year": format_for_bar2_crime_type_year}
+
+
+def benchmark(crime_incidents, park, buffer_ft=TWO_MILES_FT):
+    """Times the notebook's steps against CrimeCube on the same incidents and checks that the two mile tables match."""
+    start = time.perf_counter()
+    expected = notebook_tables(crime_incidents, park, buffer_ft)
+    notebook_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    tables = CrimeCube.from_incidents(crime_incidents, park.geometry.values, buffer_ft).tables()
+    cube_seconds = time.perf_counter() - start
+    matches = all(np.array_equal(np.asarray(expected[name].to_numpy(), dtype=np.float64),
+                                 np.asarray(tables[name].to_numpy(), dtype=np.float64), equal_nan=True)
+                  for name in ("two_mi_crime_by_year", "two_mi_crime_by_hour", "format_for_bar2_crime_type_year"))
+    matches = matches and expected["two_mi_crime_type_time"][["crime_incidents"]].to_numpy().tolist() == \
+        tables["two_mi_crime_type_time"][["crime_incidents"]].to_numpy().tolist()
+    print(f"{len(crime_incidents):,} incidents: the notebook's steps took {notebook_seconds:.2f} s for four of the two "
+          f"mile tables and the count cube took {cube_seconds:.2f} s for every table "
+          f"({notebook_seconds / max(cube_seconds, 1e-9):.1f}x). The tables {'match' if matches else 'do NOT match'}.")
+    return notebook_seconds, cube_seconds, matches
+
+
+def main():
+    import geopandas as gpd
+    parser = argparse.ArgumentParser(description="Summarize Memphis crime incidents in and around a park.")
+    parser.add_argument("crime_incidents")
+    parser.add_argument("boundary", help="City boundary layer the incidents are clipped to.")
+    parser.add_argument("park")
+    parser.add_argument("--park-layer", default=None)
+    parser.add_argument("--boundary-row", type=int, default=None, help="Row of the boundary layer to use.")
+    parser.add_argument("--crs", type=int, default=2274, help="Projected CRS in feet, as in the notebook.")
+    parser.add_argument("--excel", default=None, help="Excel workbook to save the tables to.")
+    parser.add_argument("--benchmark", action="store_true", help="Also run the notebook's steps and compare.")
+    arguments = parser.parse_args()
+    boundary_rows = slice(arguments.boundary_row, arguments.boundary_row + 1) \
+        if arguments.boundary_row is not None else None
+    boundary = gpd.read_file(arguments.boundary, rows=boundary_rows).to_crs(arguments.crs)
+    crime_incidents = gpd.read_file(arguments.crime_incidents).to_crs(arguments.crs).clip(boundary)
+    park = gpd.read_file(arguments.park, layer=arguments.park_layer).to_crs(arguments.crs)
+    start = time.perf_counter()
+    tables = CrimeCube.from_incidents(crime_incidents, park.geometry.values).tables()
+    print(f"Made {len(tables)} tables from {len(crime_incidents):,} incidents in {time.perf_counter() - start:.2f} s.")
+    for name, table in tables.items():
+        print(f"\n{name}\n{table.head()}")
+    if arguments.excel is not None:
+        save_tables(tables, arguments.excel)
+    if arguments.benchmark:
+        benchmark(crime_incidents, park)
+
+
+if __name__ == "__main__":
+    main()
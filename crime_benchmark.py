@@ -0,0 +1,52 @@
+"""Times crime_analysis.CrimeCube against the Memphis crime notebook's steps on synthetic incidents around a park, so
+the speed up and the matching tables can be checked without the Memphis Open Data download. The incidents have the
+notebook's date_offen, time_offen and agency_cri columns and are spread over a few miles around the park in EPSG:2274.
+
+python crime_benchmark.py 2000000
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import crime_analysis
+
+AGENCY_CRIMES = ["Assault", "Burglary/Business", "Burglary/Non-Residential", "MVT/Passenger Vehicle", "Property Crime",
+                 "Theft of Vehicle", "Vandalism/Felony", "Violation of Protection Order",
+                 "Weapon Law Violations/Misdemeanor"]
+
+
+def synthetic_incidents(incident_count, spread_ft=20000, seed=0):
+    """Returns a GeoDataFrame of random incidents and a GeoDataFrame with one park polygon, both in EPSG:2274. Dates run
+    from 2003 to 2022 so some fall before the notebook's 2006 cut off, and times mix the HH:MM:SS.000 and HH:MM
+    formats."""
+    rng = np.random.default_rng(seed)
+    center_x, center_y = 760000.0, 310000.0  # Near MLK Riverside Park in Memphis
+    park = shapely.Polygon([(center_x - 1500, center_y - 900), (center_x + 1200, center_y - 1100),
+                            (center_x + 1600, center_y + 800), (center_x - 1000, center_y + 1200)])
+    x = center_x + rng.uniform(-spread_ft, spread_ft, incident_count)
+    y = center_y + rng.uniform(-spread_ft, spread_ft, incident_count)
+    dates = np.datetime64("2003-01-01") + rng.integers(0, 7300, incident_count).astype("timedelta64[D]")
+    seconds = rng.integers(0, 86400, incident_count)
+    hours_minutes = pd.Series(seconds // 3600).map("{:02d}".format) + ":" + pd.Series(seconds // 60 % 60).map(
+        "{:02d}".format)
+    full_times = hours_minutes + ":" + pd.Series(seconds % 60).map("{:02d}".format) + ".000"
+    times = np.where(rng.random(incident_count) < 0.5, hours_minutes, full_times)
+    incidents = gpd.GeoDataFrame({"date_offen": pd.Series(dates).dt.strftime("%Y-%m-%d").to_numpy(),
+                                  "time_offen": times,
+                                  "agency_cri": rng.choice(AGENCY_CRIMES, incident_count)},
+                                 geometry=gpd.points_from_xy(x, y), crs=2274)
+    return incidents, gpd.GeoDataFrame(geometry=[park], crs=2274)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CrimeCube against the notebook's steps.")
+    parser.add_argument("incidents", type=int, nargs="?", default=500000)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    incidents, park = synthetic_incidents(arguments.incidents, seed=arguments.seed)
+    crime_analysis.benchmark(incidents, park)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Fills new fields on GeoParquet and GeoPackage layers from existing ones with whole-column Arrow operations, instead of
+an arcpy.da.UpdateCursor that reads and writes one row at a time. Source columns are read in bulk, each new field is
+computed for the whole column at once and the layer is written back in one write.
+
+python derived_fields.py Mata_Stops.gpkg Mata_Stops_fields.gpkg --split First_Road_Stop stop_name @ --compare
+python derived_fields.py union_with_Overlap.parquet labeled.parquet \
+    --equals Polygon_Type FID_Union_Layer -1 "Interior Polygon" "Exterior Polygon"
+"""
+import argparse
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+class DerivedField:
+    """A new field computed from source_column. compute takes the source column as an Arrow array and returns the new
+    column, and row_function does the same for a single value, the way an UpdateCursor loop would."""
+    def __init__(self, name, source_column, compute, row_function):
+        self.name = name
+        self.source_column = source_column
+        self.compute = compute
+        self.row_function = row_function
+
+
+def split_before(name, source_column, delimiter):
+    """The text before the first delimiter, or all of the text when there isn't one, like str.partition(delimiter)[0]."""
+    return DerivedField(name, source_column,
+                        lambda column: pc.list_element(pc.split_pattern(column, pattern=delimiter, max_splits=1), 0),
+                        lambda value: value.partition(delimiter)[0] if value is not None else None)
+
+
+def value_map(name, source_column, mapping, default=None):
+    """Looks each value up in mapping, using default for values that aren't in it."""
+    keys = pa.array(list(mapping))
+    values = pa.array(list(mapping.values()))
+
+    def compute(column):
+        mapped = pc.take(values, pc.index_in(column, value_set=keys.cast(column.type)))
+        return mapped if default is None else pc.fill_null(mapped, default)
+    return DerivedField(name, source_column, compute, lambda value: mapping.get(value, default))
+
+
+def equals(name, source_column, value, true_value, false_value):
+    """true_value where the source equals value and false_value everywhere else."""
+    def compute(column):
+        return pc.if_else(pc.fill_null(pc.equal(column, pa.scalar(value).cast(column.type)), False), true_value,
+                          false_value)
+    return DerivedField(name, source_column, compute, lambda row_value: true_value if row_value == value else false_value)
+
+
+# The fields filled by New_Bus_Field.py and by the UpdateCursor in incident_union_poly
+FIRST_ROAD_STOP = split_before("First_Road_Stop", "stop_name", "@")
+POLYGON_TYPE = equals("Polygon_Type", "FID_Union_Layer", -1, "Interior Polygon", "Exterior Polygon")
+
+
+def add_derived_fields(table, derived_fields):
+    """Returns table with each derived field added, or replaced when a column with its name already exists."""
+    for derived_field in derived_fields:
+        new_column = derived_field.compute(table.column(derived_field.source_column))
+        if derived_field.name in table.column_names:
+            table = table.set_column(table.column_names.index(derived_field.name), derived_field.name, new_column)
+        else:
+            table = table.append_column(derived_field.name, new_column)
+    return table
+
+
+def derive_fields(input_path, output_path, derived_fields, layer=None, compare=False):
+    """Adds derived fields to a GeoParquet or GeoPackage layer and writes it to output_path, which can be the same as
+    input_path. GeoParquet files are handled a row group at a time and GeoPackage layers are read and written through
+    Arrow with pyogrio. With compare, the same fields are also computed row by row to show the speed up. Returns the
+    number of rows."""
+    start = time.perf_counter()
+    row_seconds = 0.0
+    compute_seconds = 0.0
+    if input_path.lower().endswith(".parquet"):
+        source_file = pq.ParquetFile(input_path)
+        temporary_path = output_path + ".tmp"
+        parquet_writer = None
+        rows = 0
+        try:
+            for row_group in range(source_file.num_row_groups):
+                table = source_file.read_row_group(row_group)
+                rows += table.num_rows
+                if compare:
+                    row_seconds += _row_by_row_seconds(table, derived_fields)
+                compute_start = time.perf_counter()
+                table = add_derived_fields(table, derived_fields)
+                compute_seconds += time.perf_counter() - compute_start
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(temporary_path, table.schema.with_metadata(
+                        source_file.schema_arrow.metadata))  # Keeps the geo metadata
+                parquet_writer.write_table(table)
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+        os.replace(temporary_path, output_path)
+    else:
+        import pyogrio
+        metadata, table = pyogrio.read_arrow(input_path, layer=layer)
+        rows = table.num_rows
+        if compare:
+            row_seconds += _row_by_row_seconds(table, derived_fields)
+        compute_start = time.perf_counter()
+        table = add_derived_fields(table, derived_fields)
+        compute_seconds += time.perf_counter() - compute_start
+        geometry_name = metadata["geometry_name"] or "wkb_geometry"
+        pyogrio.write_arrow(table, output_path, layer=layer or pyogrio.list_layers(input_path)[0][0],
+                            driver="GPKG" if output_path.lower().endswith(".gpkg") else None,
+                            geometry_name=geometry_name, geometry_type=metadata["geometry_type"],
+                            crs=metadata["crs"], encoding="UTF-8")
+    elapsed = time.perf_counter() - start - row_seconds
+    print(f"Added {', '.join(derived_field.name for derived_field in derived_fields)} to {rows:,} rows in "
+          f"{elapsed:.2f} s ({rows / max(elapsed, 1e-9):,.0f} rows/s). Results were saved to {output_path}.")
+    if compare:
+        print(f"Computing the fields took {compute_seconds:.2f} s ({rows / max(compute_seconds, 1e-9):,.0f} rows/s) on "
+              f"whole columns and {row_seconds:.2f} s ({rows / max(row_seconds, 1e-9):,.0f} rows/s) row by row, like "
+              f"an UpdateCursor loop before any of its reads and writes.")
+    return rows
+
+
+def _row_by_row_seconds(table, derived_fields):
+    start = time.perf_counter()
+    for derived_field in derived_fields:
+        [derived_field.row_function(value) for value in table.column(derived_field.source_column).to_pylist()]
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add fields computed from existing fields to a layer.")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--layer", default=None)
+    parser.add_argument("--split", nargs=3, action="append", default=[], metavar=("NEW", "SOURCE", "DELIMITER"),
+                        help="NEW is the text of SOURCE before the first DELIMITER.")
+    parser.add_argument("--equals", nargs=5, action="append", default=[],
+                        metavar=("NEW", "SOURCE", "VALUE", "TRUE_VALUE", "FALSE_VALUE"),
+                        help="NEW is TRUE_VALUE where SOURCE equals VALUE and FALSE_VALUE elsewhere.")
+    parser.add_argument("--compare", action="store_true", help="Also time the fields computed row by row.")
+    arguments = parser.parse_args()
+    derived_fields = [split_before(*split) for split in arguments.split]
+    for name, source_column, value, true_value, false_value in arguments.equals:
+        try:
+            value = json.loads(value)  # Numbers such as -1 are compared as numbers
+        except ValueError:
+            pass
+        derived_fields.append(equals(name, source_column, value, true_value, false_value))
+    if not derived_fields:
+        parser.error("Give at least one --split or --equals field.")
+    derive_fields(arguments.input, arguments.output, derived_fields, arguments.layer, arguments.compare)
+
+
+if __name__ == "__main__":
+    main()
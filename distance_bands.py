@@ -0,0 +1,155 @@
+"""Labels incidents by how far they are from the nearest of many parks, instead of buffering and clipping the incidents
+once for every park and distance. The parks go in a shapely STRtree, each incident's nearest park and distance to it
+are found with one query of the tree, and the distance is turned into a band label by a binary search over the sorted
+breakpoints. An incident inside a park has a distance of 0 and the "inside" band.
+
+python distance_bands.py crime_incidents.shp parks.gpkg crime_bands.parquet --crs 2274 --breaks-mi 0.5 2 \
+    --park-id-column Name --all-parks crime_park_bands.parquet
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+METERS_PER_MILE = 1609.344
+
+
+def band_labels(breakpoints_mi):
+    """Names the bands for breakpoints in miles, for example [0.5, 2] gives inside, 0-0.5 mi and 0.5-2 mi."""
+    edges = [0] + [f"{breakpoint:g}" for breakpoint in breakpoints_mi]
+    return ["inside"] + [f"{edges[i]}-{edges[i + 1]} mi" for i in range(len(breakpoints_mi))]
+
+
+def units_per_mile(crs):
+    """How many of the CRS's linear units are in a mile, 5280 for EPSG:2274's feet."""
+    crs = pyproj.CRS.from_user_input(crs)
+    if crs.is_geographic:
+        raise ValueError(f"The CRS, {crs.name}, is geographic. Use a projected CRS so distances are in feet or meters.")
+    return METERS_PER_MILE / crs.axis_info[0].unit_conversion_factor
+
+
+def band_codes(distances, breakpoints):
+    """Band numbers for distances: 0 inside (distance 0), i for distances up to and including breakpoints[i - 1], and
+    len(breakpoints) + 1 past the last breakpoint."""
+    return np.where(distances == 0, 0, np.searchsorted(breakpoints, distances, side="left") + 1)
+
+
+class DistanceBands:
+    """Assigns incidents to distance bands around a set of parks, all in one projected CRS."""
+    def __init__(self, parks, breakpoints_mi=(0.5, 2), crs=2274, labels=None):
+        self.parks = np.asarray(parks)
+        self.breakpoints_mi = sorted(breakpoints_mi)
+        self.breakpoints = np.asarray(self.breakpoints_mi, dtype=np.float64) * units_per_mile(crs)
+        self.labels = labels if labels is not None else band_labels(self.breakpoints_mi)
+        if len(self.labels) != len(self.breakpoints) + 1:
+            raise ValueError(f"{len(self.breakpoints) + 1} labels are needed for {len(self.breakpoints)} breakpoints.")
+        self.tree = shapely.STRtree(self.parks)
+
+    def nearest(self, points, chunk_size=500000, fill_outside=False):
+        """Returns the nearest park's position, the distance to it and the band code for each point. Points further than
+        the last breakpoint from every park get -1, infinity and len(labels), unless fill_outside is True, in which case
+        their nearest park and distance are found with a nearest search of the tree and only the band code is past the
+        last band. The nearest park is picked from the pairs found by all_parks, which is much faster than a nearest
+        search when the search distance is known."""
+        near_park = np.full(len(points), -1, dtype=np.int64)
+        near_distance = np.full(len(points), np.inf)
+        point_numbers, park_numbers, distances, _ = self.all_parks(points, chunk_size)
+        order = np.lexsort((park_numbers, distances, point_numbers))  # Ties go to the first park
+        point_numbers, park_numbers, distances = point_numbers[order], park_numbers[order], distances[order]
+        first_pair = np.flatnonzero(np.diff(point_numbers, prepend=-1))
+        near_park[point_numbers[first_pair]] = park_numbers[first_pair]
+        near_distance[point_numbers[first_pair]] = distances[first_pair]
+        outside = np.flatnonzero(near_park < 0)
+        if fill_outside and len(outside) and len(self.parks):
+            (point_numbers, park_numbers), distances = self.tree.query_nearest(points[outside], return_distance=True)
+            order = np.lexsort((park_numbers, point_numbers))  # Ties go to the first park here too
+            point_numbers, park_numbers, distances = point_numbers[order], park_numbers[order], distances[order]
+            first_pair = np.flatnonzero(np.diff(point_numbers, prepend=-1))
+            near_park[outside[point_numbers[first_pair]]] = park_numbers[first_pair]
+            near_distance[outside[point_numbers[first_pair]]] = distances[first_pair]
+        return near_park, near_distance, band_codes(near_distance, self.breakpoints)
+
+    def all_parks(self, points, chunk_size=500000):
+        """Returns (point position, park position, distance, band code) for every park within the last breakpoint of
+        each point, so incidents near several parks are counted for each of them."""
+        results = []
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            point_numbers, park_numbers = self.tree.query(chunk, predicate="dwithin", distance=self.breakpoints[-1])
+            distances = shapely.distance(chunk[point_numbers], self.parks[park_numbers])
+            results.append((start + point_numbers, park_numbers, distances))
+        if not results:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), np.empty(0, np.int64)
+        point_numbers, park_numbers, distances = [np.concatenate(column) for column in zip(*results)]
+        return point_numbers, park_numbers, distances, band_codes(distances, self.breakpoints)
+
+    def label(self, codes):
+        """Band codes as a categorical of the labels, with codes past the last band left empty."""
+        return pd.Categorical.from_codes(np.where(codes < len(self.labels), codes, -1), categories=self.labels,
+                                         ordered=True)
+
+
+def assign_bands(incidents, parks, breakpoints_mi=(0.5, 2), park_id_column=None, keep_outside=False):
+    """Adds NEAR_PARK, PARK_DIST (in CRS units), PARK_DIST_MI and DIST_BAND to a GeoDataFrame of incidents in the same
+    projected CRS as parks. Incidents past the last breakpoint are dropped unless keep_outside is True, which takes the
+    place of clipping the incidents to each buffer. Kept incidents past the last breakpoint still get their nearest park
+    and distance, with an empty DIST_BAND."""
+    distance_bands = DistanceBands(parks.geometry.values, breakpoints_mi, parks.crs)
+    near_park, near_distance, codes = distance_bands.nearest(incidents.geometry.values, fill_outside=keep_outside)
+    park_ids = parks[park_id_column].to_numpy() if park_id_column is not None else np.arange(len(parks))
+    banded = incidents.copy()
+    banded["NEAR_PARK"] = np.where(near_park >= 0, park_ids[np.maximum(near_park, 0)], None) \
+        if park_id_column is not None else near_park
+    banded["PARK_DIST"] = near_distance
+    banded["PARK_DIST_MI"] = near_distance / units_per_mile(parks.crs)
+    banded["DIST_BAND"] = distance_bands.label(codes)
+    if not keep_outside:
+        banded = banded[near_park >= 0]
+    return banded
+
+
+def assign_park_bands(incidents, parks, breakpoints_mi=(0.5, 2), park_id_column=None):
+    """Returns a DataFrame with a row for every incident and park pair within the last breakpoint: the incident's
+    index, the park, the distance and its band."""
+    distance_bands = DistanceBands(parks.geometry.values, breakpoints_mi, parks.crs)
+    point_numbers, park_numbers, distances, codes = distance_bands.all_parks(incidents.geometry.values)
+    park_ids = parks[park_id_column].to_numpy() if park_id_column is not None else np.arange(len(parks))
+    return pd.DataFrame({"incident": incidents.index.to_numpy()[point_numbers],
+                         "park": park_ids[park_numbers],
+                         "PARK_DIST": distances,
+                         "DIST_BAND": distance_bands.label(codes)})
+
+
+def main():
+    import geopandas as gpd
+    parser = argparse.ArgumentParser(description="Label incidents by their distance band around the nearest park.")
+    parser.add_argument("incidents")
+    parser.add_argument("parks")
+    parser.add_argument("output", help="GeoParquet (.parquet) or GeoPackage (.gpkg) of the banded incidents.")
+    parser.add_argument("--crs", type=int, default=2274, help="Projected CRS to measure in, feet for EPSG:2274.")
+    parser.add_argument("--breaks-mi", type=float, nargs="+", default=[0.5, 2])
+    parser.add_argument("--park-id-column", default=None)
+    parser.add_argument("--park-layer", default=None)
+    parser.add_argument("--keep-outside", action="store_true", help="Keep incidents past the last breakpoint.")
+    parser.add_argument("--all-parks", default=None, help="Also save every incident and park pair to this Parquet.")
+    arguments = parser.parse_args()
+    incidents = (gpd.read_parquet(arguments.incidents) if arguments.incidents.lower().endswith(".parquet")
+                 else gpd.read_file(arguments.incidents)).to_crs(arguments.crs)
+    parks = gpd.read_file(arguments.parks, layer=arguments.park_layer).to_crs(arguments.crs)
+    start = time.perf_counter()
+    banded = assign_bands(incidents, parks, arguments.breaks_mi, arguments.park_id_column, arguments.keep_outside)
+    print(f"Banded {len(incidents):,} incidents around {len(parks):,} parks in {time.perf_counter() - start:.2f} s.")
+    print(banded["DIST_BAND"].value_counts(sort=False).to_string())
+    if arguments.output.lower().endswith(".parquet"):
+        banded.to_parquet(arguments.output)
+    else:
+        banded.to_file(arguments.output)
+    if arguments.all_parks is not None:
+        assign_park_bands(incidents, parks, arguments.breaks_mi, arguments.park_id_column).to_parquet(
+            arguments.all_parks, index=False)
+
+
+if __name__ == "__main__":
+    main()
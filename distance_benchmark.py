@@ -0,0 +1,57 @@
+"""Compares the speed and accuracy of the ways find_amenity can measure the distance from a user to many locations. The
+per location reprojection and aoi_distance path is the one used in the Testing Amenity Modules notebook. Errors are
+measured against the WGS84 ellipsoid distance from geodesic_distance."""
+import time
+import numpy as np
+import find_amenity
+
+
+def random_locations(location_count, center=(35.68, -105.94), spread_degrees=1.0, seed=0):
+    """Makes [latitude, longitude] pairs spread around Santa Fe, NM, the area used in the amenity notebook."""
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(center[0] - spread_degrees, center[0] + spread_degrees, location_count),
+                            rng.uniform(center[1] - spread_degrees, center[1] + spread_degrees, location_count)])
+
+
+def per_location_distances(user_location, WGS_Locations, projected_crs_ESPG):
+    user_location_proj = find_amenity.location_reprojection(list(user_location), projected_crs_ESPG)
+    return np.array([find_amenity.aoi_distance(user_location_proj,
+                                               find_amenity.location_reprojection(list(location), projected_crs_ESPG))
+                     for location in WGS_Locations])
+
+
+def batch_projected_distances(user_location, WGS_Locations, projected_crs_ESPG):
+    user_location_proj = find_amenity.batch_reprojection(user_location, projected_crs_ESPG)[0]
+    projected_locations = find_amenity.batch_reprojection(WGS_Locations, projected_crs_ESPG)
+    return np.hypot(projected_locations[:, 0] - user_location_proj[0],
+                    projected_locations[:, 1] - user_location_proj[1]) / 1609.344
+
+
+def run_benchmark(location_count=100000, per_location_count=5000, projected_crs_ESPG=32113, spread_degrees=1.0):
+    WGS_Locations = random_locations(location_count, spread_degrees=spread_degrees)
+    user_location = np.array([35.642034836788696, -106.01596691208717])
+    true_distances = find_amenity.geodesic_distance(user_location, WGS_Locations)
+    methods = [("Per location reprojection + aoi_distance",
+                lambda locations: per_location_distances(user_location, locations, projected_crs_ESPG),
+                per_location_count),
+               ("Batch reprojection + planar distance",
+                lambda locations: batch_projected_distances(user_location, locations, projected_crs_ESPG),
+                location_count),
+               ("Haversine", lambda locations: find_amenity.haversine_distance(user_location, locations),
+                location_count),
+               ("Geodesic (pyproj.Geod)", lambda locations: find_amenity.geodesic_distance(user_location, locations),
+                location_count)]
+    print(f"Distances from one user to locations spread {spread_degrees} degrees around Santa Fe, NM "
+          f"(EPSG:{projected_crs_ESPG} for the projected methods).")
+    for name, method, count in methods:
+        start = time.perf_counter()
+        distances = method(WGS_Locations[:count])
+        elapsed = time.perf_counter() - start
+        error = np.abs(distances - true_distances[:count])
+        print(f"{name}: {count / elapsed:,.0f} distances/s, mean error {error.mean() * 5280:.1f} ft, "
+              f"max error {error.max() * 5280:.1f} ft")
+
+
+if __name__ == "__main__":
+    run_benchmark()
+    run_benchmark(spread_degrees=5.0)
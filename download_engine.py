@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class BandwidthLimiter:
+    """Shares a single download speed limit, in bytes per second, between every download thread. burst_bytes is how many
+    bytes can go past the limit after the downloads have been idle. It is 0 by default, so even a small download is held
+    to the limit."""
+    def __init__(self, max_bytes_per_second, burst_bytes=0):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.burst_bytes = burst_bytes
+        self.allowance = burst_bytes
+        self.last_check = time.monotonic()
+        self.lock = threading.Lock()
+
+    def throttle(self, byte_count):
+        """Sleeps until the bytes that were just downloaded fit within the speed limit."""
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.burst_bytes,
+                                 self.allowance + (now - self.last_check) * self.max_bytes_per_second)
+            self.last_check = now
+            self.allowance -= byte_count
+            wait_time = -self.allowance / self.max_bytes_per_second if self.allowance < 0 else 0
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class DownloadProgress:
+    """Keeps count of the bytes written by all download threads and prints the download speed every few seconds."""
+    def __init__(self, total_bytes, total_files, report_every=2.0):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.report_every = report_every
+        self.downloaded_bytes = 0
+        self.finished_files = 0
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+        self.last_report_bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, byte_count):
+        with self.lock:
+            self.downloaded_bytes += byte_count
+            if time.monotonic() - self.last_report >= self.report_every:
+                self._report()
+
+    def file_finished(self):
+        with self.lock:
+            self.finished_files += 1
+            self._report()
+
+    def _report(self):
+        now = time.monotonic()
+        current_speed = (self.downloaded_bytes - self.last_report_bytes) / max(now - self.last_report, 1e-9)
+        average_speed = self.downloaded_bytes / max(now - self.start_time, 1e-9)
+        print(f"Downloaded {self.downloaded_bytes * 0.000001:.1f}/{self.total_bytes * 0.000001:.1f} MB "
+              f"at {current_speed * 0.000001:.2f} MB/s (average {average_speed * 0.000001:.2f} MB/s). "
+              f"Files finished: {self.finished_files}/{self.total_files}")
+        self.last_report = now
+        self.last_report_bytes = self.downloaded_bytes
+
+
+def file_checksum(path, chunk_size=1048576, checksum=None):
+    """Returns the sha256 checksum object of a file on disk. An existing checksum object can be passed in to continue
+    it."""
+    if checksum is None:
+        checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum
+
+
+def stream_download(session, url, path, expected_size=None, chunk_size=1048576, limiter=None, progress=None):
+    """Streams a file to disk in chunks instead of holding it in memory. The file is written to path + ".part" until it
+    is finished, and a partial file left by an earlier attempt is resumed with an HTTP Range request. Returns the size
+    of the finished file in bytes and its sha256 checksum."""
+    part_path = path + ".part"
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if expected_size is not None and resume_from >= expected_size > 0:
+        os.replace(part_path, path)  # An earlier attempt finished writing but was stopped before renaming the file
+        if progress is not None:
+            progress.add(resume_from)
+        return resume_from, file_checksum(path, chunk_size).hexdigest()
+
+    headers = {"Range": f"bytes={resume_from}-"} if resume_from else {}
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:  # Partial file doesn't match the file on the server, so start over
+            os.remove(part_path)
+            return stream_download(session, url, path, expected_size, chunk_size, limiter, progress)
+        response.raise_for_status()
+        if resume_from and response.status_code != 206:
+            resume_from = 0  # Server ignored the Range header and is sending the whole file
+        checksum = hashlib.sha256()
+        if resume_from:
+            file_checksum(part_path, chunk_size, checksum)
+            if progress is not None:
+                progress.add(resume_from)
+        with open(part_path, "ab" if resume_from else "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                checksum.update(chunk)
+                if limiter is not None:
+                    limiter.throttle(len(chunk))
+                if progress is not None:
+                    progress.add(len(chunk))
+
+    file_size = os.path.getsize(part_path)
+    if expected_size is not None and expected_size > 0 and file_size != expected_size:
+        raise IOError(f"{os.path.basename(path)} is {file_size} bytes but {expected_size} bytes were expected. "
+                      f"The partial file was kept so the download can be resumed.")
+    os.replace(part_path, path)
+    return file_size, checksum.hexdigest()
+
+
+def download_files(downloads, session=None, workers=4, chunk_size=1048576, max_bytes_per_second=None,
+                   report_every=2.0):
+    """Downloads (url, path, expected_size) entries with a pool of worker threads and yields (download, result, error)
+    in the order that the files finish. The result is the (size, checksum) of the file, or None when the download
+    failed with the error. max_bytes_per_second caps the combined speed of all the workers."""
+    downloads = list(downloads)
+    if len(downloads) == 0:
+        return
+    paths = [download[1] for download in downloads]
+    if len(set(paths)) < len(paths):
+        raise ValueError("Two or more downloads have the same path, so one would overwrite the other. Give each "
+                         "download its own path.")
+    if session is None:
+        session = requests.Session()
+    limiter = BandwidthLimiter(max_bytes_per_second) if max_bytes_per_second else None
+    progress = DownloadProgress(sum(download[2] or 0 for download in downloads), len(downloads), report_every)
+
+    def run_download(download):
+        url, path, expected_size = download
+        result = stream_download(session, url, path, expected_size, chunk_size, limiter, progress)
+        progress.file_finished()
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(downloads)))
+    try:
+        running_downloads = {executor.submit(run_download, download): download for download in downloads}
+        for finished_download in as_completed(running_downloads):
+            error = finished_download.exception()
+            result = finished_download.result() if error is None else None
+            yield running_downloads[finished_download], result, error
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import download_engine
+
+
+class DownloadLedger:
+    """An append-only record of the files downloaded from the National Maps API. Each download adds one JSON line to the
+    ledger, so a job never rewrites the file and a crash can only cut off the line that was being written. When an entry
+    shows up more than once, the last line for it is the one that counts."""
+    def __init__(self, ledger_path):
+        self.ledger_path = ledger_path
+        self.entries = {}
+        if os.path.exists(ledger_path):
+            self._load()
+
+    def _load(self):
+        with open(self.ledger_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Line that was cut off by a crash
+                self.entries[record["key"]] = record
+
+    @staticmethod
+    def entry_key(dict_item):
+        """Entries are keyed by sourceId, and by downloadURL for entries that don't have one."""
+        return dict_item.get("sourceId") or dict_item["downloadURL"]
+
+    def record(self, dict_item, path, size_in_bytes=None, checksum=None, state="complete", error=None):
+        """Appends the state of a download to the ledger."""
+        record = {"key": self.entry_key(dict_item),
+                  "sourceId": dict_item.get("sourceId"),
+                  "downloadURL": dict_item["downloadURL"],
+                  "path": path,
+                  "sizeInBytes": size_in_bytes,
+                  "sha256": checksum,
+                  "state": state,
+                  "error": None if error is None else str(error),
+                  "loggedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "entry": dict_item}
+        with open(self.ledger_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[record["key"]] = record
+
+    def import_json_log(self, json_log_path, data_folder):
+        """Adds the entries of a downloads_logs.json file, the log that was kept before the ledger, so files it lists
+        aren't downloaded again. The old log didn't store paths or sizes, so entries are matched to the file named after
+        their downloadURL in data_folder, and entries whose file is gone are left out. Returns the number of entries
+        added."""
+        with open(json_log_path, "r") as f:
+            log = json.load(f)
+        imported = 0
+        for dict_item in log:
+            path = os.path.join(data_folder, os.path.basename(dict_item["downloadURL"]))
+            if self.entry_key(dict_item) in self.entries or not os.path.exists(path):
+                continue
+            self.record(dict_item, path, os.path.getsize(path), download_engine.file_checksum(path).hexdigest())
+            imported += 1
+        return imported
+
+    def is_complete(self, dict_item, path, verify_checksum=False):
+        """Checks if an entry was downloaded to the path and that the file on disk still matches what was recorded. The
+        size is always compared, and the checksum is recomputed when verify_checksum is True."""
+        record = self.entries.get(self.entry_key(dict_item))
+        if record is None or record["state"] != "complete" or record["path"] != path:
+            return False
+        if record["downloadURL"] != dict_item["downloadURL"] or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != record["sizeInBytes"]:
+            return False
+        if verify_checksum and download_engine.file_checksum(path).hexdigest() != record["sha256"]:
+            return False
+        return True
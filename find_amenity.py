@@ -1,8 +1,18 @@
+from functools import lru_cache
 from shapely.geometry import Point
+import numpy as np
 import pyproj
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 from ipyleaflet import Map, Marker, basemaps, basemap_to_tiles, Popup, AwesomeIcon
 from ipywidgets import HTML
 
+# Searches that could match more locations than this walk the KD-tree, and a walk that needs more neighbors than this
+# to find k matches scans the feature arrays instead
+TREE_SEARCH_LIMIT = 4096
+
 
 def availible_features(unique_features):
     """ Use this function to make a list of features of interest. Features must be in a list. Like movie showings at
@@ -52,14 +62,31 @@ def user_location():
                       f" in a x,y format.")
 
 
+@lru_cache(maxsize=32)
+def cached_transformer(source_crs, target_crs):
+    """Returns a pyproj Transformer between two CRS. Transformers take much longer to build than to use, so the most
+    recently used ones are kept and reused instead of being rebuilt on every call."""
+    return pyproj.Transformer.from_crs(source_crs, target_crs)
+
+
 def location_reprojection(WGS_Location=[], projected_crs_ESPG=int):
     """Function assumes coordinates are from WGS84. This function reprojects a list containing WGS84 coordinates
     to a projection of your choice."""
-    transformer_self = pyproj.Transformer.from_crs(4326, projected_crs_ESPG)
+    transformer_self = cached_transformer(4326, projected_crs_ESPG)
     transformed_location = transformer_self.transform(WGS_Location[0], WGS_Location[1])
     return transformed_location
 
 
+def batch_reprojection(WGS_Locations, projected_crs_ESPG, source_crs=4326):
+    """Reprojects many WGS84 coordinates in a single call. WGS_Locations is an array or list of coordinate pairs in the
+    same order that location_reprojection takes them. Returns an array with a row of projected coordinates for each
+    location."""
+    WGS_Locations = np.asarray(WGS_Locations, dtype=np.float64).reshape(-1, 2)
+    transformer_self = cached_transformer(source_crs, projected_crs_ESPG)
+    first_coordinates, second_coordinates = transformer_self.transform(WGS_Locations[:, 0], WGS_Locations[:, 1])
+    return np.column_stack([first_coordinates, second_coordinates])
+
+
 def feature_interest(availible_feature):
     """Provides a way for user to input what amenity that they are interested in. Currently, the script can
     only handle one amenity at a time. """
@@ -89,6 +116,248 @@ def selecting_location(feature_of_interest, feature_list, AOI_info):
 def aoi_distance(user_location_proj, confirmed_feature_loc_proj):
     """This script takes the projected coordinates of a list containing the user's projected coordinates and the
     location's projected coordinates to calculate the linear distance of the locations from the user."""
-        dist_to_feature = Point(user_location_proj).distance(Point(confirmed_feature_loc_proj))
+    dist_to_feature = Point(user_location_proj).distance(Point(confirmed_feature_loc_proj))
     dist_in_mi = round(dist_to_feature / 1609.344,2)
     return dist_in_mi
+
+
+EARTH_RADIUS_MI = 3958.7613  # Mean radius of the earth
+WGS84_GEOD = pyproj.Geod(ellps="WGS84")
+
+
+def haversine_distance(WGS_Locations_from, WGS_Locations_to):
+    """Great circle distance in miles between WGS84 coordinates, computed straight from latitude and longitude so no
+    reprojection is needed. Takes [latitude, longitude] pairs like the WGS Coordinates of availible_locations_info,
+    and arrays of pairs are compared row by row (a single pair is compared to every row). Fast, but treats the earth as
+    a sphere, so it can be off by up to about 0.5%."""
+    WGS_Locations_from = np.radians(np.asarray(WGS_Locations_from, dtype=np.float64))
+    WGS_Locations_to = np.radians(np.asarray(WGS_Locations_to, dtype=np.float64))
+    lat_from, lon_from = WGS_Locations_from[..., 0], WGS_Locations_from[..., 1]
+    lat_to, lon_to = WGS_Locations_to[..., 0], WGS_Locations_to[..., 1]
+    a = (np.sin((lat_to - lat_from) / 2) ** 2
+         + np.cos(lat_from) * np.cos(lat_to) * np.sin((lon_to - lon_from) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MI * np.arcsin(np.sqrt(a))
+
+
+def geodesic_distance(WGS_Locations_from, WGS_Locations_to):
+    """Distance in miles along the WGS84 ellipsoid between WGS84 coordinates, using pyproj.Geod on whole arrays at once.
+    Takes the same [latitude, longitude] pairs as haversine_distance. Slower than haversine_distance but accurate at any
+    distance."""
+    WGS_Locations_from, WGS_Locations_to = np.broadcast_arrays(np.asarray(WGS_Locations_from, dtype=np.float64),
+                                                               np.asarray(WGS_Locations_to, dtype=np.float64))
+    forward_azimuth, back_azimuth, distance = WGS84_GEOD.inv(WGS_Locations_from[..., 1], WGS_Locations_from[..., 0],
+                                                             WGS_Locations_to[..., 1], WGS_Locations_to[..., 0])
+    return np.asarray(distance) / 1609.344
+
+
+def location_distances(user_location, locations_info, method="haversine"):
+    """Returns an array with the distance in miles from the user's WGS84 location to every location made with
+    availible_locations_info, without reprojecting them. method is "haversine" or "geodesic"."""
+    WGS_Locations = np.array([location["WGS Coordinates"] for location in locations_info], dtype=np.float64)
+    if method == "haversine":
+        return haversine_distance(user_location, WGS_Locations)
+    elif method == "geodesic":
+        return geodesic_distance(user_location, WGS_Locations)
+    else:
+        raise ValueError(f"The method, {method}, isn't supported. Use 'haversine' or 'geodesic'.")
+
+
+class FeatureIndex:
+    """An inverted index from each feature to the locations that have it. Features are stored the same way that
+    availible_features formats them, and each feature keeps a sorted array of location indexes, so locations that have
+    several features can be found by intersecting arrays instead of checking every location. A LocationStore can be
+    used in place of the list of dictionaries."""
+    def __init__(self, locations_info):
+        self.location_count = len(locations_info)
+        if hasattr(locations_info, "feature_locations"):
+            self.feature_locations = locations_info.feature_locations()
+            return
+        feature_locations = {}
+        for location_number, location in enumerate(locations_info):
+            for feature in set(self.normalize(feature) for feature in location["Features"]):
+                feature_locations.setdefault(feature, []).append(location_number)
+        self.feature_locations = {feature: np.array(location_numbers, dtype=np.intp)
+                                  for feature, location_numbers in feature_locations.items()}
+
+    @staticmethod
+    def normalize(feature):
+        return feature.strip().title()
+
+    def features(self):
+        return tuple(self.feature_locations)
+
+    def _matching_locations(self, features_of_interest):
+        if isinstance(features_of_interest, str):
+            features_of_interest = [features_of_interest]
+        empty = np.array([], dtype=np.intp)
+        return [self.feature_locations.get(self.normalize(feature), empty) for feature in features_of_interest]
+
+    def most_matches(self, features_of_interest, match="all"):
+        """Upper bound on how many locations can match, read from the lengths of the feature arrays."""
+        matching_lengths = [len(location_numbers) for location_numbers in self._matching_locations(features_of_interest)]
+        if len(matching_lengths) == 0:
+            return 0
+        return min(matching_lengths) if match == "all" else sum(matching_lengths)
+
+    def have_features(self, location_numbers, features_of_interest, match="all"):
+        """Returns a boolean array showing which of the given locations have all (or any) of the features. Each
+        location is looked up in the sorted feature arrays, so only the given locations are checked."""
+        location_numbers = np.asarray(location_numbers, dtype=np.intp)
+        matches = np.full(len(location_numbers), match == "all")
+        for feature_locations in self._matching_locations(features_of_interest):
+            positions = np.minimum(np.searchsorted(feature_locations, location_numbers), len(feature_locations) - 1)
+            has_feature = feature_locations[positions] == location_numbers if len(feature_locations) else \
+                np.zeros(len(location_numbers), dtype=bool)
+            matches = matches & has_feature if match == "all" else matches | has_feature
+        return matches
+
+    def locations_with(self, features_of_interest, match="all"):
+        """Returns the sorted indexes of locations that have all of the features, or any of them when match is "any"."""
+        empty = np.array([], dtype=np.intp)
+        matching_locations = self._matching_locations(features_of_interest)
+        if len(matching_locations) == 0:
+            return empty
+        if match == "all":
+            matching_locations.sort(key=len)  # Intersecting from the rarest feature keeps the arrays small
+            combined_locations = matching_locations[0]
+            for location_numbers in matching_locations[1:]:
+                has_feature = np.zeros(self.location_count, dtype=bool)
+                has_feature[location_numbers] = True
+                combined_locations = combined_locations[has_feature[combined_locations]]
+            return combined_locations
+        elif match == "any":
+            has_feature = np.zeros(self.location_count, dtype=bool)
+            for location_numbers in matching_locations:
+                has_feature[location_numbers] = True
+            return np.flatnonzero(has_feature)
+        else:
+            raise ValueError(f"The match, {match}, isn't supported. Use 'all' or 'any'.")
+
+
+class AmenityIndex:
+    """Projects a list of locations made with availible_locations_info once and indexes them, so the nearest locations
+    to one user, or to many users at once, can be found without measuring every user and location pair. Distances are
+    in miles, like aoi_distance. A LocationStore can be used in place of the list of dictionaries, in which case its
+    coordinate array is projected directly and matches are returned as LocationView objects."""
+    def __init__(self, locations_info, projected_crs_ESPG):
+        self.projected_crs_ESPG = projected_crs_ESPG
+        if hasattr(locations_info, "coordinates"):
+            self.locations_info = locations_info
+            self.projected_locations = batch_reprojection(locations_info.coordinates, projected_crs_ESPG)
+        else:
+            self.locations_info = list(locations_info)
+            self.projected_locations = batch_reprojection([location["WGS Coordinates"]
+                                                           for location in self.locations_info], projected_crs_ESPG)
+        self.tree = cKDTree(self.projected_locations) if cKDTree is not None and len(self.locations_info) else None
+        self.feature_index = FeatureIndex(self.locations_info)
+
+    def _project_users(self, user_locations):
+        user_locations = np.asarray(user_locations, dtype=np.float64)
+        single_user = user_locations.ndim == 1
+        return batch_reprojection(user_locations, self.projected_crs_ESPG), single_user
+
+    def query(self, user_locations, k=1):
+        """Returns (distances in miles, location indexes) arrays with a row of the k nearest locations for each user
+        location, closest first. Rows are padded with inf distances and -1 indexes when there are fewer than k
+        locations."""
+        projected_users, single_user = self._project_users(user_locations)
+        if self.tree is not None:
+            distances, indexes = self.tree.query(projected_users, k=k)
+            distances, indexes = distances.reshape(len(projected_users), k), indexes.reshape(len(projected_users), k)
+            indexes = np.where(np.isinf(distances), -1, indexes)
+        else:
+            all_distances = np.hypot(projected_users[:, None, 0] - self.projected_locations[None, :, 0],
+                                     projected_users[:, None, 1] - self.projected_locations[None, :, 1])
+            indexes = np.argsort(all_distances, axis=1)[:, :k]
+            distances = np.take_along_axis(all_distances, indexes, axis=1)
+            if indexes.shape[1] < k:
+                padding = k - indexes.shape[1]
+                distances = np.pad(distances, ((0, 0), (0, padding)), constant_values=np.inf)
+                indexes = np.pad(indexes, ((0, 0), (0, padding)), constant_values=-1)
+        distances = distances / 1609.344
+        if single_user:
+            return distances[0], indexes[0]
+        return distances, indexes
+
+    def nearest(self, user_location, k=1):
+        """Returns the k nearest locations to a user as (location dict, distance in miles) pairs, closest first. A list
+        of user locations returns a list of results for each user."""
+        distances, indexes = self.query(user_location, k=k)
+        if distances.ndim == 1:
+            return self._matches(distances, indexes)
+        return [self._matches(user_distances, user_indexes) for user_distances, user_indexes in zip(distances, indexes)]
+
+    def within(self, user_location, radius_mi):
+        """Returns the locations within radius_mi miles of a user as (location dict, distance in miles) pairs, closest
+        first. A list of user locations returns a list of results for each user."""
+        projected_users, single_user = self._project_users(user_location)
+        radius = radius_mi * 1609.344
+        results = []
+        for projected_user in projected_users:
+            if self.tree is not None:
+                indexes = np.asarray(self.tree.query_ball_point(projected_user, radius), dtype=np.intp)
+            else:
+                indexes = np.arange(len(self.locations_info))
+            distances = np.hypot(self.projected_locations[indexes, 0] - projected_user[0],
+                                 self.projected_locations[indexes, 1] - projected_user[1])
+            in_radius = distances <= radius
+            indexes, distances = indexes[in_radius], distances[in_radius]
+            order = np.argsort(distances)
+            results.append(self._matches(distances[order] / 1609.344, indexes[order]))
+        return results[0] if single_user else results
+
+    def _matches(self, distances, indexes):
+        return [(self.locations_info[index], round(float(distance), 2))
+                for distance, index in zip(distances, indexes) if index >= 0]
+
+    def search(self, user_location, features_of_interest, match="all", radius_mi=None, k=None):
+        """Returns the locations that have all of the features (or any of them when match is "any") as (location dict,
+        distance in miles) pairs, closest first. radius_mi and k limit how far away and how many locations are
+        returned. Common features are searched outward from the user with the KD-tree, and rare features, large k and
+        searches where the tree walk finds too few matches are measured directly from the feature arrays."""
+        if match not in ("all", "any"):
+            raise ValueError(f"The match, {match}, isn't supported. Use 'all' or 'any'.")
+        projected_user = batch_reprojection(user_location, self.projected_crs_ESPG)[0]
+        if (self.tree is not None and self.feature_index.most_matches(features_of_interest, match) > TREE_SEARCH_LIMIT
+                and (radius_mi is not None or (k is not None and k <= TREE_SEARCH_LIMIT))):
+            matches = self._tree_search(projected_user, features_of_interest, match, radius_mi, k)
+            if matches is not None:
+                return matches
+        location_numbers = self.feature_index.locations_with(features_of_interest, match=match)
+        distances = np.hypot(self.projected_locations[location_numbers, 0] - projected_user[0],
+                             self.projected_locations[location_numbers, 1] - projected_user[1]) / 1609.344
+        if radius_mi is not None:
+            in_radius = distances <= radius_mi
+            location_numbers, distances = location_numbers[in_radius], distances[in_radius]
+        if k is not None and k < len(distances):
+            nearest_k = np.argpartition(distances, k - 1)[:k]  # Only the k closest need to be sorted
+            order = nearest_k[np.argsort(distances[nearest_k], kind="stable")]
+        else:
+            order = np.argsort(distances, kind="stable")
+        return self._matches(distances[order], location_numbers[order])
+
+    def _tree_search(self, projected_user, features_of_interest, match, radius_mi, k):
+        """Walks the KD-tree outward from the user. Returns None when a search for the k nearest would need more than
+        TREE_SEARCH_LIMIT neighbors, which happens when few locations have all the features, since scanning the
+        feature arrays is faster than that."""
+        if radius_mi is not None:
+            location_numbers = np.asarray(self.tree.query_ball_point(projected_user, radius_mi * 1609.344),
+                                          dtype=np.intp)
+            location_numbers = location_numbers[self.feature_index.have_features(location_numbers, features_of_interest,
+                                                                                 match)]
+            distances = np.hypot(self.projected_locations[location_numbers, 0] - projected_user[0],
+                                 self.projected_locations[location_numbers, 1] - projected_user[1]) / 1609.344
+            order = np.argsort(distances, kind="stable")[:k]
+            return self._matches(distances[order], location_numbers[order])
+        neighbor_count = min(max(k * 8, 64), len(self.locations_info))
+        while True:  # Ask the tree for more neighbors until enough of them have the features
+            distances, location_numbers = self.tree.query(projected_user, k=neighbor_count)
+            distances, location_numbers = np.atleast_1d(distances), np.atleast_1d(location_numbers)
+            matching = self.feature_index.have_features(location_numbers, features_of_interest, match)
+            if matching.sum() >= k or neighbor_count == len(self.locations_info):
+                break
+            if neighbor_count >= TREE_SEARCH_LIMIT:
+                return None
+            neighbor_count = min(neighbor_count * 4, len(self.locations_info))
+        distances, location_numbers = distances[matching][:k], location_numbers[matching][:k]
+        return self._matches(distances / 1609.344, location_numbers)
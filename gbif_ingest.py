@@ -0,0 +1,206 @@
+"""Converts GBIF simple CSV downloads to point layers without arcpy, so the first step of the GBIF tool can run on any
+machine. Each file is read in chunks with only the needed columns, rows with missing or impossible coordinates are
+dropped, and the points are written to GeoParquet or GeoPackage. Files are spread across a pool of processes.
+
+python gbif_ingest.py "GBIF Data/TestSpreadsheets" gbif_points --format parquet --workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from gbif_manifest import ProcessingManifest
+from reprojection_store import ReprojectionStore
+
+# Columns kept from the GBIF simple CSV and the types they are read as
+GBIF_COLUMNS = {"gbifID": "string",
+                "species": "string",
+                "scientificName": "string",
+                "countryCode": "string",
+                "stateProvince": "string",
+                "basisOfRecord": "string",
+                "eventDate": "string",
+                "year": "Int16",
+                "month": "Int8",
+                "day": "Int8",
+                "coordinateUncertaintyInMeters": "float64"}
+COORDINATE_COLUMNS = ("decimalLongitude", "decimalLatitude")
+
+
+def output_layer_name(csv_path):
+    """Names the output after the CSV the same way GBIF_conversion names its feature classes."""
+    return os.path.splitext(os.path.basename(csv_path))[0].replace("-", "") + "_XY"
+
+
+def read_gbif_chunks(csv_path, columns=GBIF_COLUMNS, chunksize=500000, delimiter="\t"):
+    """Yields (chunk, rows read) for a GBIF simple CSV, keeping only rows with valid decimalLatitude and
+    decimalLongitude. Coordinates are parsed as numbers after reading so a bad value only drops its own row."""
+    wanted_columns = set(columns) | set(COORDINATE_COLUMNS)
+    reader = pd.read_csv(csv_path,
+                         sep=delimiter,
+                         usecols=lambda column: column in wanted_columns,
+                         dtype={column: "string" for column in wanted_columns},
+                         quoting=csv.QUOTE_NONE,
+                         on_bad_lines="skip",
+                         chunksize=chunksize)
+    for chunk in reader:
+        rows_read = len(chunk)
+        for column in wanted_columns - set(chunk.columns):
+            chunk[column] = pd.NA  # Keeps every chunk in the same shape when a download is missing a column
+        longitude = pd.to_numeric(chunk["decimalLongitude"], errors="coerce").to_numpy(dtype=np.float64,
+                                                                                       na_value=np.nan)
+        latitude = pd.to_numeric(chunk["decimalLatitude"], errors="coerce").to_numpy(dtype=np.float64,
+                                                                                     na_value=np.nan)
+        valid = (np.isfinite(longitude) & np.isfinite(latitude) & (np.abs(longitude) <= 180) & (np.abs(latitude) <= 90)
+                 & ~((longitude == 0) & (latitude == 0)))  # 0,0 is how many records mark a missing location
+        chunk = chunk.loc[valid, list(columns)].reset_index(drop=True)
+        for column, dtype in columns.items():
+            if dtype != "string":
+                chunk[column] = _to_dtype(chunk[column], dtype)
+        chunk["decimalLongitude"] = longitude[valid]
+        chunk["decimalLatitude"] = latitude[valid]
+        yield chunk, rows_read
+
+
+def _to_dtype(values, dtype):
+    """Parses text as numbers of dtype. Values that aren't numbers, and for integer types values that aren't whole or
+    don't fit the type (a month of 3.5 or a year of 99999), are left missing instead of stopping the conversion."""
+    numbers = pd.to_numeric(values, errors="coerce").astype("Float64")
+    if pd.api.types.is_integer_dtype(dtype):
+        type_range = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+        numbers = numbers.where((numbers % 1 == 0) & (numbers >= type_range.min) & (numbers <= type_range.max))
+    return numbers.astype(dtype)
+
+
+def parquet_schema(columns=GBIF_COLUMNS):
+    """The Arrow schema of the GeoParquet layers, pinned so every chunk, and a file with no valid rows, has the same
+    columns and types."""
+    empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+    for column in COORDINATE_COLUMNS:
+        empty[column] = pd.Series(dtype="float64")
+    schema = pa.Schema.from_pandas(empty, preserve_index=False).append(pa.field("geometry", pa.binary()))
+    return schema.with_metadata({**(schema.metadata or {}), b"geo": _geoparquet_metadata()})
+
+
+def _geoparquet_metadata():
+    return json.dumps({"version": "1.0.0",
+                       "primary_column": "geometry",
+                       "columns": {"geometry": {"encoding": "WKB",
+                                                "geometry_types": ["Point"],
+                                                "crs": pyproj.CRS.from_epsg(4326).to_json_dict()}}})
+
+
+def convert_gbif_csv(csv_path, output_folder, output_format="parquet", columns=GBIF_COLUMNS, chunksize=500000,
+                     delimiter="\t"):
+    """Streams one GBIF simple CSV into a WGS84 point layer in output_folder. Returns (csv_path, output_path, rows read,
+    rows written, seconds)."""
+    start = time.perf_counter()
+    layer_name = output_layer_name(csv_path)
+    output_path = os.path.join(output_folder, layer_name + (".parquet" if output_format == "parquet" else ".gpkg"))
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    rows_read = 0
+    rows_written = 0
+    parquet_writer = None
+    try:
+        for chunk, chunk_rows_read in read_gbif_chunks(csv_path, columns, chunksize, delimiter):
+            rows_read += chunk_rows_read
+            rows_written += len(chunk)
+            points = shapely.points(chunk["decimalLongitude"].to_numpy(), chunk["decimalLatitude"].to_numpy())
+            if output_format == "parquet":
+                chunk["geometry"] = shapely.to_wkb(points)
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(output_path, parquet_schema(columns))
+                parquet_writer.write_table(pa.Table.from_pandas(chunk, schema=parquet_writer.schema,
+                                                                preserve_index=False))
+            elif output_format == "gpkg":
+                import pyogrio
+                import geopandas as gpd
+                pyogrio.write_dataframe(gpd.GeoDataFrame(chunk, geometry=points, crs="EPSG:4326"), output_path,
+                                        layer=layer_name, driver="GPKG", append=os.path.exists(output_path))
+            else:
+                raise ValueError(f"The output format, {output_format}, isn't supported. Use 'parquet' or 'gpkg'.")
+        if not os.path.exists(output_path):  # No valid rows, so an empty layer is written for later steps to read
+            if output_format == "parquet":
+                pq.write_table(parquet_schema(columns).empty_table(), output_path)
+            else:
+                import pyogrio
+                import geopandas as gpd
+                empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+                pyogrio.write_dataframe(gpd.GeoDataFrame(empty, geometry=gpd.GeoSeries([], crs="EPSG:4326")),
+                                        output_path, layer=layer_name, driver="GPKG", geometry_type="Point")
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    return csv_path, output_path, rows_read, rows_written, time.perf_counter() - start
+
+
+def convert_gbif_folder(Incident_Folder, output_folder, output_format="parquet", workers=None, chunksize=500000,
+                        delimiter="\t", incremental=True, working_crs=None):
+    """Converts every .csv in Incident_Folder across a pool of processes and prints the rows per second for each file
+    and for the whole folder. With incremental, files that a manifest in output_folder shows were already converted
+    with the same settings, and haven't changed since, are skipped. When working_crs is given every layer is also
+    projected to it once through a ReprojectionStore in output_folder/projected. Returns the list of results from
+    convert_gbif_csv for the files that were converted."""
+    os.makedirs(output_folder, exist_ok=True)
+    GBIF_table = [os.path.join(Incident_Folder, filename) for filename in sorted(os.listdir(Incident_Folder))
+                  if filename.endswith(".csv")]
+    manifest = ProcessingManifest(os.path.join(output_folder, "gbif_manifest.json"))
+    step_parameters = {"format": output_format, "columns": list(GBIF_COLUMNS), "delimiter": delimiter}
+    if incremental:
+        unchanged_files = [csv_path for csv_path in GBIF_table
+                           if manifest.is_current(csv_path, "convert", step_parameters)]
+        if unchanged_files:
+            print(f"{len(unchanged_files)} of the {len(GBIF_table)} files haven't changed and were skipped.")
+        GBIF_table = [csv_path for csv_path in GBIF_table if csv_path not in unchanged_files]
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        conversions = [executor.submit(convert_gbif_csv, csv_path, output_folder, output_format, GBIF_COLUMNS,
+                                       chunksize, delimiter) for csv_path in GBIF_table]
+        for conversion in as_completed(conversions):
+            csv_path, output_path, rows_read, rows_written, seconds = conversion.result()
+            results.append(conversion.result())
+            if os.path.exists(output_path):
+                manifest.record(csv_path, "convert", [output_path], step_parameters)
+            print(f"{os.path.basename(csv_path)} was converted to {output_path}: {rows_written:,} of {rows_read:,} "
+                  f"rows kept, {rows_read / max(seconds, 1e-9):,.0f} rows/s.")
+    elapsed = time.perf_counter() - start
+    total_rows = sum(result[2] for result in results)
+    print(f"Converted {len(results)} files and {total_rows:,} rows in {elapsed:.1f} s "
+          f"({total_rows / max(elapsed, 1e-9):,.0f} rows/s).")
+    if working_crs is not None and output_format == "parquet":
+        reprojection_store = ReprojectionStore(os.path.join(output_folder, "projected"))
+        for csv_path in sorted(manifest.steps):
+            for output_path in manifest.outputs(csv_path, "convert"):
+                if os.path.exists(output_path):
+                    print(f"{os.path.basename(output_path)} in {working_crs}: "
+                          f"{reprojection_store.projected(output_path, working_crs)}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert GBIF simple CSV downloads to point layers without arcpy.")
+    parser.add_argument("incident_folder")
+    parser.add_argument("output_folder")
+    parser.add_argument("--format", choices=["parquet", "gpkg"], default="parquet")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=500000)
+    parser.add_argument("--delimiter", default="\t")
+    parser.add_argument("--full", action="store_true", help="Convert every file, even ones that haven't changed.")
+    parser.add_argument("--crs", default=None, help="Working CRS to project the layers to, such as EPSG:2274.")
+    arguments = parser.parse_args()
+    convert_gbif_folder(arguments.incident_folder, arguments.output_folder, arguments.format, arguments.workers,
+                        arguments.chunksize, arguments.delimiter, incremental=not arguments.full,
+                        working_crs=arguments.crs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+def file_fingerprint(path, known_fingerprint=None, chunk_size=1048576):
+    """Returns the size, modification time and sha256 of a file. The file is only hashed when its size or modification
+    time differ from known_fingerprint, so unchanged inputs are never read again."""
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if (known_fingerprint is not None and known_fingerprint["size"] == stat.st_size
+            and known_fingerprint["mtime"] == stat.st_mtime):
+        fingerprint["sha256"] = known_fingerprint["sha256"]
+        return fingerprint
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    fingerprint["sha256"] = checksum.hexdigest()
+    return fingerprint
+
+
+class ProcessingManifest:
+    """Records which input files were processed by each step of the GBIF pipeline (convert, project, clip), the
+    fingerprint the input had at the time, the step's parameters and the outputs it made. A step only needs to run
+    again when its input's content changed, its parameters changed or one of its outputs is missing. Because each
+    step stores the input's fingerprint, a changed input makes all of its downstream steps out of date as well."""
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.inputs = {}
+        self.steps = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.inputs = manifest["inputs"]
+            self.steps = manifest["steps"]
+
+    def fingerprint(self, input_path):
+        """Fingerprints an input and remembers it, reusing the stored hash when the size and time haven't changed."""
+        input_path = os.path.abspath(input_path)
+        fingerprint = file_fingerprint(input_path, self.inputs.get(input_path))
+        self.inputs[input_path] = fingerprint
+        return fingerprint
+
+    def is_current(self, input_path, step, parameters=None, output_exists=os.path.exists):
+        """Checks if a step's recorded outputs are still valid for the input. output_exists checks each output, and can
+        be swapped for arcpy.Exists when the outputs are in a geodatabase."""
+        input_path = os.path.abspath(input_path)
+        record = self.steps.get(input_path, {}).get(step)
+        if record is None:
+            return False
+        if record["sha256"] != self.fingerprint(input_path)["sha256"] or record["parameters"] != (parameters or {}):
+            return False
+        return all(output_exists(output) for output in record["outputs"])
+
+    def outputs(self, input_path, step):
+        record = self.steps.get(os.path.abspath(input_path), {}).get(step)
+        return [] if record is None else record["outputs"]
+
+    def record(self, input_path, step, outputs, parameters=None):
+        """Records the outputs a step made from an input and saves the manifest."""
+        input_path = os.path.abspath(input_path)
+        self.steps.setdefault(input_path, {})[step] = {"sha256": self.fingerprint(input_path)["sha256"],
+                                                       "parameters": parameters or {},
+                                                       "outputs": list(outputs)}
+        self.save()
+
+    def save(self):
+        """Writes the manifest to a temporary file first and swaps it in, so a crash can't leave a half written file."""
+        manifest_folder = os.path.dirname(os.path.abspath(self.manifest_path))
+        with tempfile.NamedTemporaryFile("w", dir=manifest_folder, delete=False, suffix=".tmp") as f:
+            json.dump({"inputs": self.inputs, "steps": self.steps}, f, indent=4)
+        os.replace(f.name, self.manifest_path)
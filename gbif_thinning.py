@@ -0,0 +1,146 @@
+"""Removes duplicate and near duplicate GBIF occurrences before the rest of the GBIF tool runs. Occurrences of the same
+species that fall in the same grid cell within the same time window are put in one bin, and only the first occurrence
+of each bin is kept along with a multiplicity column counting how many occurrences it stands for.
+
+The input is streamed in batches. Each batch's bins are hashed to a 64 bit integer and the batch is split by hash into
+partition files, so the final dedup only has to hold one partition in memory at a time. The number of partitions is
+worked out from the size of the input and a memory budget, so a partition stays within the budget however large the
+input is.
+
+python gbif_thinning.py gbif_points/raccoons_XY.parquet raccoons_thinned.parquet --cell-size 0.01 --days 7
+"""
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PANDAS_OVERHEAD = 4  # Rough size of a pandas DataFrame compared to the uncompressed Parquet data, mostly from strings
+
+
+def occurrence_day(years, months, days):
+    """Returns the days since 1970-01-01 of each occurrence, which are negative before 1970, and a boolean array that is
+    True for occurrences with a date. Occurrences whose year, month or day is missing or impossible are undated and get
+    a day number of 0. The columns can be the nullable Int16 and Int8 columns written by gbif_ingest.py."""
+    # Nullable integers are read as floats so missing values become NaN, which to_datetime can coerce
+    dates = pd.to_datetime(pd.DataFrame({"year": pd.to_numeric(years, errors="coerce").astype("float64"),
+                                         "month": pd.to_numeric(months, errors="coerce").astype("float64"),
+                                         "day": pd.to_numeric(days, errors="coerce").astype("float64")}),
+                           errors="coerce")
+    dated = dates.notna().to_numpy()
+    day_numbers = np.zeros(len(dates), dtype=np.int64)
+    day_numbers[dated] = dates[dated].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    return day_numbers, dated
+
+
+def bin_keys(chunk, cell_size=0.01, time_window_days=1, species_column="species"):
+    """Hashes each occurrence's species, grid cell (cell_size degrees) and time window (time_window_days long, or no
+    window when it is None) to a uint64 bin key. Occurrences without a date are binned together within their cell, apart
+    from the dated ones."""
+    cell_x = np.floor(chunk["decimalLongitude"].to_numpy(dtype=np.float64) / cell_size).astype(np.int64)
+    cell_y = np.floor(chunk["decimalLatitude"].to_numpy(dtype=np.float64) / cell_size).astype(np.int64)
+    if time_window_days is None:
+        time_bin = np.zeros(len(chunk), dtype=np.int64)
+        dated = np.zeros(len(chunk), dtype=bool)
+    else:
+        day_numbers, dated = occurrence_day(chunk["year"], chunk["month"], chunk["day"])
+        time_bin = np.where(dated, day_numbers // time_window_days, 0)  # Floor division keeps pre-1970 windows apart
+    bins = pd.DataFrame({"species": chunk[species_column].astype("string").fillna(""),
+                         "cell_x": cell_x, "cell_y": cell_y, "time_bin": time_bin, "dated": dated})
+    return pd.util.hash_pandas_object(bins, index=False).to_numpy(dtype=np.uint64)
+
+
+def pandas_bytes(source_file):
+    """Estimates how much memory a Parquet file takes once it is loaded into pandas, from its uncompressed size."""
+    return PANDAS_OVERHEAD * sum(source_file.metadata.row_group(row_group).total_byte_size
+                                 for row_group in range(source_file.metadata.num_row_groups))
+
+
+def thin_occurrences(input_path, output_path, cell_size=0.01, time_window_days=1, species_column="species",
+                     partitions=None, batch_size=500000, memory_budget_bytes=536870912):
+    """Writes one representative occurrence per bin of a GeoParquet layer made by gbif_ingest.py to output_path, with a
+    multiplicity column. Rows are written one partition at a time, so they aren't in the input's order. Without a
+    number of partitions, enough are used for each one to fit in memory_budget_bytes, and batches are made smaller
+    when they wouldn't fit either. Returns (rows read, rows written)."""
+    start = time.perf_counter()
+    source_file = pq.ParquetFile(input_path)
+    if partitions is None:
+        estimated_bytes = pandas_bytes(source_file)
+        partitions = max(1, math.ceil(estimated_bytes / memory_budget_bytes))
+        if estimated_bytes > 0:
+            batch_size = max(1, min(batch_size, memory_budget_bytes * source_file.metadata.num_rows // estimated_bytes))
+    partition_folder = tempfile.mkdtemp(prefix="gbif_thinning_", dir=os.path.dirname(os.path.abspath(output_path)))
+    partition_writers = {}
+    rows_read = 0
+    output_writer = None
+    rows_written = 0
+    try:
+        # Pass 1: dedup within each batch and spread the batch's bins over the partition files
+        for batch in source_file.iter_batches(batch_size=batch_size):
+            chunk = batch.to_pandas()
+            chunk["bin_key"] = bin_keys(chunk, cell_size, time_window_days, species_column)
+            chunk["input_row"] = np.arange(rows_read, rows_read + len(chunk), dtype=np.int64)
+            rows_read += len(chunk)
+            multiplicity = chunk.groupby("bin_key", sort=False).size()
+            chunk = chunk.drop_duplicates("bin_key")
+            chunk["multiplicity"] = multiplicity.reindex(chunk["bin_key"]).to_numpy(dtype=np.int64)
+            partition_numbers = (chunk["bin_key"].to_numpy() % np.uint64(partitions)).astype(np.int64)
+            for partition_number, partition in chunk.groupby(partition_numbers, sort=False):
+                table = pa.Table.from_pandas(partition, preserve_index=False)
+                if partition_number not in partition_writers:
+                    partition_writers[partition_number] = pq.ParquetWriter(
+                        os.path.join(partition_folder, f"partition_{partition_number}.parquet"), table.schema)
+                partition_writers[partition_number].write_table(table.cast(partition_writers[partition_number].schema))
+        for partition_writer in partition_writers.values():
+            partition_writer.close()
+        # Pass 2: finish the dedup one partition at a time, keeping the earliest row of each bin
+        for partition_number in sorted(partition_writers):
+            partition = pq.read_table(os.path.join(partition_folder, f"partition_{partition_number}.parquet")).to_pandas()
+            partition = partition.sort_values("input_row", kind="stable")
+            multiplicity = partition.groupby("bin_key", sort=False)["multiplicity"].sum()
+            partition = partition.drop_duplicates("bin_key")
+            partition["multiplicity"] = multiplicity.reindex(partition["bin_key"]).to_numpy(dtype=np.int64)
+            table = pa.Table.from_pandas(partition.drop(columns=["bin_key", "input_row"]), preserve_index=False)
+            if output_writer is None:
+                metadata = {**(table.schema.metadata or {}), **(source_file.schema_arrow.metadata or {})}
+                if b"pandas" in metadata:
+                    del metadata[b"pandas"]
+                output_writer = pq.ParquetWriter(output_path, table.schema.with_metadata(metadata))
+            output_writer.write_table(table.cast(output_writer.schema))
+            rows_written += len(partition)
+    finally:
+        for partition_writer in partition_writers.values():
+            partition_writer.close()
+        if output_writer is not None:
+            output_writer.close()
+        shutil.rmtree(partition_folder, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    print(f"Thinned {rows_read:,} occurrences to {rows_written:,} ({rows_read / max(rows_written, 1):.2f}x reduction, "
+          f"{1 - rows_written / max(rows_read, 1):.1%} removed) in {elapsed:.1f} s with {partitions} partitions. "
+          f"Results were saved to {output_path}.")
+    return rows_read, rows_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep one GBIF occurrence per species, grid cell and time window.")
+    parser.add_argument("input", help="GeoParquet layer made by gbif_ingest.py.")
+    parser.add_argument("output")
+    parser.add_argument("--cell-size", type=float, default=0.01, help="Grid cell size in degrees.")
+    parser.add_argument("--days", type=int, default=1, help="Time window in days. Use 0 to ignore dates.")
+    parser.add_argument("--species-column", default="species")
+    parser.add_argument("--partitions", type=int, default=None, help="Defaults to enough to fit in --memory-mb.")
+    parser.add_argument("--batch-size", type=int, default=500000)
+    parser.add_argument("--memory-mb", type=float, default=512, help="Memory budget for a partition or a batch.")
+    arguments = parser.parse_args()
+    thin_occurrences(arguments.input, arguments.output, arguments.cell_size, arguments.days or None,
+                     arguments.species_column, arguments.partitions, arguments.batch_size,
+                     int(arguments.memory_mb * 1048576))
+
+
+if __name__ == "__main__":
+    main()
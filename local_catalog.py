@@ -0,0 +1,92 @@
+import os
+import sqlite3
+from shapely.geometry import box
+from download_ledger import DownloadLedger
+
+
+class LocalCatalog:
+    """A SQLite catalog of the National Maps products that were downloaded to disk. Footprints are stored in an R-tree
+    index so the files that cover a point, bbox or polygon can be found without reading every entry."""
+    columns = ["entry_key", "dataset", "title", "publication_date", "size_in_bytes", "local_path", "download_url",
+               "min_x", "min_y", "max_x", "max_y"]
+
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.connection = sqlite3.connect(catalog_path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS products ("
+                                "id INTEGER PRIMARY KEY, "
+                                "entry_key TEXT UNIQUE NOT NULL, "
+                                "dataset TEXT, "
+                                "title TEXT, "
+                                "publication_date TEXT, "
+                                "size_in_bytes INTEGER, "
+                                "local_path TEXT NOT NULL, "
+                                "download_url TEXT, "
+                                "min_x REAL, min_y REAL, max_x REAL, max_y REAL)")
+        self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_index "
+                                "USING rtree(id, min_x, max_x, min_y, max_y)")
+        self.connection.commit()
+
+    def add(self, dict_item, local_path, size_in_bytes=None, dataset=None):
+        """Adds a downloaded entry from the API to the catalog, replacing an earlier record for the same entry."""
+        self._insert(dict_item, local_path, size_in_bytes, dataset)
+        self.connection.commit()
+
+    def add_many(self, downloads, dataset=None):
+        """Adds (dict_item, local_path, size_in_bytes) downloads to the catalog in a single transaction."""
+        for dict_item, local_path, size_in_bytes in downloads:
+            self._insert(dict_item, local_path, size_in_bytes, dataset)
+        self.connection.commit()
+
+    def add_from_ledger(self, ledger, dataset=None):
+        """Adds the completed downloads recorded in a DownloadLedger, for files that were downloaded before the catalog
+        was kept."""
+        self.add_many([(record["entry"], record["path"], record["sizeInBytes"]) for record in ledger.entries.values()
+                       if record["state"] == "complete" and os.path.exists(record["path"])], dataset=dataset)
+
+    def _insert(self, dict_item, local_path, size_in_bytes=None, dataset=None):
+        bounding_box = dict_item["boundingBox"]
+        entry_key = DownloadLedger.entry_key(dict_item)
+        existing_row = self.connection.execute("SELECT id FROM products WHERE entry_key = ?", (entry_key,)).fetchone()
+        if existing_row is not None:
+            self.connection.execute("DELETE FROM products_index WHERE id = ?", existing_row)
+            self.connection.execute("DELETE FROM products WHERE id = ?", existing_row)
+        if dataset is None and dict_item.get("datasets"):
+            dataset = ", ".join(dict_item["datasets"])
+        cursor = self.connection.execute(
+            "INSERT INTO products (entry_key, dataset, title, publication_date, size_in_bytes, local_path, download_url, "
+            "min_x, min_y, max_x, max_y) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry_key, dataset, dict_item.get("title"), dict_item.get("publicationDate"),
+             size_in_bytes if size_in_bytes is not None else dict_item.get("sizeInBytes"), os.path.abspath(local_path),
+             dict_item["downloadURL"], bounding_box["minX"], bounding_box["minY"], bounding_box["maxX"],
+             bounding_box["maxY"]))
+        self.connection.execute("INSERT INTO products_index VALUES (?, ?, ?, ?, ?)",
+                                (cursor.lastrowid, bounding_box["minX"], bounding_box["maxX"], bounding_box["minY"],
+                                 bounding_box["maxY"]))
+
+    def query_bbox(self, bbox, dataset=None):
+        """Returns the catalog records whose footprint intersects a [xmin, ymin, xmax, ymax] bbox in WGS84."""
+        sql = ("SELECT " + ", ".join(f"p.{column}" for column in self.columns) + " FROM products_index i "
+               "JOIN products p ON p.id = i.id "
+               "WHERE i.min_x <= ? AND i.max_x >= ? AND i.min_y <= ? AND i.max_y >= ?")
+        parameters = [bbox[2], bbox[0], bbox[3], bbox[1]]
+        if dataset is not None:
+            sql += " AND p.dataset = ?"
+            parameters.append(dataset)
+        return [dict(zip(self.columns, row)) for row in self.connection.execute(sql, parameters)]
+
+    def query_point(self, x, y, dataset=None):
+        """Returns the catalog records whose footprint covers a WGS84 point."""
+        return self.query_bbox([x, y, x, y], dataset=dataset)
+
+    def query_polygon(self, polygon, dataset=None):
+        """Returns the catalog records whose footprint intersects a shapely polygon in WGS84. The R-tree narrows the
+        records down by the polygon's bounds before the exact intersection test."""
+        return [record for record in self.query_bbox(polygon.bounds, dataset=dataset)
+                if polygon.intersects(box(record["min_x"], record["min_y"], record["max_x"], record["max_y"]))]
+
+    def is_on_disk(self, dict_item):
+        """Checks if an entry from the API is in the catalog and its file is still on disk."""
+        row = self.connection.execute("SELECT local_path FROM products WHERE entry_key = ?",
+                                      (DownloadLedger.entry_key(dict_item),)).fetchone()
+        return row is not None and os.path.exists(row[0])
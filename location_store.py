@@ -0,0 +1,141 @@
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class LocationView(Mapping):
+    """Reads a single location out of a LocationStore with the same keys as the dictionaries made by
+    availible_locations_info. Values are only built when they are asked for."""
+    __slots__ = ("store", "location_number")
+    keys_ = ("Name", "WGS Coordinates", "Features")
+
+    def __init__(self, store, location_number):
+        self.store = store
+        self.location_number = location_number
+
+    def __getitem__(self, key):
+        if key == "Name":
+            return self.store.name(self.location_number)
+        elif key == "WGS Coordinates":
+            return self.store.coordinates[self.location_number].tolist()
+        elif key == "Features":
+            return self.store.features_of(self.location_number)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class LocationStore:
+    """Holds many locations as columns instead of one dictionary per location. Coordinates are a float64 array of
+    [latitude, longitude] rows, names are an Arrow string array when pyarrow is installed, and features are stored once
+    in a vocabulary with each location's features listed in CSR form (feature_ids[feature_offsets[i]:feature_offsets[i +
+    1]] are the features of location i). Indexing the store returns LocationView objects that act like the
+    dictionaries from availible_locations_info."""
+    def __init__(self, names, coordinates, feature_vocabulary, feature_offsets, feature_ids):
+        self.names = pa.array(names, type=pa.string()) if pa is not None else np.asarray(names, dtype=object)
+        self.coordinates = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.feature_vocabulary = tuple(feature_vocabulary)
+        self.feature_offsets = np.asarray(feature_offsets, dtype=np.int64)
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int32)
+
+    @classmethod
+    def from_columns(cls, names, latitudes, longitudes, features, feature_separator=";"):
+        """Builds a store from columns. Each item in features is either a list of features or a string of features
+        separated by feature_separator. Features are formatted like availible_features, and repeated features are
+        only stored once per location."""
+        features = pd.Series(list(features), dtype=object)
+        location_count = len(features)
+        if location_count and any(isinstance(value, str) for value in features.dropna().head(100)):
+            features = features.fillna("").astype(str).str.split(feature_separator)
+        exploded_features = features.explode()
+        exploded_features = exploded_features[exploded_features.notna()].astype(str).str.strip().str.title()
+        exploded_features = exploded_features[exploded_features != ""]
+        feature_codes, feature_vocabulary = pd.factorize(exploded_features)
+        location_features = pd.DataFrame({"location": exploded_features.index.to_numpy(dtype=np.int64),
+                                          "feature": feature_codes}).drop_duplicates()
+        feature_counts = np.bincount(location_features["location"].to_numpy(), minlength=location_count)
+        feature_offsets = np.concatenate([[0], np.cumsum(feature_counts)])
+        coordinates = np.column_stack([np.asarray(latitudes, dtype=np.float64),
+                                       np.asarray(longitudes, dtype=np.float64)])
+        return cls(list(names), coordinates, list(feature_vocabulary), feature_offsets,
+                   location_features["feature"].to_numpy())
+
+    @classmethod
+    def from_locations_info(cls, locations_info):
+        """Builds a store from a list of dictionaries made with availible_locations_info."""
+        return cls.from_columns([location["Name"] for location in locations_info],
+                                [location["WGS Coordinates"][0] for location in locations_info],
+                                [location["WGS Coordinates"][1] for location in locations_info],
+                                [list(location["Features"]) for location in locations_info])
+
+    @classmethod
+    def from_csv(cls, csv_path, name_column="Name", latitude_column="Latitude", longitude_column="Longitude",
+                 features_column="Features", feature_separator=";", **read_csv_options):
+        """Loads a store from a CSV with one row per location, reading only the columns that are needed."""
+        locations = pd.read_csv(csv_path,
+                                usecols=[name_column, latitude_column, longitude_column, features_column],
+                                dtype={name_column: str, latitude_column: np.float64, longitude_column: np.float64,
+                                       features_column: str},
+                                **read_csv_options)
+        return cls.from_columns(locations[name_column], locations[latitude_column], locations[longitude_column],
+                                locations[features_column], feature_separator=feature_separator)
+
+    @classmethod
+    def from_file(cls, file_path, name_column="Name", features_column="Features", feature_separator=";"):
+        """Loads a store from a point GeoJSON, GeoPackage or GeoParquet file. Points are converted to WGS84 first."""
+        import geopandas as gpd
+        if file_path.lower().endswith(".parquet"):
+            locations = gpd.read_parquet(file_path, columns=[name_column, features_column, "geometry"])
+        else:
+            locations = gpd.read_file(file_path, columns=[name_column, features_column])
+        if locations.crs is not None:
+            locations = locations.to_crs(4326)
+        return cls.from_columns(locations[name_column], locations.geometry.y, locations.geometry.x,
+                                locations[features_column], feature_separator=feature_separator)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __getitem__(self, location_number):
+        if location_number < 0:
+            location_number += len(self)
+        if not 0 <= location_number < len(self):
+            raise IndexError(location_number)
+        return LocationView(self, int(location_number))
+
+    def __iter__(self):
+        for location_number in range(len(self)):
+            yield LocationView(self, location_number)
+
+    def name(self, location_number):
+        name = self.names[location_number]
+        return name.as_py() if pa is not None else name
+
+    def features_of(self, location_number):
+        feature_ids = self.feature_ids[self.feature_offsets[location_number]:self.feature_offsets[location_number + 1]]
+        return [self.feature_vocabulary[feature_id] for feature_id in feature_ids]
+
+    def feature_locations(self):
+        """Returns a dictionary from each feature to the sorted array of locations that have it, for FeatureIndex."""
+        location_numbers = np.repeat(np.arange(len(self), dtype=np.intp), np.diff(self.feature_offsets))
+        order = np.argsort(self.feature_ids, kind="stable")  # Stable sort keeps the locations sorted within a feature
+        feature_starts = np.searchsorted(self.feature_ids[order], np.arange(len(self.feature_vocabulary) + 1))
+        sorted_locations = location_numbers[order]
+        return {feature: sorted_locations[feature_starts[feature_id]:feature_starts[feature_id + 1]]
+                for feature_id, feature in enumerate(self.feature_vocabulary)}
+
+    def nbytes(self):
+        """Approximate memory used by the store's arrays."""
+        names_bytes = self.names.nbytes if pa is not None else sum(len(name) for name in self.names)
+        return names_bytes + self.coordinates.nbytes + self.feature_offsets.nbytes + self.feature_ids.nbytes
@@ -0,0 +1,167 @@
+"""Finds the nearest area_Interest polygon for every point without arcpy, giving the same NEAR_FID and NEAR_DIST columns
+as arcpy.analysis.Near. The polygons are put in a shapely STRtree that is built once in each worker process, and the
+points are streamed from the GeoParquet file and sent to the workers in chunks of coordinates. Points that fall inside
+a polygon are found first with a bounding box query and given a distance of 0 without a nearest search.
+
+python near_analysis.py gbif_points/raccoons_XY.parquet cb_2018_us_ua10_500k.shp raccoons_near.parquet --crs EPSG:5070
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from reprojection_store import ReprojectionStore
+
+_near_tree = None  # STRtree of the polygons, built once in each worker
+
+
+def _start_worker(polygons_wkb):
+    global _near_tree
+    _near_tree = shapely.STRtree(shapely.from_wkb(polygons_wkb))
+
+
+def near_chunk(coordinates, search_radius=None, tree=None):
+    """Returns the position of the nearest polygon and the distance to it for an (n, 2) array of x, y coordinates.
+    Points inside a polygon have a distance of 0, and points with no polygon within search_radius get -1 for both."""
+    tree = _near_tree if tree is None else tree
+    points = shapely.points(coordinates)
+    near_position = np.full(len(points), -1, dtype=np.int64)
+    near_distance = np.full(len(points), -1.0)
+    # The intersects query only runs the exact test for points inside a polygon's bounding box
+    point_numbers, polygon_numbers = tree.query(points, predicate="intersects")
+    point_numbers, first_match = np.unique(point_numbers, return_index=True)
+    near_position[point_numbers] = polygon_numbers[first_match]
+    near_distance[point_numbers] = 0.0
+    outside = np.flatnonzero(near_position == -1)
+    if len(outside):
+        (point_numbers, polygon_numbers), distances = tree.query_nearest(points[outside], max_distance=search_radius,
+                                                                         return_distance=True, all_matches=False)
+        near_position[outside[point_numbers]] = polygon_numbers
+        near_distance[outside[point_numbers]] = distances
+    return near_position, near_distance
+
+
+def _near_chunk_in_worker(coordinates, search_radius):
+    return near_chunk(coordinates, search_radius)
+
+
+def iter_near_chunks(chunks, polygons, search_radius=None, workers=None):
+    """Runs near_chunk over (item, coordinates) pairs from an iterable and yields (item, near position, near distance)
+    in the same order. Chunks are spread over a pool of processes, and only a couple of chunks per worker are read ahead,
+    so chunks streamed from a file never all have to be in memory. workers=1 runs them in this process instead."""
+    if workers == 1:
+        tree = shapely.STRtree(polygons)
+        for item, coordinates in chunks:
+            yield (item, *near_chunk(coordinates, search_radius, tree))
+        return
+    most_pending = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker,
+                             initargs=(shapely.to_wkb(polygons),)) as executor:
+        pending = deque()
+        for item, coordinates in chunks:
+            pending.append((item, executor.submit(_near_chunk_in_worker, coordinates, search_radius)))
+            if len(pending) >= most_pending:
+                item, result = pending.popleft()
+                yield (item, *result.result())
+        while pending:
+            item, result = pending.popleft()
+            yield (item, *result.result())
+
+
+def near_arrays(coordinates, polygons, search_radius=None, workers=None, chunk_size=250000):
+    """Runs near_chunk over all of the coordinates, splitting them into chunks that are spread over a pool of processes.
+    polygons is an array of shapely geometries in the same CRS as the coordinates. Returns the position of each point's
+    nearest polygon and the distance to it."""
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(coordinates) <= chunk_size:
+        workers = 1  # Starting a pool takes longer than a single chunk
+    chunks = ((None, coordinates[start:start + chunk_size]) for start in range(0, len(coordinates), chunk_size))
+    results = [result[1:] for result in iter_near_chunks(chunks, polygons, search_radius, workers)]
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+
+
+def geometry_column(parquet_file):
+    """Returns the name of a GeoParquet file's geometry column from its geo metadata."""
+    return json.loads(parquet_file.schema_arrow.metadata[b"geo"])["primary_column"]
+
+
+def near_analysis(points_path, area_Interest, output_path, working_crs=None, id_column=None, search_radius=None,
+                  workers=None, chunk_size=250000, store_folder=None):
+    """Adds NEAR_FID and NEAR_DIST to a GeoParquet point layer and writes it to output_path. Both layers are projected
+    to working_crs (area_Interest's CRS by default) through a ReprojectionStore so each is only projected once.
+    NEAR_FID is the nearest polygon's id_column value, or its OBJECTID style row number (starting at 1) without one,
+    and NEAR_DIST is in the linear unit of the working CRS, as with arcpy.analysis.Near. The points are read and
+    written chunk_size rows at a time, so the point layer can be larger than memory."""
+    import geopandas as gpd
+    start = time.perf_counter()
+    reprojection_store = ReprojectionStore(store_folder or os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                                                                        "projected"))
+    if working_crs is None:
+        if area_Interest.lower().endswith(".parquet"):
+            working_crs = gpd.read_parquet(area_Interest,
+                                           columns=[geometry_column(pq.ParquetFile(area_Interest))]).crs
+        else:
+            import pyogrio
+            working_crs = pyogrio.read_info(area_Interest)["crs"]  # Only reads the layer's header
+    if pyproj.CRS.from_user_input(working_crs).is_geographic:
+        raise ValueError(f"The working CRS, {working_crs}, is geographic. Choose a projected CRS so NEAR_DIST is a "
+                         f"distance instead of degrees.")
+    polygons = reprojection_store.read(area_Interest, working_crs)
+    polygon_ids = polygons[id_column].to_numpy() if id_column is not None else np.arange(1, len(polygons) + 1)
+    fid_type = pa.array(polygon_ids).type
+    points_file = pq.ParquetFile(reprojection_store.projected(points_path, working_crs))
+    if points_file.metadata.num_rows <= chunk_size:
+        workers = 1
+    points_geometry = geometry_column(points_file)
+    output_schema = points_file.schema_arrow.append(pa.field("NEAR_FID", fid_type)).append(
+        pa.field("NEAR_DIST", pa.float64()))
+    batches = ((batch, shapely.get_coordinates(shapely.from_wkb(
+        batch.column(points_geometry).to_numpy(zero_copy_only=False)))) for batch in points_file.iter_batches(chunk_size))
+    point_count = 0
+    inside_count = 0
+    with pq.ParquetWriter(output_path, output_schema) as output_writer:
+        for batch, near_position, near_distance in iter_near_chunks(batches, polygons.geometry.values, search_radius,
+                                                                   workers):
+            near_fid = polygon_ids[np.maximum(near_position, 0)] if len(polygon_ids) else near_position
+            if np.issubdtype(near_fid.dtype, np.integer):
+                near_fid = np.where(near_position >= 0, near_fid, -1)
+            else:
+                near_fid = near_fid.astype(object)  # Text ids are left empty instead of -1 when nothing is found
+                near_fid[near_position < 0] = None
+            output_batch = pa.RecordBatch.from_arrays(
+                batch.columns + [pa.array(near_fid, type=fid_type), pa.array(near_distance)], schema=output_schema)
+            output_writer.write_batch(output_batch)
+            point_count += len(near_position)
+            inside_count += np.count_nonzero(near_distance == 0)
+    elapsed = time.perf_counter() - start
+    print(f"Found the nearest of {len(polygons):,} polygons for {point_count:,} points in {elapsed:.1f} s "
+          f"({point_count / max(elapsed, 1e-9):,.0f} points/s), {inside_count:,} points are inside a polygon. "
+          f"Results were saved to {output_path}.")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the nearest area_Interest polygon for every point.")
+    parser.add_argument("points", help="GeoParquet point layer, such as one made by gbif_ingest.py.")
+    parser.add_argument("area_interest", help="Polygon layer (shapefile, GeoPackage, GeoJSON or GeoParquet).")
+    parser.add_argument("output")
+    parser.add_argument("--crs", default=None, help="Projected CRS to measure in. Defaults to the polygons' CRS.")
+    parser.add_argument("--id-column", default=None, help="Polygon column to use for NEAR_FID.")
+    parser.add_argument("--search-radius", type=float, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=250000)
+    arguments = parser.parse_args()
+    near_analysis(arguments.points, arguments.area_interest, arguments.output, arguments.crs, arguments.id_column,
+                  arguments.search_radius, arguments.workers, arguments.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Counts the points inside each area_Interest polygon and inside the parts of overlap_area left outside of it, without
+arcpy. This gives the same polygons and Join_Count as the PairwiseErase, Union, SpatialJoin and Polygon_Type steps in
+incident_union_poly, but each point is only looked at once. Both polygon layers are put in STRtrees, and points are
+read a row group at a time so the point layer never has to fit in memory.
+
+python polygon_summary.py raccoons_XY.parquet cities.shp counties.shp raccoons_union_with_Overlap.parquet --crs 2274
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import geopandas as gpd
+import shapely
+from reprojection_store import ReprojectionStore
+
+
+class PolygonSummary:
+    """Holds the Interior polygons (area_Interest) and Exterior polygons (overlap_area with area_Interest erased) and
+    counts points into them. A point that intersects an area_Interest polygon is counted for it, and only the points
+    that didn't are tested against overlap_area, so the erased overlap polygons are never needed for counting."""
+    def __init__(self, area_polygons, overlap_polygons=None):
+        self.area_polygons = np.asarray(area_polygons)
+        self.overlap_polygons = np.asarray(overlap_polygons) if overlap_polygons is not None else np.empty(0, object)
+        shapely.prepare(self.area_polygons)
+        shapely.prepare(self.overlap_polygons)
+        self.area_tree = shapely.STRtree(self.area_polygons)
+        self.overlap_tree = shapely.STRtree(self.overlap_polygons)
+        self.area_counts = np.zeros(len(self.area_polygons), dtype=np.int64)
+        self.overlap_counts = np.zeros(len(self.overlap_polygons), dtype=np.int64)
+        self.point_count = 0
+
+    def add_points(self, points):
+        """Adds an array of shapely points to the counts."""
+        self.point_count += len(points)
+        point_numbers, area_numbers = self.area_tree.query(points, predicate="intersects")
+        self.area_counts += np.bincount(area_numbers, minlength=len(self.area_polygons))
+        if len(self.overlap_polygons):
+            outside = np.ones(len(points), dtype=bool)
+            outside[point_numbers] = False
+            _, overlap_numbers = self.overlap_tree.query(points[outside], predicate="intersects")
+            self.overlap_counts += np.bincount(overlap_numbers, minlength=len(self.overlap_polygons))
+
+    def exterior_polygons(self):
+        """Erases area_Interest from each overlap polygon that it touches, like PairwiseErase."""
+        exterior = self.overlap_polygons.copy()
+        overlap_numbers, area_numbers = self.area_tree.query(self.overlap_polygons, predicate="intersects")
+        if len(overlap_numbers):
+            group_starts = np.flatnonzero(np.diff(overlap_numbers, prepend=-1))
+            for overlap_number, area_group in zip(overlap_numbers[group_starts], np.split(area_numbers, group_starts[1:])):
+                exterior[overlap_number] = shapely.difference(exterior[overlap_number],
+                                                              shapely.union_all(self.area_polygons[area_group]))
+        return exterior
+
+    def summary(self, area_attributes=None, overlap_attributes=None, area_name="area_Interest", crs=None):
+        """Returns a GeoDataFrame with one row per Interior and Exterior polygon with FID_Union_Layer, FID_<area_name>,
+        Join_Count and Polygon_Type, and the attributes of the layer each polygon came from. FID_Union_Layer is -1 for
+        Interior polygons, as in the Union output that Polygon_Type was read from."""
+        interior = pd.DataFrame(area_attributes).reset_index(drop=True) if area_attributes is not None \
+            else pd.DataFrame(index=range(len(self.area_polygons)))
+        interior.insert(0, "FID_Union_Layer", -1)
+        interior.insert(1, f"FID_{area_name}", np.arange(1, len(self.area_polygons) + 1))
+        interior["Join_Count"] = self.area_counts
+        interior["geometry"] = self.area_polygons
+        exterior = pd.DataFrame(overlap_attributes).reset_index(drop=True) if overlap_attributes is not None \
+            else pd.DataFrame(index=range(len(self.overlap_polygons)))
+        exterior = exterior.rename(columns={column: f"{column}_1" for column in exterior.columns
+                                            if column in interior.columns})
+        exterior.insert(0, "FID_Union_Layer", np.arange(1, len(self.overlap_polygons) + 1))
+        exterior.insert(1, f"FID_{area_name}", -1)
+        exterior["Join_Count"] = self.overlap_counts
+        exterior["geometry"] = self.exterior_polygons()
+        exterior = exterior[~shapely.is_empty(exterior["geometry"].to_numpy())]  # Fully covered polygons are dropped
+        summary = pd.concat([interior, exterior], ignore_index=True)
+        summary["Polygon_Type"] = np.where(summary["FID_Union_Layer"].to_numpy() == -1, "Interior Polygon",
+                                           "Exterior Polygon")
+        return gpd.GeoDataFrame(summary, geometry="geometry", crs=crs)
+
+
+def summarize_points(points_path, area_Interest, output_path, overlap_area="", working_crs=None, store_folder=None):
+    """Writes the Interior/Exterior summary of a GeoParquet point layer to output_path (.parquet or .gpkg). Without an
+    overlap_area only the area_Interest polygons are counted, like the noOverlap spatial join. All layers are projected
+    to working_crs (area_Interest's CRS by default) through a ReprojectionStore."""
+    start = time.perf_counter()
+    reprojection_store = ReprojectionStore(store_folder or os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                                                                        "projected"))
+    if working_crs is None:
+        import pyogrio
+        working_crs = gpd.read_parquet(area_Interest, columns=["geometry"]).crs \
+            if area_Interest.lower().endswith(".parquet") else pyogrio.read_info(area_Interest)["crs"]
+    areas = reprojection_store.read(area_Interest, working_crs)
+    overlaps = reprojection_store.read(overlap_area, working_crs) if overlap_area != "" else None
+    polygon_summary = PolygonSummary(areas.geometry.values,
+                                     overlaps.geometry.values if overlaps is not None else None)
+    points_file = pq.ParquetFile(reprojection_store.projected(points_path, working_crs))
+    for batch in points_file.iter_batches(columns=["geometry"]):
+        polygon_summary.add_points(shapely.from_wkb(batch.column(0).to_numpy(zero_copy_only=False)))
+    summary = polygon_summary.summary(areas.drop(columns=areas.geometry.name),
+                                      overlaps.drop(columns=overlaps.geometry.name) if overlaps is not None else None,
+                                      area_name=os.path.splitext(os.path.basename(area_Interest))[0],
+                                      crs=areas.crs)
+    if overlaps is None:
+        summary = summary.drop(columns=["FID_Union_Layer", "Polygon_Type"])
+    if output_path.lower().endswith(".parquet"):
+        summary.to_parquet(output_path)
+    else:
+        summary.to_file(output_path)
+    elapsed = time.perf_counter() - start
+    print(f"Summarized {polygon_summary.point_count:,} points into {len(summary):,} polygons in {elapsed:.1f} s "
+          f"({polygon_summary.point_count / max(elapsed, 1e-9):,.0f} points/s). Results were saved to {output_path}.")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count points in area_Interest and in the rest of overlap_area.")
+    parser.add_argument("points", help="GeoParquet point layer, such as one made by gbif_ingest.py.")
+    parser.add_argument("area_interest")
+    parser.add_argument("overlap_area", nargs="?", default="")
+    parser.add_argument("output", help="Output .parquet or .gpkg")
+    parser.add_argument("--crs", default=None, help="Projected CRS to work in. Defaults to area_interest's CRS.")
+    arguments = parser.parse_args()
+    summarize_points(arguments.points, arguments.area_interest, arguments.output, arguments.overlap_area,
+                     arguments.crs)
+
+
+if __name__ == "__main__":
+    main()
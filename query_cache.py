@@ -0,0 +1,74 @@
+import json
+import time
+import zlib
+import sqlite3
+
+
+class QueryCache:
+    """Stores the results of National Maps API queries in a SQLite file so a repeated query doesn't need to reach the
+    API. Entries older than ttl_seconds are treated as expired, and the least recently used entries are removed once the
+    stored results take up more than max_bytes."""
+    def __init__(self, cache_path, ttl_seconds=86400, max_bytes=268435456):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS query_cache ("
+                                "query_key TEXT PRIMARY KEY, "
+                                "created REAL NOT NULL, "
+                                "last_used REAL NOT NULL, "
+                                "size_in_bytes INTEGER NOT NULL, "
+                                "results BLOB NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS query_cache_last_used ON query_cache (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def query_key(dataset_name, data_type, start, end, bbox, bbox_decimals=5):
+        """Builds the cache key for a query. The dataset name is lowercased and the bbox is rounded so that the same area
+        typed with slightly different precision uses the same entry."""
+        rounded_bbox = [round(float(coordinate), bbox_decimals) for coordinate in bbox]
+        return json.dumps({"dataset": dataset_name.lower(),
+                           "dateType": data_type.lower(),
+                           "start": str(start),
+                           "end": str(end),
+                           "bbox": rounded_bbox}, sort_keys=True)
+
+    def get(self, query_key, allow_expired=False):
+        """Returns the cached results for a query, or None when the query isn't cached or has expired. Expired results
+        are still returned when allow_expired is True."""
+        row = self.connection.execute("SELECT created, results FROM query_cache WHERE query_key = ?",
+                                      (query_key,)).fetchone()
+        if row is None:
+            return None
+        created, results = row
+        if not allow_expired and self.ttl_seconds is not None and time.time() - created > self.ttl_seconds:
+            return None
+        self.connection.execute("UPDATE query_cache SET last_used = ? WHERE query_key = ?", (time.time(), query_key))
+        self.connection.commit()
+        return json.loads(zlib.decompress(results))
+
+    def put(self, query_key, results):
+        """Stores the results for a query and removes the least recently used entries if the cache is over its size."""
+        compressed_results = zlib.compress(json.dumps(results).encode("utf-8"))
+        now = time.time()
+        self.connection.execute("INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?)",
+                                (query_key, now, now, len(compressed_results), compressed_results))
+        self._evict()
+        self.connection.commit()
+
+    def _evict(self):
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size_in_bytes), 0) FROM query_cache").fetchone()[0]
+        if self.max_bytes is None or total_size <= self.max_bytes:
+            return
+        expired_keys = []
+        for query_key, size_in_bytes in self.connection.execute(
+                "SELECT query_key, size_in_bytes FROM query_cache ORDER BY last_used ASC"):
+            if total_size <= self.max_bytes:
+                break
+            expired_keys.append((query_key,))
+            total_size -= size_in_bytes
+        self.connection.executemany("DELETE FROM query_cache WHERE query_key = ?", expired_keys)
+
+    def clear(self):
+        self.connection.execute("DELETE FROM query_cache")
+        self.connection.commit()
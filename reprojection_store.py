@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pyproj
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+import geopandas as gpd
+from gbif_manifest import file_fingerprint
+
+
+def crs_id(target_crs):
+    """Short name used in the store for a CRS, the EPSG code when there is one and otherwise a hash of its WKT."""
+    target_crs = pyproj.CRS.from_user_input(target_crs)
+    epsg_code = target_crs.to_epsg()
+    if epsg_code is not None:
+        return f"EPSG_{epsg_code}"
+    return "WKT_" + hashlib.sha256(target_crs.to_wkt().encode("utf-8")).hexdigest()[:16]
+
+
+class ReprojectionStore:
+    """Keeps one copy of each dataset in each working CRS that a pipeline asks for. Copies are keyed on the source
+    file's content (its sha256), the layer read from it and the target CRS, so a dataset is only reprojected once no matter how many steps
+    use it or what it is named, and an edited source gets a new copy. The spatial reference, bounds and row count of
+    each copy are stored in the store's index, so checking the CRS or extent of a dataset doesn't read the data.
+    Copies are written as GeoParquet in store_folder."""
+    def __init__(self, store_folder):
+        self.store_folder = store_folder
+        self.index_path = os.path.join(store_folder, "reprojection_index.json")
+        self.sources = {}
+        self.datasets = {}
+        self.loaded = {}  # Datasets already read in this process, handed back without reading them again
+        os.makedirs(store_folder, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.sources = index["sources"]
+            self.datasets = index["datasets"]
+
+    def dataset_key(self, source_path, target_crs, layer=None):
+        """Returns the (source fingerprint, layer, target CRS) key of a dataset, only hashing the source if it changed.
+        The layer is left out when there isn't one, as with GeoParquet sources."""
+        source_path = os.path.abspath(source_path)
+        fingerprint = file_fingerprint(source_path, self.sources.get(source_path))
+        self.sources[source_path] = fingerprint
+        if layer is None:
+            return f"{fingerprint['sha256'][:32]}_{crs_id(target_crs)}"
+        return f"{fingerprint['sha256'][:32]}_{re.sub(r'[^0-9A-Za-z_]', '_', str(layer))}_{crs_id(target_crs)}"
+
+    def metadata(self, source_path, target_crs, layer=None):
+        """Returns the stored metadata of a dataset in the target CRS (path, crs, crs_wkt, bounds, rows, layer), or None
+        when it hasn't been made yet."""
+        record = self.datasets.get(self.dataset_key(source_path, target_crs, layer))
+        if record is None or not os.path.exists(record["path"]):
+            return None
+        return record
+
+    def crs_matches(self, source_path, target_crs, layer=None):
+        """Checks if a dataset's stored copy is in the target CRS without opening it."""
+        record = self.metadata(source_path, target_crs, layer)
+        return record is not None and pyproj.CRS.from_wkt(record["crs_wkt"]) == pyproj.CRS.from_user_input(target_crs)
+
+    def projected(self, source_path, target_crs, layer=None):
+        """Returns the path to the dataset in the target CRS, reprojecting the source the first time it is asked for.
+        A GeoParquet source that is already in the target CRS is used as it is instead of being copied."""
+        dataset_key = self.dataset_key(source_path, target_crs, layer)
+        record = self.metadata(source_path, target_crs, layer)
+        if record is not None:
+            return record["path"]
+        target_crs = pyproj.CRS.from_user_input(target_crs)
+        if source_path.lower().endswith(".parquet"):
+            record = self._project_parquet(source_path, target_crs, dataset_key)
+        else:
+            source = gpd.read_file(source_path, layer=layer)
+            if source.crs is None:
+                raise ValueError(f"{source_path} doesn't have a spatial reference and can't be reprojected.")
+            output_path = os.path.join(self.store_folder, dataset_key + ".parquet")
+            projected = source.to_crs(target_crs)
+            projected.to_parquet(output_path)
+            record = self._record(output_path, target_crs, projected.total_bounds, len(projected))
+        record["source"] = os.path.abspath(source_path)
+        record["layer"] = layer
+        self.datasets[dataset_key] = record
+        self.save()
+        return record["path"]
+
+    def read(self, source_path, target_crs, columns=None, layer=None):
+        """Returns the dataset in the target CRS as a GeoDataFrame. The same dataset asked for twice in one process is
+        only read once."""
+        path = self.projected(source_path, target_crs, layer=layer)
+        memo_key = (path, tuple(columns) if columns is not None else None)
+        if memo_key not in self.loaded:
+            self.loaded[memo_key] = gpd.read_parquet(path, columns=columns)
+        return self.loaded[memo_key]
+
+    def _project_parquet(self, source_path, target_crs, dataset_key):
+        # Row groups are projected one at a time so a large point file doesn't have to fit in memory
+        source_file = pq.ParquetFile(source_path)
+        geo_metadata = json.loads(source_file.schema_arrow.metadata[b"geo"])
+        geometry_column = geo_metadata["primary_column"]
+        source_crs = pyproj.CRS.from_json_dict(geo_metadata["columns"][geometry_column]["crs"]) \
+            if geo_metadata["columns"][geometry_column].get("crs") is not None else pyproj.CRS.from_epsg(4326)
+        if source_crs == target_crs:
+            bounds = geo_metadata["columns"][geometry_column].get("bbox")
+            if bounds is None:
+                bounds = gpd.read_parquet(source_path, columns=[geometry_column]).total_bounds
+            return self._record(os.path.abspath(source_path), target_crs, bounds, source_file.metadata.num_rows)
+        output_path = os.path.join(self.store_folder, dataset_key + ".parquet")
+        geo_metadata["columns"][geometry_column]["crs"] = target_crs.to_json_dict()
+        schema = source_file.schema_arrow.with_metadata({**source_file.schema_arrow.metadata,
+                                                         b"geo": json.dumps(geo_metadata)})
+        bounds = np.array([np.inf, np.inf, -np.inf, -np.inf])
+        parquet_writer = None
+        try:
+            for row_group in range(source_file.num_row_groups):
+                table = source_file.read_row_group(row_group)
+                geometry_index = table.schema.get_field_index(geometry_column)
+                projected = gpd.GeoSeries.from_wkb(table.column(geometry_index).to_numpy(zero_copy_only=False),
+                                                   crs=source_crs).to_crs(target_crs)
+                if len(projected):
+                    row_group_bounds = projected.total_bounds
+                    bounds = np.concatenate([np.minimum(bounds[:2], row_group_bounds[:2]),
+                                             np.maximum(bounds[2:], row_group_bounds[2:])])
+                table = table.set_column(geometry_index, geometry_column,
+                                         pa.array(shapely.to_wkb(projected.values), type=pa.binary()))
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(output_path, schema)
+                parquet_writer.write_table(table.cast(schema))
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+        if parquet_writer is None:
+            raise ValueError(f"{source_path} doesn't have any rows to reproject.")
+        return self._record(output_path, target_crs, bounds, source_file.metadata.num_rows)
+
+    @staticmethod
+    def _record(path, target_crs, bounds, rows):
+        return {"path": path,
+                "crs": crs_id(target_crs),
+                "crs_wkt": target_crs.to_wkt(),
+                "linear_unit": target_crs.axis_info[0].unit_name if target_crs.axis_info else None,
+                "bounds": [float(value) for value in bounds],
+                "rows": int(rows)}
+
+    def save(self):
+        """Writes the index to a temporary file first and swaps it in, so a crash can't leave a half written file."""
+        with tempfile.NamedTemporaryFile("w", dir=self.store_folder, delete=False, suffix=".tmp") as f:
+            json.dump({"sources": self.sources, "datasets": self.datasets}, f, indent=4)
+        os.replace(f.name, self.index_path)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from aggregation_pyramid import AggregationPyramid
+
+
+def random_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"x": rng.uniform(-3000, 3000, count), "y": rng.uniform(-3000, 3000, count),
+                         "year": rng.choice([2019, 2020, np.nan], count),
+                         "category": rng.choice(["theft", "assault", "fraud"], count)})
+
+
+def clipped_counts(points, polygon, by):
+    inside = points[shapely.intersects_xy(polygon, points["x"].to_numpy(), points["y"].to_numpy())]
+    inside = inside.assign(year=inside["year"].fillna(-1).astype(np.int16), hour=np.int8(-1))
+    return inside.groupby(by).size().rename("count").reset_index().sort_values(by, ignore_index=True)
+
+
+def test_summaries_match_clipping_after_adding_points_twice_and_reloading(tmp_path):
+    first = random_points(4000, seed=1)
+    second = random_points(3000, seed=2)
+    pyramid = AggregationPyramid(cell_size=100, levels=5)
+    pyramid.add_points(first["x"], first["y"], first["year"], None, first["category"])
+    pyramid.add_points(second["x"], second["y"], second["year"], None, second["category"])
+    pyramid.save(str(tmp_path / "pyramid"))
+    reloaded = AggregationPyramid.load(str(tmp_path / "pyramid"))
+    points = pd.concat([first, second], ignore_index=True)
+    polygons = [shapely.Point(120, -340).buffer(1700), shapely.box(-2999, -2999, 2999, 2999),
+                shapely.Polygon([(-2500, -100), (2200, -2600), (900, 2400)])]
+    for polygon in polygons:
+        for by in (["year"], ["category", "year"]):
+            expected = clipped_counts(points, polygon, by)
+            for summarized in (pyramid, reloaded):
+                summary = summarized.summarize(polygon, by)
+                pd.testing.assert_frame_equal(summary.astype({"count": np.int64}), expected.astype({"count": np.int64}),
+                                              check_dtype=False)
+    assert np.all(np.diff(reloaded.points["cell_key"]) >= 0)
+    assert reloaded.counts[0]["count"].sum() == len(points)
+
+
+def test_bad_levels_and_coordinates_are_refused():
+    with pytest.raises(ValueError):
+        AggregationPyramid(cell_size=100, levels=0)
+    pyramid = AggregationPyramid(cell_size=100, levels=3)
+    with pytest.raises(ValueError):
+        pyramid.add_points([1.0, np.nan], [1.0, 2.0])
+    with pytest.raises(ValueError):
+        pyramid.add_points([1.0], [np.inf])
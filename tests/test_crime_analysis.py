@@ -0,0 +1,12 @@
+import pandas as pd
+import crime_analysis
+from crime_benchmark import synthetic_incidents
+
+
+def test_cube_tables_match_notebook_groupbys():
+    incidents, park = synthetic_incidents(30000, seed=1)
+    expected = crime_analysis.notebook_tables(incidents, park)
+    tables = crime_analysis.CrimeCube.from_incidents(incidents, park.geometry.values).tables()
+    for name, expected_table in expected.items():
+        # The cube keeps years as int16, so only the dtypes differ from the notebook's tables
+        pd.testing.assert_frame_equal(tables[name], expected_table, check_dtype=False, check_index_type=False)
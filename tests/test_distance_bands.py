@@ -0,0 +1,67 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from distance_bands import DistanceBands, assign_bands, assign_park_bands, band_codes, units_per_mile
+
+CRS = "EPSG:2274"
+HALF_MILE = 0.5 * units_per_mile(CRS)
+
+
+def two_parks():
+    # Two parks 200 ft apart with the origin halfway between them
+    return gpd.GeoDataFrame({"Name": ["Overton", "Tom Lee"]},
+                            geometry=[shapely.box(-200, -100, -100, 100), shapely.box(100, -100, 200, 100)], crs=CRS)
+
+
+def test_band_codes_at_the_breakpoints():
+    breakpoints = np.array([HALF_MILE, 4 * HALF_MILE])
+    codes = band_codes(np.array([0, 1, HALF_MILE, np.nextafter(HALF_MILE, np.inf), 4 * HALF_MILE, 5 * HALF_MILE]),
+                       breakpoints)
+    assert codes.tolist() == [0, 1, 1, 2, 2, 3]
+
+
+def test_assign_bands_inside_ties_and_breakpoints():
+    parks = two_parks()
+    distance_bands = DistanceBands(parks.geometry.values, crs=CRS)
+    # Inside the first park, halfway between the parks, exactly 0.5 mi past the second park and past 2 miles
+    incidents = gpd.GeoDataFrame(geometry=gpd.points_from_xy([-150, 0, 200 + distance_bands.breakpoints[0], 20000],
+                                                             [0, 0, 0, 0]), crs=CRS)
+    banded = assign_bands(incidents, parks, park_id_column="Name", keep_outside=True)
+    assert banded["NEAR_PARK"].tolist() == ["Overton", "Overton", "Tom Lee", "Tom Lee"]
+    assert banded["PARK_DIST"].tolist() == [0, 100, distance_bands.breakpoints[0], 19800]
+    assert banded["DIST_BAND"].astype(object).tolist()[:3] == ["inside", "0-0.5 mi", "0-0.5 mi"]
+    assert banded["DIST_BAND"].isna().tolist() == [False, False, False, True]
+    assert len(assign_bands(incidents, parks)) == 3
+
+
+def test_nearest_matches_query_nearest():
+    rng = np.random.default_rng(3)
+    parks = shapely.buffer(shapely.points(rng.uniform(0, 50000, (40, 2))), rng.uniform(50, 800, 40))
+    points = shapely.points(rng.uniform(-5000, 55000, (3000, 2)))
+    distance_bands = DistanceBands(parks, breakpoints_mi=(0.25, 1), crs=CRS)
+    near_park, near_distance, codes = distance_bands.nearest(points, chunk_size=700, fill_outside=True)
+    (point_numbers, park_numbers), distances = distance_bands.tree.query_nearest(points, return_distance=True,
+                                                                                all_matches=False)
+    assert np.array_equal(point_numbers, np.arange(len(points)))
+    np.testing.assert_allclose(near_distance, distances)
+    np.testing.assert_allclose(shapely.distance(points, parks[near_park]), distances)
+    assert np.array_equal(codes, band_codes(distances, distance_bands.breakpoints))
+    outside_park, outside_distance, _ = distance_bands.nearest(points)
+    beyond = distances > distance_bands.breakpoints[-1]
+    assert beyond.any() and np.all(outside_park[beyond] == -1) and np.all(np.isinf(outside_distance[beyond]))
+    np.testing.assert_allclose(outside_distance[~beyond], distances[~beyond])
+
+
+def test_assign_park_bands_counts_every_pair():
+    rng = np.random.default_rng(5)
+    parks = gpd.GeoDataFrame(geometry=shapely.buffer(shapely.points(rng.uniform(0, 20000, (15, 2))), 300), crs=CRS)
+    incidents = gpd.GeoDataFrame(geometry=shapely.points(rng.uniform(0, 20000, (2000, 2))), crs=CRS,
+                                 index=np.arange(2000) + 100)
+    pairs = assign_park_bands(incidents, parks)
+    distances = shapely.distance(np.asarray(incidents.geometry)[:, None], np.asarray(parks.geometry)[None, :])
+    within = distances <= 2 * units_per_mile(CRS)
+    assert len(pairs) == within.sum()
+    assert np.array_equal(pairs.groupby("park").size().reindex(range(len(parks)), fill_value=0).to_numpy(),
+                          within.sum(axis=0))
+    assert pairs["incident"].min() >= 100
+    assert (pairs["DIST_BAND"] == "inside").sum() == (distances == 0).sum()
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import download_engine
+from NationalMaps_APIAccess import NationalMAP_API
+
+PAYLOAD = bytes(range(256)) * 400  # 102,400 bytes
+FILES = {"/data.bin": PAYLOAD, "/2019/tile.zip": b"2019" * 1000, "/2021/tile.zip": b"2021" * 1500}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves FILES with Range support, like the TNM download servers, and 404s everything else."""
+    range_headers = []
+
+    def do_GET(self):
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        payload = FILES[self.path]
+        range_header = self.headers.get("Range")
+        RangeHandler.range_headers.append(range_header)
+        if range_header is None:
+            self.send_response(200)
+            body = payload
+        else:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(payload)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+            body = payload[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    RangeHandler.range_headers = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_part_file_is_resumed_with_range(server_url, tmp_path):
+    path = str(tmp_path / "data.bin")
+    with open(path + ".part", "wb") as f:
+        f.write(PAYLOAD[:40000])
+    size, checksum = download_engine.stream_download(requests.Session(), f"{server_url}/data.bin", path, len(PAYLOAD),
+                                                     chunk_size=8192)
+    assert RangeHandler.range_headers == ["bytes=40000-"]
+    assert size == len(PAYLOAD)
+    assert checksum == hashlib.sha256(PAYLOAD).hexdigest()
+    assert open(path, "rb").read() == PAYLOAD
+    assert not os.path.exists(path + ".part")
+
+
+def test_416_restarts_the_download(server_url, tmp_path):
+    path = str(tmp_path / "data.bin")
+    with open(path + ".part", "wb") as f:
+        f.write(b"x" * (len(PAYLOAD) + 10))  # Longer than the file on the server, which answers 416
+    size, checksum = download_engine.stream_download(requests.Session(), f"{server_url}/data.bin", path)
+    assert RangeHandler.range_headers == [f"bytes={len(PAYLOAD) + 10}-", None]
+    assert size == len(PAYLOAD)
+    assert checksum == hashlib.sha256(PAYLOAD).hexdigest()
+    assert open(path, "rb").read() == PAYLOAD
+
+
+def test_failed_downloads_are_logged(server_url, tmp_path):
+    national_map = NationalMAP_API([-90.1, 35.1, -90.0, 35.2], str(tmp_path), str(tmp_path), query_cache=False)
+    api_query = [{"title": "Good tile", "sourceId": "good", "downloadURL": f"{server_url}/data.bin",
+                  "sizeInBytes": len(PAYLOAD), "boundingBox": {"minX": -90.1, "minY": 35.1, "maxX": -90.0, "maxY": 35.2}},
+                 {"title": "Missing tile", "sourceId": "missing", "downloadURL": f"{server_url}/missing.bin",
+                  "sizeInBytes": 10, "boundingBox": {"minX": -90.1, "minY": 35.1, "maxX": -90.0, "maxY": 35.2}}]
+    national_map.dataset_download(api_query, override_confirmation=True)
+    assert open(tmp_path / "data.bin", "rb").read() == PAYLOAD
+    error_log = open(tmp_path / "error_log.txt").read()
+    assert "Missing tile" in error_log and "missing.bin" in error_log and "Good tile" not in error_log
+    assert national_map.ledger.entries["good"]["state"] == "complete"
+    assert national_map.ledger.entries["missing"]["state"] == "failed"
+
+
+def test_entries_with_the_same_file_name_get_their_own_paths(server_url, tmp_path):
+    national_map = NationalMAP_API([-90.1, 35.1, -90.0, 35.2], str(tmp_path), str(tmp_path), query_cache=False)
+    bounding_box = {"minX": -90.1, "minY": 35.1, "maxX": -90.0, "maxY": 35.2}
+    api_query = [{"title": f"Tile {year}", "sourceId": f"tile{year}", "downloadURL": f"{server_url}/{year}/tile.zip",
+                  "sizeInBytes": len(FILES[f"/{year}/tile.zip"]), "boundingBox": bounding_box}
+                 for year in (2019, 2021, 2021)]  # The 2021 entry is listed twice
+    national_map.dataset_download(api_query, override_confirmation=True)
+    assert open(tmp_path / "tile2019_tile.zip", "rb").read() == FILES["/2019/tile.zip"]
+    assert open(tmp_path / "tile2021_tile.zip", "rb").read() == FILES["/2021/tile.zip"]
+    assert not (tmp_path / "tile.zip").exists()
+
+
+def test_bandwidth_limiter_caps_throughput(server_url, tmp_path):
+    max_bytes_per_second = 200000
+    start = time.monotonic()
+    results = list(download_engine.download_files([(f"{server_url}/data.bin", str(tmp_path / "data.bin"), None)],
+                                                  chunk_size=8192, max_bytes_per_second=max_bytes_per_second,
+                                                  report_every=60))
+    elapsed = time.monotonic() - start
+    assert results[0][2] is None
+    # Even a download smaller than one second's worth of bytes has to wait for the limit
+    assert len(PAYLOAD) / elapsed <= max_bytes_per_second * 1.1
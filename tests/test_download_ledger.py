@@ -0,0 +1,24 @@
+import json
+from download_ledger import DownloadLedger
+from NationalMaps_APIAccess import NationalMAP_API
+
+
+def test_old_json_log_is_imported_on_first_use(tmp_path):
+    data_folder = tmp_path / "data"
+    log_folder = tmp_path / "logs"
+    data_folder.mkdir()
+    log_folder.mkdir()
+    (data_folder / "tile_a.zip").write_bytes(b"a" * 100)
+    old_log = [{"title": "Tile A", "sourceId": "a", "downloadURL": "https://example.com/files/tile_a.zip"},
+               {"title": "Tile B", "sourceId": "b", "downloadURL": "https://example.com/files/tile_b.zip"}]
+    (log_folder / "downloads_logs.json").write_text(json.dumps(old_log))
+
+    national_map = NationalMAP_API([-90.1, 35.1, -90.0, 35.2], str(data_folder), str(log_folder), query_cache=False)
+    assert national_map.ledger.is_complete(old_log[0], str(data_folder / "tile_a.zip"), verify_checksum=True)
+    assert not national_map.ledger.is_complete(old_log[1], str(data_folder / "tile_b.zip"))
+
+    # The ledger now exists, so the old log isn't imported a second time
+    ledger = DownloadLedger(str(log_folder / "downloads_ledger.jsonl"))
+    assert list(ledger.entries) == ["a"]
+    NationalMAP_API([-90.1, 35.1, -90.0, 35.2], str(data_folder), str(log_folder), query_cache=False)
+    assert len((log_folder / "downloads_ledger.jsonl").read_text().splitlines()) == 1
@@ -0,0 +1,27 @@
+import pyarrow.parquet as pq
+from gbif_ingest import convert_gbif_folder, parquet_schema
+from gbif_manifest import ProcessingManifest
+
+HEADER = "gbifID\tspecies\tdecimalLatitude\tdecimalLongitude\tyear\tmonth\tday\n"
+
+
+def test_bad_dates_are_left_missing_and_empty_files_get_a_layer(tmp_path):
+    incident_folder = tmp_path / "csv"
+    incident_folder.mkdir()
+    (incident_folder / "empty.csv").write_text(HEADER + "9\tA\tbad\t-90\t2020\t1\t1\n")
+    (incident_folder / "dates.csv").write_text(HEADER +
+                                               "1\tA\t35.1\t-90.0\t2020\t3.0\t1\n"
+                                               "2\tA\t35.1\t-90.0\t2020.5\t3.5\t1\n"
+                                               "3\tA\t35.1\t-90.0\t99999\t13x\t300\n")
+    output_folder = tmp_path / "points"
+    convert_gbif_folder(str(incident_folder), str(output_folder), workers=1)
+    dates = pq.read_table(output_folder / "dates_XY.parquet").to_pandas()
+    assert dates["year"].tolist()[0] == 2020 and dates["year"].isna().tolist() == [False, True, True]
+    assert dates["month"].tolist()[0] == 3 and dates["month"].isna().tolist() == [False, True, True]
+    assert dates["day"].isna().tolist() == [False, False, True]
+    empty = pq.read_table(output_folder / "empty_XY.parquet")
+    assert empty.num_rows == 0
+    assert empty.schema.equals(parquet_schema(), check_metadata=True)
+    assert pq.read_schema(output_folder / "dates_XY.parquet").equals(parquet_schema(), check_metadata=True)
+    manifest = ProcessingManifest(str(output_folder / "gbif_manifest.json"))
+    assert manifest.outputs(str(incident_folder / "empty.csv"), "convert") == [str(output_folder / "empty_XY.parquet")]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from gbif_thinning import bin_keys, occurrence_day, thin_occurrences
+
+
+def gbif_chunk(dates):
+    """Occurrences of one species in one grid cell, typed like the columns gbif_ingest.py writes."""
+    return pd.DataFrame({"species": ["Procyon lotor"] * len(dates),
+                         "decimalLongitude": np.full(len(dates), -89.9512),
+                         "decimalLatitude": np.full(len(dates), 35.1234),
+                         "year": pd.array([date[0] for date in dates], dtype="Int16"),
+                         "month": pd.array([date[1] for date in dates], dtype="Int8"),
+                         "day": pd.array([date[2] for date in dates], dtype="Int8")})
+
+
+def test_missing_and_pre_1970_dates():
+    chunk = gbif_chunk([(2020, 5, 1), (None, 5, 1), (1950, 5, None), (1900, 1, 1), (1950, 6, 15), (1969, 12, 31),
+                        (2021, 2, 30)])
+    day_numbers, dated = occurrence_day(chunk["year"], chunk["month"], chunk["day"])
+    assert dated.tolist() == [True, False, False, True, True, True, False]
+    assert day_numbers[[0, 3, 4, 5]].tolist() == [18383, -25567, -7140, -1]
+    keys = bin_keys(chunk, time_window_days=7)
+    # The undated rows share a bin, and each pre-1970 date gets its own bin apart from the undated ones
+    assert keys[1] == keys[2] == keys[6]
+    assert len({keys[0], keys[1], keys[3], keys[4], keys[5]}) == 5
+
+
+def test_thinning_keeps_dated_and_undated_bins_apart(tmp_path):
+    chunk = gbif_chunk([(1950, 6, 15), (1950, 6, 16), (None, None, None), (1900, 1, 1), (None, 3, 2), (1969, 12, 31),
+                        (2020, 5, 1), (2020, 5, 3)])
+    input_path = str(tmp_path / "raccoons_XY.parquet")
+    output_path = str(tmp_path / "raccoons_thinned.parquet")
+    chunk.to_parquet(input_path, index=False)
+    rows_read, rows_written = thin_occurrences(input_path, output_path, time_window_days=7, batch_size=3)
+    thinned = pq.read_table(output_path).to_pandas()
+    assert (rows_read, rows_written) == (8, 5)
+    counts = {(None if pd.isna(year) else int(year)): multiplicity
+              for year, multiplicity in zip(thinned["year"], thinned["multiplicity"])}
+    assert counts == {1950: 2, None: 2, 1900: 1, 1969: 1, 2020: 2}
@@ -0,0 +1,22 @@
+import os
+import geopandas as gpd
+import pandas as pd
+from polygon_summary import summarize_points
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def test_counts_match_incident_union_poly(tmp_path):
+    # union_with_Overlap_counts.csv holds the Join_Count of each polygon made by incident_union_poly's PairwiseErase,
+    # Union and SpatialJoin steps for these layers in EPSG:2274, computed with the matching geopandas overlay and
+    # spatial join since arcpy isn't available to the tests
+    points_path = str(tmp_path / "union_points.parquet")
+    gpd.read_file(os.path.join(DATA, "union_points.geojson")).to_parquet(points_path)
+    summary = summarize_points(points_path, os.path.join(DATA, "union_area_interest.geojson"),
+                               str(tmp_path / "union_with_Overlap.parquet"),
+                               overlap_area=os.path.join(DATA, "union_overlap_area.geojson"), working_crs=2274,
+                               store_folder=str(tmp_path / "projected"))
+    expected = pd.read_csv(os.path.join(DATA, "union_with_Overlap_counts.csv"))
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(pd.DataFrame(summary[columns]).sort_values(columns).reset_index(drop=True),
+                                  expected.sort_values(columns).reset_index(drop=True), check_dtype=False)
@@ -0,0 +1,25 @@
+import geopandas as gpd
+import pyproj
+from shapely.geometry import Point
+from reprojection_store import ReprojectionStore
+
+
+def test_each_layer_of_a_geopackage_gets_its_own_copy(tmp_path):
+    source_path = str(tmp_path / "layers.gpkg")
+    gpd.GeoDataFrame({"name": ["park"]}, geometry=[Point(-90.0, 35.1)], crs="EPSG:4326").to_file(
+        source_path, layer="parks")
+    gpd.GeoDataFrame({"name": ["school", "library"]}, geometry=[Point(-89.9, 35.2), Point(-89.8, 35.3)],
+                     crs="EPSG:4326").to_file(source_path, layer="schools")
+    store = ReprojectionStore(str(tmp_path / "projected"))
+    parks = store.read(source_path, "EPSG:2274", layer="parks")
+    schools = store.read(source_path, "EPSG:2274", layer="schools")
+    assert parks["name"].tolist() == ["park"]
+    assert schools["name"].tolist() == ["school", "library"]
+    assert schools.crs == pyproj.CRS.from_epsg(2274)
+    # The index kept from the first store is used by a new one without reprojecting either layer again
+    reopened = ReprojectionStore(str(tmp_path / "projected"))
+    assert reopened.metadata(source_path, "EPSG:2274", layer="parks")["rows"] == 1
+    assert reopened.metadata(source_path, "EPSG:2274", layer="schools")["layer"] == "schools"
+    assert reopened.crs_matches(source_path, "EPSG:2274", layer="schools")
+    assert reopened.projected(source_path, "EPSG:2274", layer="parks") != \
+        reopened.projected(source_path, "EPSG:2274", layer="schools")
@@ -0,0 +1,68 @@
+import shapely
+from shapely import STRtree
+from shapely.geometry import box
+
+
+def entry_footprints(json_result):
+    """Builds a shapely box for each entry from the boundingBox field returned by the National Maps API."""
+    return [box(entry["boundingBox"]["minX"], entry["boundingBox"]["minY"],
+                entry["boundingBox"]["maxX"], entry["boundingBox"]["maxY"]) for entry in json_result]
+
+
+def _priority_order(json_result, candidates, order):
+    if order == "newest":
+        return sorted(candidates, key=lambda i: (json_result[i].get("publicationDate") or "",
+                                                 json_result[i].get("lastUpdated") or ""), reverse=True)
+    elif order == "smallest":
+        return sorted(candidates, key=lambda i: json_result[i].get("sizeInBytes") or 0)
+    else:
+        raise ValueError(f"The order, {order}, isn't supported. Use 'newest' or 'smallest'.")
+
+
+def _uncovered_area(index, clipped_tiles, tree, chosen):
+    """Area of a tile that isn't covered by the other chosen tiles around it. Only the tiles that touch it are unioned,
+    so the check stays local no matter how many tiles were chosen."""
+    neighbors = [int(i) for i in tree.query(clipped_tiles[index], predicate="intersects")
+                 if i != index and int(i) in chosen]
+    if len(neighbors) == 0:
+        return clipped_tiles[index].area
+    covered = shapely.union_all([clipped_tiles[i] for i in neighbors])
+    return clipped_tiles[index].difference(covered).area
+
+
+def select_tiles(json_result, area_of_interest, order="newest", min_new_area=0.001):
+    """Chooses a small set of entries that covers the area of interest. Entries that only touch the area's edge are
+    dropped, then entries are taken in priority order ("newest" publication first or "smallest" download first) and
+    kept only when they cover more than min_new_area (a fraction of the area of interest) that earlier entries missed.
+    A last pass removes entries that later choices made redundant. Returns the chosen entries and a report of the
+    coverage and bytes saved."""
+    footprints = entry_footprints(json_result)
+    tree = STRtree(footprints)
+    area_threshold = area_of_interest.area * min_new_area
+    clipped_tiles = {}
+    for i in tree.query(area_of_interest, predicate="intersects"):
+        clipped_tile = footprints[i].intersection(area_of_interest)
+        if clipped_tile.area > 0:
+            clipped_tiles[int(i)] = clipped_tile
+
+    chosen = set()
+    ordered_candidates = _priority_order(json_result, list(clipped_tiles), order)
+    for i in ordered_candidates:
+        if _uncovered_area(i, clipped_tiles, tree, chosen) > area_threshold:
+            chosen.add(i)
+    for i in reversed(ordered_candidates):  # Lowest priority entries are removed first
+        if i in chosen and _uncovered_area(i, clipped_tiles, tree, chosen) <= area_threshold:
+            chosen.discard(i)
+
+    selected = [json_result[i] for i in sorted(chosen)]
+    covered_area = shapely.union_all([clipped_tiles[i] for i in chosen]).area if chosen else 0
+    total_bytes = sum(entry.get("sizeInBytes") or 0 for entry in json_result)
+    selected_bytes = sum(entry.get("sizeInBytes") or 0 for entry in selected)
+    report = {"Entries Found": len(json_result),
+              "Entries Intersecting": len(clipped_tiles),
+              "Entries Selected": len(selected),
+              "Coverage Percent": 100 * covered_area / area_of_interest.area if area_of_interest.area else 0,
+              "Total Bytes": total_bytes,
+              "Selected Bytes": selected_bytes,
+              "Bytes Saved": total_bytes - selected_bytes}
+    return selected, report